@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# just enough DER to read (and write) the keys, CSRs and certificates the acme clients handle
+import base64, binascii, calendar, re, time
+
+SEQUENCE, SET, INTEGER, BIT_STRING, OCTET_STRING, NULL, OID = 0x30, 0x31, 0x02, 0x03, 0x04, 0x05, 0x06
+UTF8_STRING, PRINTABLE_STRING, T61_STRING, IA5_STRING, UNIVERSAL_STRING, BMP_STRING = 0x0c, 0x13, 0x14, 0x16, 0x1c, 0x1e
+UTC_TIME, GENERALIZED_TIME = 0x17, 0x18
+
+PEM_RE = re.compile(r"-----BEGIN ([A-Z0-9 ]+)-----(.*?)-----END \1-----", re.DOTALL)
+
+
+def pem_blocks(data):
+    """yield (label, headers, der) for every PEM block in data"""
+    if isinstance(data, bytes):
+        data = data.decode('utf8', 'replace')
+    for label, body in PEM_RE.findall(data):
+        headers, _, b64 = body.strip().rpartition("\n\n")
+        if ":" not in headers:
+            headers, b64 = "", body
+        yield label, headers, base64.b64decode(re.sub(r"\s", "", b64))
+
+
+def int_from_bytes(b):
+    return int(binascii.hexlify(b), 16) if b else 0
+
+
+def int_to_bytes(i, length=None):
+    h = "{0:x}".format(i)
+    if length is None:
+        length = (len(h) + 1) // 2
+    return binascii.unhexlify(h.zfill(length * 2))
+
+
+def read_tlv(der, offset=0):
+    """return (tag, content_start, content_end) of the element at offset"""
+    der = bytearray(der)
+    tag = der[offset]
+    length = der[offset + 1]
+    offset += 2
+    if length & 0x80:
+        size = length & 0x7f
+        if not size or offset + size > len(der):
+            raise ValueError("Unsupported DER length encoding")
+        length = int_from_bytes(bytes(der[offset:offset + size]))
+        offset += size
+    if offset + length > len(der):
+        raise ValueError("Truncated DER element")
+    return tag, offset, offset + length
+
+
+def children(der):
+    """split the content octets of a constructed element into (tag, content) pairs"""
+    der = bytes(der)
+    items, offset = [], 0
+    while offset < len(der):
+        tag, start, end = read_tlv(der, offset)
+        items.append((tag, der[start:end]))
+        offset = end
+    return items
+
+
+def unwrap(der, expected=None):
+    """return (tag, content) of a single element, optionally checking its tag"""
+    tag, start, end = read_tlv(der)
+    if expected is not None and tag != expected:
+        raise ValueError("Expected DER tag 0x{0:02x}, got 0x{1:02x}".format(expected, tag))
+    return tag, bytes(der)[start:end]
+
+
+def decode_int(content):
+    value = int_from_bytes(content)
+    if content and bytearray(content)[0] & 0x80:
+        value -= 1 << (8 * len(content))
+    return value
+
+
+def decode_oid(content):
+    content = bytearray(content)
+    parts, value = [], 0
+    for byte in content:
+        value = (value << 7) | (byte & 0x7f)
+        if not byte & 0x80:
+            parts.append(value)
+            value = 0
+    first = min(parts[0] // 40, 2)
+    return ".".join(str(p) for p in [first, parts[0] - 40 * first] + parts[1:])
+
+
+def decode_string(tag, content):
+    """text of any of the ASN.1 string types found in distinguished names"""
+    if tag == BMP_STRING:
+        return content.decode('utf-16-be')
+    if tag == UNIVERSAL_STRING:
+        return content.decode('utf-32-be')
+    if tag == T61_STRING:
+        return content.decode('latin-1')
+    return content.decode('utf8')
+
+
+def decode_time(tag, content):
+    """UTCTime or GeneralizedTime (always UTC in certificates) to seconds since the epoch"""
+    text = content.decode('ascii').rstrip("Zz")
+    if tag == UTC_TIME:
+        year = int(text[:2])
+        text = str(1900 + year if year >= 50 else 2000 + year) + text[2:]
+    text, _, fraction = text.partition(".")
+    fields = [int(text[i:i + 2]) for i in range(4, len(text), 2)]
+    seconds = calendar.timegm(tuple([int(text[:4])] + fields + [0] * (5 - len(fields))))
+    return seconds + float("0." + fraction) if fraction else seconds
+
+
+def encode(tag, content):
+    """a single DER element"""
+    length = len(content)
+    if length < 0x80:
+        return bytes(bytearray([tag, length])) + content
+    size = int_to_bytes(length)
+    return bytes(bytearray([tag, 0x80 | len(size)])) + size + content
+
+
+def encode_int(value):
+    content = int_to_bytes(value) if value else b"\x00"
+    # a set top bit would make it negative
+    if bytearray(content)[0] & 0x80:
+        content = b"\x00" + content
+    return encode(INTEGER, content)
+
+
+def encode_oid(dotted):
+    parts = [int(p) for p in dotted.split(".")]
+    content = bytearray()
+    for value in [parts[0] * 40 + parts[1]] + parts[2:]:
+        chunk = [value & 0x7f]
+        value >>= 7
+        while value:
+            chunk.insert(0, 0x80 | (value & 0x7f))
+            value >>= 7
+        content.extend(chunk)
+    return encode(OID, bytes(content))
+
+
+def encode_time(seconds, generalized=False):
+    """UTCTime up to 2049, GeneralizedTime after, as RFC 5280 asks; always GeneralizedTime with
+    generalized, as OCSP has it"""
+    when = time.gmtime(seconds)
+    if when.tm_year < 2050 and not generalized:
+        return encode(UTC_TIME, time.strftime("%y%m%d%H%M%SZ", when).encode('ascii'))
+    return encode(GENERALIZED_TIME, time.strftime("%Y%m%d%H%M%SZ", when).encode('ascii'))
+
+
+def pem_encode(der, label):
+    b64 = base64.b64encode(der).decode('ascii')
+    return "-----BEGIN {0}-----\n{1}\n-----END {0}-----\n".format(label,
+        "\n".join(b64[i:i + 64] for i in range(0, len(b64), 64)))
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# issue many certificates in one run over a single account session
+import argparse, glob, os, sys, textwrap, time, logging
+from multiprocessing.pool import ThreadPool
+from acme_challenges import add_arguments, session_args
+from acme_deploy import Deployment
+from acme_jws import BACKENDS
+from acme_keys import KEY_TYPES, KeyPool
+from acme_metrics import Metrics, write_reports
+from acme_ocsp import Stapler
+from acme_responder import ChallengeResponder, parse_listen
+from acme_tiny import AcmeSession, DEFAULT_CA, LOGGER
+
+
+def iter_manifest(manifest):
+    """yield (line number, fields) of every line of a manifest that is not empty or a comment, as it is read"""
+    with open(manifest) as manifest_file:
+        for lineno, line in enumerate(manifest_file, 1):
+            line = line.split("#", 1)[0].strip()
+            if line:
+                yield lineno, line.split()
+
+
+def parse_job(parts, base, where):
+    """the job of one manifest line, paths are relative to base"""
+    if len(parts) == 2:
+        return tuple(os.path.join(base, part) for part in parts)
+    if len(parts) == 3:
+        return (tuple(parts[0].split(",")),) + tuple(os.path.join(base, part) for part in parts[1:])
+    raise ValueError("{0}: expected `csr_path output_path` or `domain,... key_path output_path`".format(where))
+
+
+def read_manifest(manifest):
+    """a manifest lists one `csr_path output_path` pair per line, or `domain,... key_path output_path`
+    to have a new key and CSR made for the domains; paths are relative to the manifest"""
+    base = os.path.dirname(os.path.abspath(manifest))
+    return [parse_job(parts, base, "{0}:{1}".format(manifest, lineno)) for lineno, parts in iter_manifest(manifest)]
+
+
+def scan_csr_dir(csr_dir, out_dir=None):
+    """every *.csr in csr_dir is signed into <name>.crt in out_dir (default csr_dir)"""
+    return [(csr, os.path.join(out_dir or csr_dir, os.path.splitext(os.path.basename(csr))[0] + ".crt"))
+        for csr in sorted(glob.glob(os.path.join(csr_dir, "*.csr")))]
+
+
+def issue_job(acme, job, acme_dir, deploy, parallel=1, poll_timeout=300, keys=None, key_type="rsa:2048",
+        chain=False, stapler=None):
+    """sign one (csr, output) pair or issue one (domains, key_output, output) job and install the result,
+    with an OCSP staple next to it when a Stapler is given"""
+    if len(job) == 2:
+        deploy.install(job[1], acme.get_crt(job[0], acme_dir, parallel=parallel, poll_timeout=poll_timeout,
+            chain=chain))
+    else:
+        key_pem, signed_crt = acme.issue(job[0], acme_dir, keys=keys, key_type=key_type, parallel=parallel,
+            poll_timeout=poll_timeout, chain=chain)
+        deploy.install(job[2], signed_crt, key_path=job[1], key_pem=key_pem)
+    if stapler is not None:
+        try:
+            stapler.refresh(job[-1])
+        except (IOError, OSError, ValueError) as e:
+            # the certificate is good without a staple, the next acme_ocsp.py run can fetch it
+            stapler.log.warning("Not stapling {0}: {1}".format(job[-1], e))
+
+
+def job_name(job):
+    return job[0] if len(job) == 2 else ",".join(job[0])
+
+
+def issue_batch(acme, jobs, acme_dir, jobs_at_once=4, parallel=1, poll_timeout=300, keys=None, key_type="rsa:2048",
+        chain=False, deploy=None, stapler=None, log=LOGGER):
+    """sign every (csr, output) pair, or issue every (domains, key_output, output) job with a key
+    from the KeyPool `keys`, with the shared AcmeSession; returns one summary dict per job.
+    Files are installed through the Deployment `deploy`, whose reload is left to the caller"""
+    deploy = deploy or Deployment(log=log)
+    def _issue(job):
+        output, csr = job[-1], job_name(job)
+        started = time.time()
+        try:
+            issue_job(acme, job, acme_dir, deploy, parallel=parallel, poll_timeout=poll_timeout, keys=keys,
+                key_type=key_type, chain=chain, stapler=stapler)
+        except Exception as e:
+            log.error("{0}: {1}".format(csr, e))
+            acme.metrics.count("certificates_failed")
+            return {"csr": csr, "output": output, "ok": False, "seconds": time.time() - started, "error": str(e)}
+        return {"csr": csr, "output": output, "ok": True, "seconds": time.time() - started, "error": None}
+
+    # register before fanning out so the workers don't all queue on it
+    acme.register()
+    pool = ThreadPool(max(1, min(jobs_at_once, len(jobs))))
+    try:
+        return pool.map(_issue, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent("""\
+            Sign many CSRs in one run, sharing the parsed account key, the account
+            registration and the CA connections between them. Each certificate is
+            written atomically over the previous one, and the web server is reloaded
+            once at the end if any of them changed.
+
+            ===Example Usage===
+            python acme_batch.py --account-key ./account.key --manifest ./sites.txt --acme-dir /var/www/html/.well-known/acme-challenge/
+            python acme_batch.py --account-key ./account.key --csr-dir ./csrs --out-dir ./certs --acme-dir /var/www/html/.well-known/acme-challenge/
+            python acme_batch.py --account-key ./account.key --manifest ./sites.txt --acme-dir /var/www/html/.well-known/acme-challenge/ --chain --reload-hook "apachectl -k graceful"
+            ===================
+            """)
+    )
+    parser.add_argument("--account-key", required=True, help="path to your account private key")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--manifest", help="file with one `csr_path output_path` pair per line")
+    source.add_argument("--csr-dir", help="sign every *.csr in this directory")
+    parser.add_argument("--out-dir", help="where --csr-dir certificates go, default is next to the CSRs")
+    challenges = parser.add_mutually_exclusive_group(required=True)
+    challenges.add_argument("--acme-dir", help="path to the .well-known/acme-challenge/ directory")
+    challenges.add_argument("--responder", type=parse_listen, metavar="[HOST:]PORT",
+        help="answer the challenges from a built-in HTTP server listening here instead")
+    add_arguments(parser)
+    parser.add_argument("--jobs", type=int, default=4, help="certificates issued at once, default 4")
+    parser.add_argument("--parallel", type=int, default=1, metavar="N", help="domains authorized at once per certificate")
+    parser.add_argument("--poll-timeout", type=float, default=300, metavar="SECONDS",
+        help="give up on a certificate when the CA has not validated it after this long, default 300")
+    parser.add_argument("--quiet", action="store_const", const=logging.ERROR, help="suppress output except for errors")
+    parser.add_argument("--ca", default=DEFAULT_CA, help="certificate authority, default is https://iisca.com")
+    parser.add_argument("--signer", default="auto", choices=BACKENDS,
+        help="how to sign requests with the account key, default picks the fastest available")
+    parser.add_argument("--state-dir",
+        help="keep account, authorization and CA directory state here between runs")
+    parser.add_argument("--key-pool", metavar="DIR",
+        help="keep pre-generated keys here for `domain,... key_path output_path` jobs (see acme_keys.py)")
+    parser.add_argument("--key-type", default="rsa:2048", help="one of {0}, default rsa:2048".format(", ".join(KEY_TYPES)))
+    parser.add_argument("--pool-size", type=int, default=8, help="keys kept ready in --key-pool, default 8")
+    parser.add_argument("--chain", action="store_true", help="append the issuer certificate, i.e. write full chains")
+    parser.add_argument("--reload-hook", metavar="COMMAND",
+        help="shell command run once after the batch if any certificate changed, e.g. `systemctl reload nginx`")
+    parser.add_argument("--ocsp", action="store_true",
+        help="also fetch an OCSP response for stapling into <output>.ocsp, keep them fresh with acme_ocsp.py")
+    parser.add_argument("--metrics-json", metavar="PATH", help="write phase timings and counters of the run here")
+    parser.add_argument("--metrics-prom", metavar="PATH",
+        help="write them as a Prometheus textfile too, e.g. for the node exporter textfile collector")
+
+    args = parser.parse_args(argv)
+    LOGGER.setLevel(args.quiet or LOGGER.level)
+    challenge_args = session_args(parser, args, log=LOGGER)
+
+    jobs = read_manifest(args.manifest) if args.manifest else scan_csr_dir(args.csr_dir, args.out_dir)
+    metrics, results, stapler = Metrics(), None, None
+    responder = ChallengeResponder(args.responder).start() if args.responder else None
+    # refilled in the background while earlier jobs are being validated
+    keys = KeyPool(args.key_pool, args.key_type, size=args.pool_size, workers=2, log=LOGGER).start() if args.key_pool else None
+    try:
+        acme = AcmeSession(args.account_key, CA=args.ca, log=LOGGER, signer_backend=args.signer,
+            nonce_prefetch=args.jobs * args.parallel, state_dir=args.state_dir, responder=responder, metrics=metrics,
+            **challenge_args)
+        try:
+            with Deployment(args.reload_hook, log=LOGGER) as deployment:
+                stapler = Stapler(deployment, metrics=metrics, log=LOGGER) if args.ocsp else None
+                results = issue_batch(acme, jobs, args.acme_dir, jobs_at_once=args.jobs, parallel=args.parallel,
+                    poll_timeout=args.poll_timeout, keys=keys, key_type=args.key_type, chain=args.chain,
+                    deploy=deployment, stapler=stapler)
+        finally:
+            if stapler is not None:
+                stapler.close()
+            acme.close()
+    finally:
+        if keys is not None:
+            keys.stop()
+        if responder is not None:
+            responder.stop()
+        metrics.finish(results is not None and all(r["ok"] for r in results))
+        write_reports(metrics, args.metrics_json, args.metrics_prom)
+
+    for result in results:
+        sys.stdout.write("{0:<6} {1:7.2f}s {2} -> {3}{4}\n".format("ok" if result["ok"] else "FAILED",
+            result["seconds"], result["csr"], result["output"],
+            "" if result["ok"] else " ({0})".format(result["error"])))
+    failures = len([r for r in results if not r["ok"]])
+    sys.stdout.write("{0} issued, {1} failed\n".format(len(results) - failures, failures))
+    return 1 if failures else 0
+
+if __name__ == "__main__": # pragma: no cover
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# where HTTP-01 challenge responses go when the CA may ask any of several web nodes for them
+import errno, logging, os, time
+from acme_state import write_atomic
+
+LOGGER = logging.getLogger(__name__)
+
+# the same as acme_responder.CHALLENGE_PATH, not imported so issuing does not load the HTTP server
+CHALLENGE_PATH = "/.well-known/acme-challenge/"
+
+
+class DirectoryBackend(object):
+    """Challenge files in one or more directories.
+
+    One directory is the web root of this node, or a shared mount every node
+    serves from; more are the web roots of other nodes (or containers)
+    mounted on this host. Files are written atomically, so a node never
+    serves half a key authorization, and all tokens of an order are written
+    in one go. `target` names the directories in the journal.
+    """
+
+    def __init__(self, acme_dirs):
+        self.acme_dirs = list(acme_dirs)
+        self.target = os.pathsep.join(self.acme_dirs)
+
+    def provision(self, tokens):
+        """put every {token: key authorization} in place, returns what was done for error messages"""
+        for acme_dir in self.acme_dirs:
+            for token, keyauthorization in sorted(tokens.items()):
+                write_atomic(os.path.join(acme_dir, token), keyauthorization, mode=0o644)
+        return "Wrote {0} challenge file(s) to {1}".format(len(tokens), ", ".join(self.acme_dirs))
+
+    def unprovision(self, tokens):
+        for acme_dir in self.acme_dirs:
+            for token in tokens:
+                try:
+                    os.remove(os.path.join(acme_dir, token))
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+
+
+class ResponderBackend(object):
+    """Challenge responses served from memory by a ChallengeResponder, gone with the process"""
+
+    target = None
+
+    def __init__(self, responder):
+        self.responder = responder
+
+    def provision(self, tokens):
+        for token, keyauthorization in tokens.items():
+            self.responder.add(token, keyauthorization)
+        return "Serving {0} token(s) from the challenge responder".format(len(tokens))
+
+    def unprovision(self, tokens):
+        for token in tokens:
+            self.responder.remove(token)
+
+
+class HookBackend(object):
+    """Challenge files written by `backend`, then pushed to other nodes by shell hooks.
+
+    After every provision() and unprovision() each of `hooks` is run once
+    for the whole batch of tokens, all hooks at once, with the directory in
+    $ACME_CHALLENGE_DIR, provision or cleanup in $ACME_CHALLENGE_ACTION and
+    the tokens one per line in $ACME_TOKENS, e.g. one
+    `rsync -a --delete "$ACME_CHALLENGE_DIR/" web2:/var/www/.well-known/acme-challenge/`
+    per node. A hook that fails fails the batch.
+    """
+
+    def __init__(self, backend, hooks, log=LOGGER):
+        self.backend, self.hooks = backend, list(hooks)
+        self.target = backend.target
+        self.log = log
+
+    def _run(self, action, tokens):
+        import subprocess
+        env = dict(os.environ, ACME_CHALLENGE_DIR=self.backend.acme_dirs[0], ACME_CHALLENGE_ACTION=action,
+            ACME_TOKENS="\n".join(sorted(tokens)))
+        self.log.info("Running {0} {1} hook(s)...".format(len(self.hooks), action))
+        procs = [(hook, subprocess.Popen(hook, shell=True, env=env, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT)) for hook in self.hooks]
+        errors = []
+        for hook, proc in procs:
+            out, _ = proc.communicate()
+            if proc.returncode != 0:
+                errors.append("{0} exited with {1}: {2}".format(hook, proc.returncode,
+                    out.decode('utf8', 'replace').strip()))
+        if errors:
+            raise IOError("Challenge {0} hook failed: {1}".format(action, "; ".join(errors)))
+
+    def provision(self, tokens):
+        provisioned = self.backend.provision(tokens)
+        self._run("provision", tokens)
+        return "{0} and ran {1} hook(s)".format(provisioned, len(self.hooks))
+
+    def unprovision(self, tokens):
+        self.backend.unprovision(tokens)
+        self._run("cleanup", tokens)
+
+
+class PresenceCheck(object):
+    """Makes sure every node answers every challenge before the CA is asked to validate.
+
+    Each token is fetched from each of `nodes` (base URLs such as
+    http://10.0.0.2 or http://web2:8080, asked with the domain as Host) all
+    at once, `jobs` requests at a time; without nodes it is fetched from the
+    domain itself. What is missing is fetched again every `interval` seconds
+    until `timeout`, for hooks and mounts that take a moment to show new
+    files everywhere.
+    """
+
+    def __init__(self, session, nodes=None, timeout=0, interval=1, jobs=16, log=LOGGER):
+        self.session = session
+        self.nodes = [node.rstrip("/") for node in nodes or []]
+        self.timeout, self.interval, self.jobs = timeout, interval, jobs
+        self.log = log
+
+    def _fetch(self, check):
+        """whether one (url, host, key authorization) is served"""
+        url, host, keyauthorization = check
+        try:
+            resp = self.session.request("GET", url, headers={"Host": host} if host else None)
+        except (IOError, OSError):
+            return False
+        return resp.code == 200 and resp.body.decode('utf8', 'replace').strip() == keyauthorization
+
+    def check(self, challenges):
+        """raises ValueError naming what was not served in time of [(domain, token, key authorization)]"""
+        pending = []
+        for domain, token, keyauthorization in challenges:
+            if self.nodes:
+                pending.extend((node + CHALLENGE_PATH + token, domain, keyauthorization) for node in self.nodes)
+            else:
+                pending.append(("http://{0}{1}{2}".format(domain, CHALLENGE_PATH, token), None, keyauthorization))
+        deadline = time.time() + self.timeout
+        pool = None
+        try:
+            while True:
+                if len(pending) > 1:
+                    if pool is None:
+                        from multiprocessing.pool import ThreadPool
+                        pool = ThreadPool(min(self.jobs, len(pending)))
+                    served = pool.map(self._fetch, pending)
+                else:
+                    served = [self._fetch(check) for check in pending]
+                pending = [check for check, ok in zip(pending, served) if not ok]
+                if not pending or time.time() + self.interval > deadline:
+                    break
+                self.log.info("Waiting for {0} challenge file(s) to show up...".format(len(pending)))
+                time.sleep(self.interval)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        if pending:
+            raise ValueError("couldn't download {0}".format(", ".join(
+                url if host is None else "{0} (Host: {1})".format(url, host) for url, host, _ in pending)))
+
+
+def add_arguments(parser):
+    """the multi-node options of the command line clients, see session_args()"""
+    parser.add_argument("--mirror-dir", action="append", default=[], metavar="DIR",
+        help="also write the challenge files here, e.g. the web root of another node mounted on this host; repeatable")
+    parser.add_argument("--sync-hook", action="append", default=[], metavar="COMMAND",
+        help="shell command run after the challenge files of an order are written and again after they are removed, "
+            "e.g. rsync -a --delete \"$ACME_CHALLENGE_DIR/\" web2:/var/www/.well-known/acme-challenge/; repeatable, "
+            "all run at once")
+    parser.add_argument("--check-node", action="append", default=[], metavar="URL",
+        help="fetch every challenge from this web node, e.g. http://10.0.0.2, before asking the CA to validate; "
+            "repeatable, default is the domain itself")
+    parser.add_argument("--check-timeout", type=float, default=0, metavar="SECONDS",
+        help="keep fetching this long until every node serves the challenges, default is one try")
+
+
+def session_args(parser, args, log=LOGGER):
+    """the AcmeSession keyword arguments for the add_arguments() options"""
+    if (args.mirror_dir or args.sync_hook) and not args.acme_dir:
+        parser.error("--mirror-dir and --sync-hook need --acme-dir")
+    challenges = None
+    if args.mirror_dir or args.sync_hook:
+        challenges = DirectoryBackend([args.acme_dir] + args.mirror_dir)
+        if args.sync_hook:
+            challenges = HookBackend(challenges, args.sync_hook, log=log)
+    return {"challenges": challenges, "check_nodes": args.check_node, "check_timeout": args.check_timeout}
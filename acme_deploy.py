@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# put new keys and certificates in place atomically and reload the web server once per run
+import argparse, logging, os, stat, subprocess, sys, threading
+from acme_state import write_atomic
+
+LOGGER = logging.getLogger(__name__)
+
+
+def replace_file(path, data, mode=None):
+    """atomically replace path with data unless it already holds exactly that, returns whether it changed.
+    A symlink at path is followed, so the file it points to is replaced and the link kept. A replaced file
+    keeps its mode, owner and group so whoever could read it still can, mode (default 0644) is only
+    used for a new file"""
+    data = data.encode('utf8') if not isinstance(data, bytes) else data
+    path = os.path.realpath(path)
+    try:
+        with open(path, "rb") as current_file:
+            if current_file.read() == data:
+                return False
+    except (IOError, OSError):
+        pass
+    try:
+        current = os.stat(path)
+    except OSError:
+        write_atomic(path, data, mode=0o644 if mode is None else mode)
+    else:
+        write_atomic(path, data, mode=stat.S_IMODE(current.st_mode), owner=(current.st_uid, current.st_gid))
+    return True
+
+
+class Deployment(object):
+    """Installs keys and certificates and reloads the server once for all of them.
+
+    install() swaps each file in with a rename, the key before the
+    certificate, and only counts a file as changed when its bytes did. A
+    replaced file keeps its mode and ownership, a new key is made 0600.
+    reload() runs `reload_hook` through the shell once if anything changed
+    since the last reload, with the changed paths one per line in
+    $ACME_DEPLOYED; used as a context manager it reloads on the way out. The
+    hook should do a graceful reload, e.g. `apachectl -k graceful` or
+    `systemctl reload nginx`, so open connections are not dropped.
+    """
+
+    def __init__(self, reload_hook=None, log=LOGGER):
+        self.reload_hook = reload_hook
+        self.log = log
+        self.changed = []
+        self.reloads = 0
+        self._lock = threading.Lock()
+
+    def install_file(self, path, data, mode=None):
+        if not replace_file(path, data, mode=mode):
+            return False
+        self.log.info("Deployed {0}".format(path))
+        with self._lock:
+            self.changed.append(path)
+        return True
+
+    def install(self, cert_path, cert_pem, key_path=None, key_pem=None):
+        """put a certificate (and its new key) in place, returns whether anything changed"""
+        # a reader that sees the new certificate also finds its key
+        changed = key_path is not None and self.install_file(key_path, key_pem, mode=0o600)
+        return self.install_file(cert_path, cert_pem) or changed
+
+    def reload(self):
+        """run the hook once for everything installed since the last reload, returns whether it ran"""
+        with self._lock:
+            changed, self.changed = self.changed, []
+        if not changed or not self.reload_hook:
+            return False
+        self.log.info("Reloading for {0} changed file(s): {1}".format(len(changed), self.reload_hook))
+        env = dict(os.environ, ACME_DEPLOYED="\n".join(changed))
+        proc = subprocess.Popen(self.reload_hook, shell=True, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        out, _ = proc.communicate()
+        self.reloads += 1
+        if proc.returncode != 0:
+            raise IOError("Reload hook failed with exit code {0}: {1}".format(proc.returncode,
+                out.decode('utf8', 'replace').strip()))
+        return True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        # certificates already swapped in must be picked up even when a later one failed
+        self.reload()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Install keys and certificates atomically, then reload the web "
+        "server once if any of them changed",
+        epilog="e.g. acme_deploy.py --install ./site.key /etc/ssl/site.key --install ./site.crt /etc/ssl/site.crt "
+            "--reload-hook 'systemctl reload apache2'")
+    parser.add_argument("--install", nargs=2, action="append", default=[], metavar=("SRC", "DEST"),
+        help="copy SRC over DEST atomically, private keys get mode 0600; give keys before their certificates")
+    parser.add_argument("--reload-hook", metavar="COMMAND", help="shell command for a graceful reload")
+    parser.add_argument("--quiet", action="store_const", const=logging.ERROR, help="suppress output except for errors")
+    args = parser.parse_args(argv)
+    if not args.install:
+        parser.error("nothing to --install")
+
+    LOGGER.addHandler(logging.StreamHandler())
+    LOGGER.setLevel(args.quiet or logging.INFO)
+    deployment = Deployment(args.reload_hook)
+    with deployment:
+        for src, dest in args.install:
+            with open(src, "rb") as src_file:
+                data = src_file.read()
+            deployment.install_file(dest, data, mode=0o600 if b"PRIVATE KEY-----" in data else None)
+    return 0
+
+if __name__ == "__main__": # pragma: no cover
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# issue certificates for thousands of domains over many accounts and CAs at a steady pace, needs python 3 (asyncio)
+import argparse, asyncio, logging, os, sys, textwrap, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from acme_batch import issue_job, iter_manifest, job_name, parse_job
+from acme_challenges import add_arguments, session_args
+from acme_deploy import Deployment
+from acme_http import RateLimited
+from acme_jws import BACKENDS
+from acme_keys import KEY_TYPES, KeyPool
+from acme_metrics import Metrics, write_reports
+from acme_ocsp import Stapler
+from acme_responder import ChallengeResponder, parse_listen
+from acme_tiny import AcmeSession, DEFAULT_CA, LOGGER
+
+
+def ca_base_url(ca):
+    """the base URL of a CA given by it or by its directory URL; AcmeSession appends /directory itself"""
+    ca = ca.rstrip("/")
+    return ca[:-len("/directory")] if ca.endswith("/directory") else ca
+
+
+def read_fleet_manifest(manifest, account_key=None, ca=DEFAULT_CA):
+    """yield (account_key, ca, job) for every line of a manifest as it is read. Lines are those of
+    acme_batch.py, optionally starting with `account=PATH` and `ca=URL` to override the defaults.
+    The CA is its base URL as AcmeSession takes it, a directory URL is cut back to that"""
+    base = os.path.dirname(os.path.abspath(manifest))
+    for lineno, parts in iter_manifest(manifest):
+        where, options = "{0}:{1}".format(manifest, lineno), {"account": account_key, "ca": ca}
+        while parts and parts[0].split("=", 1)[0] in options and "=" in parts[0]:
+            name, value = parts.pop(0).split("=", 1)
+            options[name] = os.path.join(base, value) if name == "account" else value
+        if options["account"] is None:
+            raise ValueError("{0}: no account= given and no default account key".format(where))
+        yield options["account"], ca_base_url(options["ca"]), parse_job(parts, base, where)
+
+
+class TokenBucket(object):
+    """Hands out `rate` tokens per second, up to `burst` saved up.
+
+    reserve() takes a token and returns how long to wait before using it. The
+    level may go below zero, so waiters start evenly spaced in the order they
+    asked instead of all at once when the bucket refills. pause() holds every
+    token back until a Retry-After has passed, without letting a burst build
+    up meanwhile.
+    """
+
+    def __init__(self, rate, burst=1, clock=time.time):
+        self.rate, self.burst = float(rate), float(burst)
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated = clock() # may lie ahead while paused
+        self.paused_until = 0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        with self._lock:
+            now = self.clock()
+            if now > self.updated:
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+            self.tokens -= 1
+            return self.updated - now + max(0, -self.tokens) / self.rate
+
+    def pause(self, seconds):
+        with self._lock:
+            until = self.clock() + seconds
+            self.paused_until = max(self.paused_until, until)
+            if until > self.updated:
+                self.tokens, self.updated = min(self.tokens, 0), until
+
+    def blocked(self):
+        """seconds until a pause is over, 0 if there is none"""
+        return max(0, self.paused_until - self.clock())
+
+
+class Fleet(object):
+    """Runs the issuance jobs of many accounts against many CAs from one asyncio loop.
+
+    At most `concurrency` jobs are in flight, each on a worker thread since
+    AcmeSession blocks. A job only starts once the token buckets of its
+    account (`account_rate` orders per second) and of its CA (`ca_rate`)
+    allow, so every CA sees a steady stream of orders rather than bursts. A
+    429 pauses the account, a 503 the whole CA, for the Retry-After the CA
+    sent or else an exponential backoff from `backoff` seconds, and the job
+    is tried again up to `attempts` times in all. Jobs are pulled from the
+    iterable through a queue of `queue_size` as workers free up, so a
+    manifest of any length is never held in memory.
+    """
+
+    def __init__(self, make_session, acme_dir, concurrency=16, ca_rate=2.0, account_rate=1.0, burst=4,
+            queue_size=256, attempts=5, backoff=30, max_backoff=3600, deploy=None, metrics=None, log=LOGGER,
+            **issue_args):
+        self.make_session = make_session
+        self.acme_dir = acme_dir
+        self.concurrency, self.queue_size = concurrency, queue_size
+        self.ca_rate, self.account_rate, self.burst = ca_rate, account_rate, burst
+        self.attempts, self.backoff, self.max_backoff = attempts, backoff, max_backoff
+        self.deploy = deploy or Deployment(log=log)
+        self.metrics = metrics or Metrics()
+        self.log = log
+        self.issue_args = issue_args
+        self.stats = {"issued": 0, "failed": 0, "retries": 0}
+        self._sessions = {} # (account key, CA) -> AcmeSession
+        self._buckets = {} # CA or (account key, CA) -> TokenBucket
+        self._lock = threading.Lock()
+
+    def _session(self, account_key, ca):
+        with self._lock:
+            acme = self._sessions.get((account_key, ca))
+        if acme is None:
+            # made without the lock, loading a key and fetching a directory must not hold up other accounts
+            made = self.make_session(account_key, ca)
+            with self._lock:
+                acme = self._sessions.setdefault((account_key, ca), made)
+            if acme is not made: # another worker made one first
+                made.close()
+        acme.register()
+        return acme
+
+    def _bucket(self, key, rate):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate, self.burst)
+        return bucket
+
+    async def _issue(self, item, loop, executor):
+        account_key, ca, job = item
+        # the account first, so the CA's token is not spent while waiting on the account's
+        buckets = (self._bucket((account_key, ca), self.account_rate), self._bucket(ca, self.ca_rate))
+        result = {"account": account_key, "ca": ca, "csr": job_name(job), "output": job[-1], "ok": False,
+            "attempts": 0, "error": None}
+        started = time.time()
+        while True:
+            for bucket in buckets:
+                await asyncio.sleep(bucket.reserve())
+                while bucket.blocked():
+                    await asyncio.sleep(bucket.blocked())
+            result["attempts"] += 1
+            try:
+                await loop.run_in_executor(executor, self._issue_job, account_key, ca, job)
+                result["ok"] = True
+                break
+            except RateLimited as e:
+                self.metrics.count("rate_limited", code=str(e.code))
+                if result["attempts"] >= self.attempts:
+                    result["error"] = str(e)
+                    break
+                wait = e.retry_after
+                if wait is None:
+                    wait = min(self.max_backoff, self.backoff * 2 ** (result["attempts"] - 1))
+                self.log.warning("{0}: {1} answered {2}, pausing {3} for {4:.0f}s".format(result["csr"], ca, e.code,
+                    "account {0}".format(account_key) if e.code == 429 else "the CA", wait))
+                buckets[0 if e.code == 429 else 1].pause(wait)
+                self.stats["retries"] += 1
+                self.metrics.count("jobs_retried")
+            except Exception as e:
+                result["error"] = str(e)
+                break
+        result["seconds"] = time.time() - started
+        if not result["ok"]:
+            self.log.error("{0}: {1}".format(result["csr"], result["error"]))
+            self.metrics.count("certificates_failed")
+        return result
+
+    def _issue_job(self, account_key, ca, job):
+        issue_job(self._session(account_key, ca), job, self.acme_dir, self.deploy, **self.issue_args)
+
+    async def _worker(self, queue, on_result, loop, executor):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            result = await self._issue(item, loop, executor)
+            self.stats["issued" if result["ok"] else "failed"] += 1
+            if on_result is not None:
+                on_result(result)
+
+    async def _run(self, jobs, on_result, loop, executor):
+        queue = asyncio.Queue(self.queue_size)
+        workers = [loop.create_task(self._worker(queue, on_result, loop, executor)) for _ in range(self.concurrency)]
+        try:
+            for item in jobs:
+                await queue.put(item)
+        finally:
+            # let the jobs already queued finish, also when reading the manifest failed
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+
+    def run(self, jobs, on_result=None):
+        """issue every (account_key, ca, job) of the iterable, on_result(summary dict) is called as each
+        job finishes; returns the counts of issued, failed and retried jobs"""
+        loop, executor = asyncio.new_event_loop(), ThreadPoolExecutor(self.concurrency)
+        try:
+            loop.run_until_complete(self._run(jobs, on_result, loop, executor))
+        finally:
+            executor.shutdown()
+            loop.close()
+        return dict(self.stats)
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = list(self._sessions.values()), {}
+        for acme in sessions:
+            acme.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent("""\
+            Issue the certificates of a large manifest over several accounts and
+            CAs, keeping under each CA's rate limits. Lines are those of
+            acme_batch.py, optionally prefixed with `account=PATH` and `ca=URL`:
+
+                account=keys/a.key ca=https://acme.example example.com,www.example.com example.com.key example.com.crt
+                csrs/other.csr certs/other.crt
+
+            Orders are paced by a token bucket per CA and per account, and a 429
+            or 503 pauses the account or CA for as long as its Retry-After says.
+
+            ===Example Usage===
+            python3 acme_fleet.py --account-key ./account.key --manifest ./fleet.txt --acme-dir /var/www/html/.well-known/acme-challenge/ --ca-rate 5 --account-rate 1
+            ===================
+            """)
+    )
+    parser.add_argument("--manifest", required=True, help="jobs to run, one per line")
+    parser.add_argument("--account-key", help="account key of the lines without account=")
+    parser.add_argument("--ca", default=DEFAULT_CA, help="CA of the lines without ca=, default is https://iisca.com")
+    challenges = parser.add_mutually_exclusive_group(required=True)
+    challenges.add_argument("--acme-dir", help="path to the .well-known/acme-challenge/ directory")
+    challenges.add_argument("--responder", type=parse_listen, metavar="[HOST:]PORT",
+        help="answer the challenges from a built-in HTTP server listening here instead")
+    add_arguments(parser)
+    parser.add_argument("--concurrency", type=int, default=16, help="certificates issued at once over all CAs, default 16")
+    parser.add_argument("--ca-rate", type=float, default=2.0, metavar="PER_SECOND",
+        help="orders started per second against each CA, default 2")
+    parser.add_argument("--account-rate", type=float, default=1.0, metavar="PER_SECOND",
+        help="orders started per second by each account, default 1")
+    parser.add_argument("--burst", type=int, default=4, help="orders a CA or account may start at once after a lull, default 4")
+    parser.add_argument("--queue-size", type=int, default=256, help="manifest lines read ahead, default 256")
+    parser.add_argument("--attempts", type=int, default=5, help="tries per certificate when rate limited, default 5")
+    parser.add_argument("--backoff", type=float, default=30, metavar="SECONDS",
+        help="first pause after a 429 or 503 without Retry-After, doubled on each retry, default 30")
+    parser.add_argument("--parallel", type=int, default=1, metavar="N", help="domains authorized at once per certificate")
+    parser.add_argument("--poll-timeout", type=float, default=300, metavar="SECONDS",
+        help="give up on a certificate when the CA has not validated it after this long, default 300")
+    parser.add_argument("--quiet", action="store_const", const=logging.ERROR, help="suppress output except for errors")
+    parser.add_argument("--signer", default="auto", choices=BACKENDS,
+        help="how to sign requests with the account keys, default picks the fastest available")
+    parser.add_argument("--state-dir", help="keep account, authorization and CA directory state here between runs")
+    parser.add_argument("--key-pool", metavar="DIR",
+        help="keep pre-generated keys here for `domain,... key_path output_path` jobs (see acme_keys.py)")
+    parser.add_argument("--key-type", default="rsa:2048", help="one of {0}, default rsa:2048".format(", ".join(KEY_TYPES)))
+    parser.add_argument("--pool-size", type=int, default=8, help="keys kept ready in --key-pool, default 8")
+    parser.add_argument("--chain", action="store_true", help="append the issuer certificate, i.e. write full chains")
+    parser.add_argument("--reload-hook", metavar="COMMAND",
+        help="shell command run once at the end if any certificate changed, e.g. `systemctl reload nginx`")
+    parser.add_argument("--ocsp", action="store_true",
+        help="also fetch an OCSP response for stapling into <output>.ocsp, keep them fresh with acme_ocsp.py")
+    parser.add_argument("--metrics-json", metavar="PATH", help="write phase timings and counters of the run here")
+    parser.add_argument("--metrics-prom", metavar="PATH",
+        help="write them as a Prometheus textfile too, e.g. for the node exporter textfile collector")
+
+    args = parser.parse_args(argv)
+    LOGGER.setLevel(args.quiet or LOGGER.level)
+    challenge_args = session_args(parser, args, log=LOGGER)
+
+    metrics, stats = Metrics(), None
+    responder = ChallengeResponder(args.responder).start() if args.responder else None
+    keys = KeyPool(args.key_pool, args.key_type, size=args.pool_size, workers=2, log=LOGGER).start() if args.key_pool else None
+    def _report(result):
+        sys.stdout.write("{0:<6} {1:7.2f}s {2} -> {3}{4}\n".format("ok" if result["ok"] else "FAILED",
+            result["seconds"], result["csr"], result["output"],
+            "" if result["ok"] else " ({0})".format(result["error"])))
+        sys.stdout.flush()
+    try:
+        with Deployment(args.reload_hook, log=LOGGER) as deployment:
+            stapler = Stapler(deployment, metrics=metrics, log=LOGGER) if args.ocsp else None
+            fleet = Fleet(lambda account_key, ca: AcmeSession(account_key, CA=ca, log=LOGGER,
+                    signer_backend=args.signer, nonce_prefetch=args.parallel, state_dir=args.state_dir,
+                    responder=responder, metrics=metrics, **challenge_args),
+                args.acme_dir, concurrency=args.concurrency, ca_rate=args.ca_rate, account_rate=args.account_rate,
+                burst=args.burst, queue_size=args.queue_size, attempts=args.attempts, backoff=args.backoff,
+                deploy=deployment, metrics=metrics, parallel=args.parallel, poll_timeout=args.poll_timeout,
+                keys=keys, key_type=args.key_type, chain=args.chain, stapler=stapler)
+            try:
+                stats = fleet.run(read_fleet_manifest(args.manifest, args.account_key, args.ca), on_result=_report)
+            finally:
+                fleet.close()
+                if stapler is not None:
+                    stapler.close()
+    finally:
+        if keys is not None:
+            keys.stop()
+        if responder is not None:
+            responder.stop()
+        metrics.finish(stats is not None and not stats["failed"])
+        write_reports(metrics, args.metrics_json, args.metrics_prom)
+
+    sys.stdout.write("{issued} issued, {failed} failed, {retries} retried after rate limiting\n".format(**stats))
+    return 1 if stats["failed"] else 0
+
+if __name__ == "__main__": # pragma: no cover
+    sys.exit(main(sys.argv[1:]))
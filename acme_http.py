@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+# shared HTTP plumbing for the acme clients in this directory
+import collections, email.utils, io, json, logging, select, socket, ssl, threading, time
+try:
+    from urllib.request import urlopen, Request # Python 3
+    from urllib.error import HTTPError
+    from urllib.parse import urljoin, urlsplit
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
+except ImportError:
+    from urllib2 import urlopen, Request, HTTPError # Python 2
+    from urlparse import urljoin, urlsplit
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
+from acme_state import JSONStore
+
+LOGGER = logging.getLogger(__name__)
+
+# a request with one of these methods does the same however often it arrives (RFC 7231 section 4.2.2)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+
+def parse_retry_after(value, now=None):
+    """seconds to wait according to a Retry-After header (delta-seconds or HTTP-date), or None"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(0.0, email.utils.mktime_tz(parsed) - (time.time() if now is None else now))
+
+
+class RateLimited(ValueError):
+    """the CA answered 429 or 503, retry_after is how long it asked us to wait (None if it didn't say)"""
+
+    def __init__(self, message, code, headers=None):
+        ValueError.__init__(self, message)
+        self.code = code
+        self.retry_after = parse_retry_after(headers.get('Retry-After') if headers is not None else None)
+
+
+class NoncePool(object):
+    """Replay-Nonce pool for one CA.
+
+    Every CA response carries a fresh nonce in its Replay-Nonce header, so
+    feeding those responses to observe() keeps the pool topped up for free.
+    get() only falls back to a HEAD request when the pool is empty. With
+    prefetch > 0 a background thread keeps that many nonces ready.
+    """
+
+    def __init__(self, nonce_url, opener=urlopen, prefetch=0, maxlen=64):
+        self.nonce_url = nonce_url
+        self._opener = opener
+        self._nonces = collections.deque(maxlen=maxlen)
+        self._cond = threading.Condition()
+        self._prefetch = prefetch
+        self._thread = None
+        self._closed = False
+        self.fetched = 0 # nonces we had to HEAD for
+        self.reused = 0 # nonces taken from earlier responses
+
+    def observe(self, headers):
+        # headers may be None (e.g. IOError without a response)
+        nonce = headers.get('Replay-Nonce') if headers is not None else None
+        if nonce:
+            with self._cond:
+                self._nonces.append(nonce)
+        return nonce
+
+    def _fetch(self):
+        req = Request(self.nonce_url)
+        req.get_method = lambda : 'HEAD'
+        try:
+            resp = self._opener(req)
+        except IOError as e:
+            # some servers answer HEAD with an error but still hand out a nonce
+            resp = e
+        nonce = getattr(resp, "headers", None)
+        nonce = nonce.get('Replay-Nonce') if nonce is not None else None
+        if not nonce:
+            raise IOError("No Replay-Nonce in response from {0}".format(self.nonce_url))
+        return nonce
+
+    def get(self):
+        with self._cond:
+            if self._nonces:
+                self.reused += 1
+                nonce = self._nonces.popleft()
+                self._cond.notify()
+                return nonce
+            self.fetched += 1
+        return self._fetch()
+
+    def start_prefetch(self, size=None):
+        """keep up to `size` nonces ready in a background thread"""
+        if size is not None:
+            self._prefetch = size
+        if self._prefetch <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._prefetch_loop, name="nonce-prefetch")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _prefetch_loop(self):
+        while True:
+            with self._cond:
+                while not self._closed and len(self._nonces) >= self._prefetch:
+                    self._cond.wait()
+                if self._closed:
+                    return
+            try:
+                nonce = self._fetch()
+            except IOError as e:
+                LOGGER.debug("Nonce prefetch failed: {0}".format(e))
+                with self._cond:
+                    self._cond.wait(1.0)
+                continue
+            with self._cond:
+                self.fetched += 1
+                self._nonces.append(nonce)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(5)
+            self._thread = None
+
+    def __len__(self):
+        return len(self._nonces)
+
+
+class _HTTPSConnection(HTTPSConnection):
+    """HTTPS connection that can resume an earlier TLS session"""
+
+    def __init__(self, host, port=None, timeout=None, ssl_context=None, tls_session=None):
+        HTTPSConnection.__init__(self, host, port, timeout=timeout, context=ssl_context)
+        self.ssl_context = ssl_context
+        self.tls_session = tls_session
+
+    def connect(self):
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+        kwargs = {"server_hostname": self.host}
+        if self.tls_session is not None:
+            kwargs["session"] = self.tls_session # python 3.6+
+        self.sock = self.ssl_context.wrap_socket(sock, **kwargs)
+
+
+def _dropped(conn):
+    """whether the server closed an idle kept-alive connection: with no request outstanding its
+    socket only becomes readable at EOF (or with junk nobody asked for)"""
+    sock = getattr(conn, "sock", None)
+    if sock is None:
+        return True
+    try:
+        return bool(select.select([sock], [], [], 0)[0])
+    except (ValueError, socket.error):
+        return True
+
+
+class _Response(object):
+    """a fully read response, quacks like what urlopen returns"""
+
+    def __init__(self, url, code, reason, headers, body):
+        self.url, self.code, self.reason, self.headers, self.body = url, code, reason, headers, body
+
+    def getcode(self):
+        return self.code
+
+    def geturl(self):
+        return self.url
+
+    def info(self):
+        return self.headers
+
+    def read(self):
+        return self.body
+
+
+class HTTPSession(object):
+    """Keep-alive HTTP(S) connection pool for talking to the CA.
+
+    Connections are kept open per (scheme, host, port) and handed back to the
+    pool once a response has been read completely, and new TLS connections
+    resume the last TLS session to the same host. urlopen() is a drop-in for
+    the urllib function of the same name, so call sites keep their IOError
+    handling. The connections_opened, connections_reused and
+    tls_sessions_reused counters show how well the pool works. With an
+    acme_metrics.Metrics, every request is also counted and timed there.
+    """
+
+    def __init__(self, timeout=30, ssl_context=None, max_idle=8, metrics=None):
+        self.timeout = timeout
+        self.metrics = metrics
+        self.ssl_context = ssl_context or ssl.create_default_context()
+        self.max_idle = max_idle
+        self._idle = {}
+        self._tls_sessions = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+        self.connections_reused = 0
+        self.tls_sessions_reused = 0
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "connections_opened": self.connections_opened,
+            "connections_reused": self.connections_reused,
+            "tls_sessions_reused": self.tls_sessions_reused,
+        }
+
+    def _connect(self, key):
+        scheme, host, port = key
+        if scheme == "https":
+            return _HTTPSConnection(host, port, timeout=self.timeout,
+                ssl_context=self.ssl_context, tls_session=self._tls_sessions.get(key))
+        return HTTPConnection(host, port, timeout=self.timeout)
+
+    def _checkout(self, key):
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                conn = idle.pop() if idle else None
+                if conn is None:
+                    self.connections_opened += 1
+                    break
+            # found closed before anything is sent on it, so no request ever has to be replayed for it
+            if not _dropped(conn):
+                with self._lock:
+                    self.connections_reused += 1
+                return conn, True
+            conn.close()
+        return self._connect(key), False
+
+    def _checkin(self, key, conn, keep):
+        sock = getattr(conn, "sock", None)
+        if sock is not None and hasattr(sock, "session"):
+            with self._lock:
+                if getattr(sock, "session_reused", False) and getattr(conn, "tls_session", None) is not None:
+                    self.tls_sessions_reused += 1
+                    conn.tls_session = None # count each handshake once
+                if sock.session is not None:
+                    self._tls_sessions[key] = sock.session
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if keep and sock is not None and len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, method, url, body=None, headers=None, max_redirects=5):
+        """send one request and return the fully read response, whatever its status"""
+        for _ in range(max_redirects + 1):
+            parts = urlsplit(url)
+            key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+            path = parts.path or "/"
+            if parts.query:
+                path = "{0}?{1}".format(path, parts.query)
+            hdrs = {"User-Agent": "acme-tiny", "Connection": "keep-alive"}
+            hdrs.update(headers or {})
+            if body is not None and "Content-Type" not in hdrs:
+                hdrs["Content-Type"] = "application/jose+json"
+            started = time.time()
+            conn, reused = self._checkout(key)
+            sent = False
+            try:
+                try:
+                    conn.request(method, path, body, hdrs)
+                    sent = True
+                    resp = conn.getresponse()
+                except (socket.error, HTTPException):
+                    conn.close()
+                    # a kept-alive connection that broke while the request was written can't have
+                    # delivered it, so it is sent again on a fresh one. Once it went out in full the
+                    # server may have acted on it before the connection broke: only requests that do
+                    # the same however often they arrive are repeated then, a POST (new-authz,
+                    # challenge, new-cert) fails and the caller decides
+                    if not reused or (sent and method not in IDEMPOTENT_METHODS):
+                        raise
+                    with self._lock:
+                        self.connections_opened += 1
+                    conn = self._connect(key)
+                    conn.request(method, path, body, hdrs)
+                    resp = conn.getresponse()
+                # also for HEAD: an unread response keeps the connection busy, and the next
+                # request on it would fail only after its body had been sent
+                data = resp.read()
+            except (socket.error, HTTPException) as e:
+                conn.close()
+                # callers handle IOError, to them a garbled answer is the same as a broken connection
+                if isinstance(e, HTTPException):
+                    raise IOError("Bad response from {0}: {1} {2}".format(url, e.__class__.__name__, e))
+                raise
+            with self._lock:
+                self.requests += 1
+            if self.metrics is not None:
+                self.metrics.count("http_requests", method=method, code=resp.status)
+                self.metrics.observe("http_request_seconds", time.time() - started, method=method)
+            self._checkin(key, conn, not resp.will_close)
+            if resp.status in (301, 302, 303, 307, 308) and method in ("GET", "HEAD") and resp.getheader("Location"):
+                url = urljoin(url, resp.getheader("Location"))
+                continue
+            return _Response(url, resp.status, resp.reason, resp.msg, data)
+        raise IOError("Too many redirects for {0}".format(url))
+
+    def urlopen(self, url, data=None):
+        """like urllib's urlopen: accepts a url or a Request and raises HTTPError on errors"""
+        headers = {}
+        if isinstance(url, Request):
+            method, data = url.get_method(), url.data
+            headers = dict(url.header_items())
+            url = url.get_full_url()
+        else:
+            method = "GET" if data is None else "POST"
+        resp = self.request(method, url, data, headers)
+        if not 200 <= resp.code < 300:
+            raise HTTPError(resp.url, resp.code, resp.reason, resp.headers, io.BytesIO(resp.body))
+        return resp
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+class Directory(object):
+    """The CA's /directory resource, cached in memory and optionally on disk.
+
+    Within `ttl` seconds of the last fetch the cached copy is used as is;
+    after that it is revalidated with If-None-Match/If-Modified-Since, so an
+    unchanged directory costs a 304 instead of a full download.
+    """
+
+    def __init__(self, url, session=None, ttl=3600, cache_path=None, observe=None):
+        self.url = url
+        self.session = session or HTTPSession()
+        self.ttl = ttl
+        self.store = JSONStore(cache_path) if cache_path else None
+        self.observe = observe
+        self.fetches = 0
+        self._lock = threading.Lock()
+        self._cached = None
+
+    def _load(self):
+        if self._cached is None and self.store is not None:
+            cached = self.store.load()
+            if cached.get("url") == self.url:
+                self._cached = cached
+        return self._cached
+
+    def get(self):
+        with self._lock:
+            cached = self._load()
+            if cached is not None and time.time() - cached["fetched"] < self.ttl:
+                return cached["directory"]
+            headers = {}
+            if cached is not None and cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached is not None and cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+            resp = self.session.request("GET", self.url, headers=headers)
+            self.fetches += 1
+            if self.observe is not None:
+                self.observe(resp.headers)
+            if resp.code == 304 and cached is not None:
+                cached["fetched"] = time.time()
+            elif resp.code == 200:
+                cached = {
+                    "url": self.url,
+                    "directory": json.loads(resp.read().decode('utf8')),
+                    "etag": resp.headers.get('ETag'),
+                    "last_modified": resp.headers.get('Last-Modified'),
+                    "fetched": time.time(),
+                }
+            elif resp.code in (429, 503):
+                # so callers that pace themselves (acme_fleet.py) back off and try again
+                raise RateLimited("Error fetching {0}: {1} {2}".format(self.url, resp.code, resp.read()), resp.code,
+                    resp.headers)
+            else:
+                raise IOError("Error fetching {0}: {1} {2}".format(self.url, resp.code, resp.read()))
+            self._cached = cached
+            if self.store is not None:
+                self.store.update(lambda data: (data.clear(), data.update(cached)))
+            return cached["directory"]
+
+    def resource(self, name):
+        """url of an ACME resource such as new-reg or new-cert"""
+        url = self.get().get(name)
+        if not url:
+            raise ValueError("CA directory {0} has no {1} resource".format(self.url, name))
+        return url
+
+    def terms_of_service(self):
+        return self.get().get('meta', {}).get('terms-of-service')
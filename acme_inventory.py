@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# what was issued to whom and when it expires, in one SQLite file instead of a directory of PEMs
+import argparse, hashlib, json, logging, os, sqlite3, sys, threading, time
+from acme_asn1 import pem_blocks
+from acme_x509 import CERTIFICATE_LABELS, parse_certificate
+
+LOGGER = logging.getLogger(__name__)
+
+DAY = 86400
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS certificates (
+    id INTEGER PRIMARY KEY,
+    fingerprint TEXT NOT NULL UNIQUE, -- sha256 of the DER, the same certificate is only stored once
+    serial TEXT NOT NULL,
+    issuer TEXT NOT NULL,
+    not_before REAL NOT NULL,
+    not_after REAL NOT NULL,
+    thumbprint TEXT, -- of the account that asked for it
+    ca TEXT,
+    location TEXT,
+    path TEXT, -- where it was found by an import
+    csr BLOB,
+    der BLOB NOT NULL,
+    recorded REAL NOT NULL,
+    revoked_at REAL,
+    revocation_reason INTEGER
+);
+CREATE INDEX IF NOT EXISTS certificates_not_after ON certificates (not_after);
+CREATE INDEX IF NOT EXISTS certificates_serial ON certificates (serial);
+CREATE TABLE IF NOT EXISTS names (
+    domain TEXT NOT NULL,
+    certificate INTEGER NOT NULL REFERENCES certificates (id),
+    PRIMARY KEY (domain, certificate)
+);
+CREATE INDEX IF NOT EXISTS names_certificate ON names (certificate);
+"""
+# the columns queries hand back, the DER and CSR are only needed by whoever reads the file directly
+COLUMNS = ("serial", "issuer", "not_before", "not_after", "thumbprint", "ca", "location", "path", "recorded",
+    "revoked_at", "revocation_reason")
+CERTIFICATE_EXTENSIONS = (".crt", ".pem", ".cer")
+
+
+def read_certificate_file(path):
+    """DER of the first certificate in a PEM file, None when it holds none (keys, CSRs)"""
+    with open(path, "rb") as cert_file:
+        data = cert_file.read()
+    for label, headers, der in pem_blocks(data):
+        if label in CERTIFICATE_LABELS:
+            return der
+    return None
+
+
+class Inventory(object):
+    """Every certificate issued or revoked, in a SQLite database.
+
+    Certificates are keyed by their SHA-256 fingerprint, so recording one
+    twice (issued, then found again by an import) only fills in what was
+    missing. Their names go to a separate table indexed by domain, and
+    not_after is indexed, so covering() and expiring() stay index lookups
+    however many certificates there are. The database is shared between
+    threads through one connection, and between processes by SQLite's own
+    locking; WAL lets queries run while a renewal writes.
+    """
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(SCHEMA)
+
+    def _insert(self, der, path=None, csr_der=None, thumbprint=None, ca=None, location=None):
+        """store a certificate unless it is there already, returns (its fingerprint, whether it is new).
+        Call with the lock held and inside a transaction"""
+        fields = parse_certificate(der)
+        fingerprint = hashlib.sha256(der).hexdigest()
+        cursor = self._db.execute("INSERT OR IGNORE INTO certificates (fingerprint, serial, issuer, not_before, "
+            "not_after, thumbprint, ca, location, path, csr, der, recorded) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (fingerprint, fields["serial"], fields["issuer"], fields["not_before"], fields["not_after"], thumbprint,
+                ca, location, path, sqlite3.Binary(csr_der) if csr_der is not None else None, sqlite3.Binary(der),
+                time.time()))
+        new = cursor.rowcount == 1
+        if new:
+            self._db.executemany("INSERT OR IGNORE INTO names (domain, certificate) VALUES (?, ?)",
+                [(domain.lower(), cursor.lastrowid) for domain in fields["domains"]])
+        else:
+            # keep what an earlier record knew, add what this one knows
+            self._db.execute("UPDATE certificates SET thumbprint = coalesce(thumbprint, ?), ca = coalesce(ca, ?), "
+                "location = coalesce(location, ?), csr = coalesce(csr, ?), path = coalesce(?, path) "
+                "WHERE fingerprint = ?", (thumbprint, ca, location,
+                    sqlite3.Binary(csr_der) if csr_der is not None else None, path, fingerprint))
+        return fingerprint, new
+
+    def record_issued(self, der, csr_der=None, thumbprint=None, ca=None, location=None, path=None):
+        """remember a DER certificate the CA just issued, returns its fingerprint"""
+        with self._lock, self._db:
+            return self._insert(der, path=path, csr_der=csr_der, thumbprint=thumbprint, ca=ca, location=location)[0]
+
+    def record_revoked(self, der, reason=None, at=None):
+        """mark a DER certificate revoked, it is recorded first if it was issued elsewhere"""
+        with self._lock, self._db:
+            fingerprint = self._insert(der)[0]
+            self._db.execute("UPDATE certificates SET revoked_at = coalesce(revoked_at, ?), "
+                "revocation_reason = coalesce(revocation_reason, ?) WHERE fingerprint = ?",
+                (time.time() if at is None else at, reason, fingerprint))
+
+    def import_paths(self, paths):
+        """record every certificate file in paths in one transaction, returns (new, known, skipped)"""
+        new = known = skipped = 0
+        with self._lock, self._db:
+            for path in paths:
+                try:
+                    der = read_certificate_file(path)
+                    if der is None:
+                        skipped += 1
+                        continue
+                    is_new = self._insert(der, path=os.path.abspath(path))[1]
+                except (IOError, OSError, ValueError, IndexError, UnicodeDecodeError) as e:
+                    LOGGER.warning("Skipping {0}: {1}".format(path, e))
+                    skipped += 1
+                    continue
+                if is_new:
+                    new += 1
+                else:
+                    known += 1
+        return new, known, skipped
+
+    def import_dir(self, directory, extensions=CERTIFICATE_EXTENSIONS):
+        """walk directory once and record every certificate in it, see import_paths()"""
+        paths = []
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            paths.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith(extensions))
+        return self.import_paths(paths)
+
+    def _select(self, where, args, order="c.not_after"):
+        query = ("SELECT {0}, group_concat(n.domain) AS domains FROM certificates c "
+            "LEFT JOIN names n ON n.certificate = c.id WHERE {1} GROUP BY c.id ORDER BY {2}").format(
+                ", ".join("c." + column for column in COLUMNS), where, order)
+        with self._lock:
+            rows = self._db.execute(query, args).fetchall()
+        results = []
+        for row in rows:
+            result = dict((column, row[column]) for column in COLUMNS)
+            result["domains"] = sorted(row["domains"].split(",")) if row["domains"] else []
+            results.append(result)
+        return results
+
+    def covering(self, domain, now=None, include_expired=False):
+        """certificates for domain, directly or through a wildcard, the longest valid first;
+        revoked and (unless include_expired) expired ones are left out"""
+        domain = domain.lower().rstrip(".")
+        names = [domain] + (["*." + domain.split(".", 1)[1]] if "." in domain else [])
+        where = "c.id IN (SELECT certificate FROM names WHERE domain IN ({0})) AND c.revoked_at IS NULL".format(
+            ", ".join("?" * len(names)))
+        args = list(names)
+        if not include_expired:
+            where += " AND c.not_after > ?"
+            args.append(time.time() if now is None else now)
+        return self._select(where, args, order="c.not_after DESC")
+
+    def expiring(self, until, since=None):
+        """unrevoked certificates with a notAfter in [since, until), since defaults to now, soonest first"""
+        return self._select("c.not_after >= ? AND c.not_after < ? AND c.revoked_at IS NULL",
+            [time.time() if since is None else since, until])
+
+    def by_serial(self, serial):
+        """certificates with this serial (hex, as parse_certificate gives it), one per issuer"""
+        return self._select("c.serial = ?", [serial.lower().lstrip("0") or "0"])
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def status(record, now=None):
+    if record["revoked_at"] is not None:
+        return "revoked"
+    return "expired" if record["not_after"] <= (time.time() if now is None else now) else "valid"
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Query the certificate inventory AcmeSession keeps in its state "
+        "dir, or import existing certificates into it",
+        epilog="e.g. acme_inventory.py --db state/inventory.sqlite3 --import /etc/ssl/sites --expiring 14")
+    parser.add_argument("--db", required=True, metavar="PATH", help="inventory file, e.g. <--state-dir>/inventory.sqlite3")
+    parser.add_argument("--import", dest="import_dirs", action="append", default=[], metavar="DIR",
+        help="record every *.crt, *.pem and *.cer under DIR, repeatable")
+    parser.add_argument("--domain", action="append", default=[], help="list the certificates covering a domain")
+    parser.add_argument("--expiring", type=float, metavar="DAYS", help="list the certificates expiring within DAYS")
+    parser.add_argument("--serial", help="show the certificate with this hex serial")
+    parser.add_argument("--include-expired", action="store_true", help="also list expired certificates for --domain")
+    parser.add_argument("--json", action="store_true", help="print the records as JSON lines")
+    parser.add_argument("--quiet", action="store_const", const=logging.ERROR, help="suppress output except for errors")
+    args = parser.parse_args(argv)
+
+    LOGGER.addHandler(logging.StreamHandler())
+    LOGGER.setLevel(args.quiet or logging.INFO)
+    inventory = Inventory(args.db)
+    try:
+        for directory in args.import_dirs:
+            started = time.time()
+            new, known, skipped = inventory.import_dir(directory)
+            LOGGER.info("Imported {0}: {1} new, {2} known, {3} skipped in {4:.2f}s".format(directory, new, known,
+                skipped, time.time() - started))
+        records = []
+        for domain in args.domain:
+            records.extend(inventory.covering(domain, include_expired=args.include_expired))
+        if args.expiring is not None:
+            records.extend(inventory.expiring(time.time() + args.expiring * DAY))
+        if args.serial:
+            records.extend(inventory.by_serial(args.serial))
+    finally:
+        inventory.close()
+
+    for record in records:
+        if args.json:
+            sys.stdout.write(json.dumps(dict(record, status=status(record)), sort_keys=True) + "\n")
+        else:
+            sys.stdout.write("{0:<7} {1} {2} {3} {4}\n".format(status(record), record["serial"],
+                time.strftime("%Y-%m-%d", time.gmtime(record["not_after"])), ",".join(record["domains"]),
+                record["path"] or record["location"] or ""))
+    return 0
+
+if __name__ == "__main__": # pragma: no cover
+    sys.exit(main(sys.argv[1:]))
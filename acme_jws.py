@@ -0,0 +1,544 @@
+#!/usr/bin/env python
+# JWS signing backends for the acme clients: the account key is loaded once and
+# every request is signed in-process, `openssl dgst` is only kept as a fallback
+import base64, binascii, ctypes, hashlib, hmac, json, logging, os, sys
+from acme_asn1 import (SEQUENCE, INTEGER, BIT_STRING, OCTET_STRING, OID, pem_blocks, children, unwrap,
+    decode_int, decode_oid, int_from_bytes, int_to_bytes)
+try:
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, padding, utils
+except ImportError: # optional, the pure python signer is used instead
+    serialization = None
+
+LOGGER = logging.getLogger(__name__)
+
+RSA_ENCRYPTION = "1.2.840.113549.1.1.1"
+EC_PUBLIC_KEY = "1.2.840.10045.2.1"
+# DER DigestInfo prefix of a SHA-256 hash, see RFC 3447 section 9.2
+SHA256_DIGEST_INFO = binascii.unhexlify("3031300d060960864801650304020105000420")
+
+
+class Curve(object):
+    """a NIST prime curve y^2 = x^3 - 3x + b and the JWS algorithm that goes with it"""
+
+    def __init__(self, name, oid, alg, hash_name, p, b, gx, gy, n):
+        self.name, self.oid, self.alg, self.hash_name = name, oid, alg, hash_name
+        self.p, self.a, self.b, self.g, self.n = p, p - 3, b, (gx, gy), n
+        self.size = (p.bit_length() + 7) // 8
+
+    def digest(self, data):
+        # a hash longer than the order is cut to its leftmost bits (FIPS 186-4 section 6.4)
+        digest = hashlib.new(self.hash_name, data).digest()
+        return int_from_bytes(digest) >> max(0, 8 * len(digest) - self.n.bit_length())
+
+# FIPS 186-4 appendix D.1.2, the curves RFC 7518 section 3.4 has ES256 and ES384 for
+CURVES = dict((curve.oid, curve) for curve in [
+    Curve("P-256", "1.2.840.10045.3.1.7", "ES256", "sha256",
+        0xffffffff00000001000000000000000000000000ffffffffffffffffffffffff,
+        0x5ac635d8aa3a93e7b3ebbd55769886bc651d06b0cc53b0f63bce3c3e27d2604b,
+        0x6b17d1f2e12c4247f8bce6e563a440f277037d812deb33a0f4a13945d898c296,
+        0x4fe342e2fe1a7f9b8ee7eb4a7c0f9e162bce33576b315ececbb6406837bf51f5,
+        0xffffffff00000000ffffffffffffffffbce6faada7179e84f3b9cac2fc632551),
+    Curve("P-384", "1.3.132.0.34", "ES384", "sha384",
+        0xfffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffeffffffff0000000000000000ffffffff,
+        0xb3312fa7e23ee7e4988e056be3f82d19181d9c6efe8141120314088f5013875ac656398d8a2ed19d2a85c8edd3ec2aef,
+        0xaa87ca22be8b05378eb1c71ef320ad746e1d3b628ba79b9859f741e082542a385502f25dbf55296c3a545e3872760ab7,
+        0x3617de4a96262c6f5d9e98bf9292dc29f8f41dbd289a147ce9da3113b5f0b8c00a60b1ce1d7e819d7a431d7c90ea0e5f,
+        0xffffffffffffffffffffffffffffffffffffffffffffffffc7634d81f4372ddf581a0db248b0a77aecec196accc52973),
+])
+CURVES_BY_NAME = dict((curve.name, curve) for curve in CURVES.values())
+
+
+def _modinv(a, m):
+    # extended euclid, pow(a, -1, m) needs python 3.8
+    x0, x1, a0, m0 = 1, 0, a % m, m
+    while m0:
+        q = a0 // m0
+        a0, m0 = m0, a0 - q * m0
+        x0, x1 = x1, x0 - q * x1
+    if a0 != 1:
+        raise ValueError("Value is not invertible")
+    return x0 % m
+
+
+# curve arithmetic in jacobian coordinates (X, Y, Z) ~ (X/Z^2, Y/Z^3), Z == 0 is the point at infinity
+def _ec_double(curve, P):
+    X, Y, Z = P
+    if not Y or not Z:
+        return (0, 1, 0)
+    p = curve.p
+    YY = Y * Y % p
+    S = 4 * X * YY % p
+    M = (3 * X * X + curve.a * pow(Z, 4, p)) % p
+    X3 = (M * M - 2 * S) % p
+    return (X3, (M * (S - X3) - 8 * YY * YY) % p, 2 * Y * Z % p)
+
+
+def _ec_add(curve, P, Q):
+    if not P[2]:
+        return Q
+    if not Q[2]:
+        return P
+    p = curve.p
+    PZ2, QZ2 = P[2] * P[2] % p, Q[2] * Q[2] % p
+    U1, U2 = P[0] * QZ2 % p, Q[0] * PZ2 % p
+    S1, S2 = P[1] * QZ2 * Q[2] % p, Q[1] * PZ2 * P[2] % p
+    if U1 == U2:
+        return _ec_double(curve, P) if S1 == S2 else (0, 1, 0)
+    H, R = (U2 - U1) % p, (S2 - S1) % p
+    HH = H * H % p
+    HHH, V = H * HH % p, U1 * HH % p
+    X3 = (R * R - HHH - 2 * V) % p
+    return (X3, (R * (V - X3) - S1 * HHH) % p, H * P[2] * Q[2] % p)
+
+
+def _ec_affine(curve, P):
+    if not P[2]:
+        raise ValueError("Point at infinity")
+    zinv = _modinv(P[2], curve.p)
+    return P[0] * zinv * zinv % curve.p, P[1] * pow(zinv, 3, curve.p) % curve.p
+
+
+def ec_multiply(curve, k, point=None):
+    """k * point (the generator by default) in affine coordinates.
+
+    A Montgomery ladder over k plus one or two times the order, so every
+    scalar of a curve takes the same number of bits and the same adds and
+    doubles whatever its value; python's integers still make no timing
+    promises, which is why the libcrypto and cryptography backends come first.
+    """
+    x, y = point or curve.g
+    k, bits = k % curve.n + curve.n, curve.n.bit_length() + 1
+    if k.bit_length() < bits:
+        k += curve.n
+    R = [(x, y, 1), _ec_double(curve, (x, y, 1))]
+    for i in range(bits - 2, -1, -1):
+        bit = (k >> i) & 1
+        R[1 - bit] = _ec_add(curve, R[0], R[1])
+        R[bit] = _ec_double(curve, R[bit])
+    return _ec_affine(curve, R[0])
+
+
+def ec_decode_point(curve, data):
+    """(x, y) of an uncompressed or compressed SEC1 point, checked to be on the curve"""
+    data, p = bytearray(data), curve.p
+    if len(data) == 1 + 2 * curve.size and data[0] == 4:
+        x, y = int_from_bytes(bytes(data[1:1 + curve.size])), int_from_bytes(bytes(data[1 + curve.size:]))
+    elif len(data) == 1 + curve.size and data[0] in (2, 3):
+        x = int_from_bytes(bytes(data[1:]))
+        # both curves have p = 3 mod 4, so the square root is a single power
+        y = pow((x * x * x + curve.a * x + curve.b) % p, (p + 1) // 4, p)
+        if (y & 1) != (data[0] & 1):
+            y = p - y
+    else:
+        raise ValueError("Malformed EC point")
+    if (y * y - x * x * x - curve.a * x - curve.b) % p:
+        raise ValueError("EC point is not on the curve")
+    return x, y
+
+
+def rfc6979_nonces(curve, d, data):
+    """the deterministic ECDSA nonces of RFC 6979 section 3.2 for key d and data, in the order to try them"""
+    n, qlen = curve.n, curve.n.bit_length()
+    rlen = (qlen + 7) // 8
+    hash_func = getattr(hashlib, curve.hash_name)
+    def bits2int(b):
+        return int_from_bytes(b) >> max(0, 8 * len(b) - qlen)
+    def mac(key, msg):
+        return hmac.new(key, msg, hash_func).digest()
+    x = int_to_bytes(d, rlen) + int_to_bytes(curve.digest(data) % n, rlen)
+    V = b"\x01" * hash_func().digest_size
+    K = mac(b"\x00" * len(V), V + b"\x00" + x)
+    V = mac(K, V)
+    K = mac(K, V + b"\x01" + x)
+    V = mac(K, V)
+    while True:
+        T = b""
+        while len(T) < rlen:
+            V = mac(K, V)
+            T += V
+        k = bits2int(T)
+        if 0 < k < n:
+            yield k
+        K = mac(K, V + b"\x00")
+        V = mac(K, V)
+
+
+def ecdsa_sign(curve, d, data):
+    """ECDSA signature of data as the JWS wants it: r and s as fixed size big-endian integers"""
+    e, n = curve.digest(data), curve.n
+    # a nonce derived from the key and the message (RFC 6979) can't be biased or repeated by a bad RNG
+    for k in rfc6979_nonces(curve, d, data):
+        r = ec_multiply(curve, k)[0] % n
+        s = _modinv(k, n) * (e + r * d) % n
+        if r and s:
+            return int_to_bytes(r, curve.size) + int_to_bytes(s, curve.size)
+
+
+def ecdsa_verify(curve, point, data, signature):
+    """check a JWS (r || s) ECDSA signature against the public point (x, y)"""
+    n = curve.n
+    if len(signature) != 2 * curve.size:
+        return False
+    r, s = int_from_bytes(signature[:curve.size]), int_from_bytes(signature[curve.size:])
+    if not 0 < r < n or not 0 < s < n:
+        return False
+    w = _modinv(s, n)
+    (x1, y1), (x2, y2) = ec_multiply(curve, curve.digest(data) * w % n), ec_multiply(curve, r * w % n, point)
+    R = _ec_add(curve, (x1, y1, 1), (x2, y2, 1))
+    return bool(R[2]) and _ec_affine(curve, R)[0] % n == r
+
+
+def ecdsa_der_to_jws(der, curve):
+    """openssl and libcrypto give a DER ECDSA-Sig-Value, the JWS wants r || s (RFC 7518 section 3.4)"""
+    r, s = [decode_int(c) for t, c in children(unwrap(der, SEQUENCE)[1]) if t == INTEGER]
+    return int_to_bytes(r, curve.size) + int_to_bytes(s, curve.size)
+
+
+def ec_jwk(curve, point):
+    """the JWK of an EC public key, its members already in thumbprint (RFC 7638) order"""
+    return {
+        "crv": curve.name,
+        "kty": "EC",
+        "x": _b64(int_to_bytes(point[0], curve.size)),
+        "y": _b64(int_to_bytes(point[1], curve.size)),
+    }
+
+
+def _b64(b):
+    return base64.urlsafe_b64encode(b).decode('utf8').replace("=", "")
+
+
+def load_ec_private_key(pem):
+    """parse an unencrypted SEC1 or PKCS#8 P-256/P-384 private key into dict(curve, d, point)"""
+    for label, headers, der in pem_blocks(pem):
+        if "ENCRYPTED" in label or "ENCRYPTED" in headers:
+            raise ValueError("Encrypted private keys are not supported in-process")
+        curve_oid = None
+        if label == "PRIVATE KEY":
+            fields = children(unwrap(der, SEQUENCE)[1])
+            algorithm = children(fields[1][1])
+            if decode_oid(algorithm[0][1]) != EC_PUBLIC_KEY or fields[2][0] != OCTET_STRING:
+                raise ValueError("Not an EC private key")
+            curve_oid, der = decode_oid(algorithm[1][1]), fields[2][1]
+        elif label != "EC PRIVATE KEY":
+            continue
+        # ECPrivateKey: version, privateKey, [0] parameters, [1] publicKey
+        fields = children(unwrap(der, SEQUENCE)[1])
+        if len(fields) < 2 or fields[1][0] != OCTET_STRING:
+            raise ValueError("Malformed EC private key")
+        d, public = int_from_bytes(fields[1][1]), None
+        for tag, content in fields[2:]:
+            if tag == 0xa0:
+                curve_oid = decode_oid(unwrap(content, OID)[1])
+            elif tag == 0xa1:
+                public = bytes(unwrap(content, BIT_STRING)[1])[1:]
+        curve = CURVES.get(curve_oid)
+        if curve is None:
+            raise ValueError("Unsupported EC curve {0}, only P-256 and P-384 can sign a JWS".format(curve_oid))
+        point = ec_decode_point(curve, public) if public else ec_multiply(curve, d)
+        return dict(curve=curve, d=d, point=point)
+    raise ValueError("No EC private key found")
+
+
+def load_ec_public_key(pem):
+    """parse a PEM SubjectPublicKeyInfo of a P-256/P-384 key into (curve, point)"""
+    for label, headers, der in pem_blocks(pem):
+        if label != "PUBLIC KEY":
+            continue
+        fields = children(unwrap(der, SEQUENCE)[1])
+        algorithm = children(fields[0][1])
+        if decode_oid(algorithm[0][1]) != EC_PUBLIC_KEY:
+            raise ValueError("Not an EC public key")
+        curve = CURVES.get(decode_oid(algorithm[1][1]))
+        if curve is None:
+            raise ValueError("Unsupported EC curve, only P-256 and P-384 can sign a JWS")
+        return curve, ec_decode_point(curve, bytes(fields[1][1])[1:])
+    raise ValueError("No public key found")
+
+
+def load_rsa_private_key(pem):
+    """parse an unencrypted PKCS#1 or PKCS#8 RSA private key into its numbers"""
+    for label, headers, der in pem_blocks(pem):
+        if "ENCRYPTED" in label or "ENCRYPTED" in headers:
+            raise ValueError("Encrypted private keys are not supported in-process")
+        if label == "PRIVATE KEY":
+            # PrivateKeyInfo: version, algorithm, privateKey OCTET STRING
+            fields = children(unwrap(der, SEQUENCE)[1])
+            if decode_oid(children(fields[1][1])[0][1]) != RSA_ENCRYPTION or fields[2][0] != OCTET_STRING:
+                raise ValueError("Not an RSA private key")
+            der = fields[2][1]
+        elif label != "RSA PRIVATE KEY":
+            continue
+        fields = [decode_int(c) for t, c in children(unwrap(der, SEQUENCE)[1]) if t == INTEGER]
+        if len(fields) < 9:
+            raise ValueError("Malformed RSA private key")
+        version, n, e, d, p, q, dp, dq, qinv = fields[:9]
+        return dict(n=n, e=e, d=d, p=p, q=q, dp=dp, dq=dq, qinv=qinv)
+    raise ValueError("No RSA private key found")
+
+
+def load_rsa_public_key(pem):
+    """(n, e) of an RSA key in PEM: a SubjectPublicKeyInfo, a PKCS#1 public key or an unencrypted private key"""
+    for label, headers, der in pem_blocks(pem):
+        if label == "PUBLIC KEY":
+            fields = children(unwrap(der, SEQUENCE)[1])
+            if decode_oid(children(fields[0][1])[0][1]) != RSA_ENCRYPTION or fields[1][0] != BIT_STRING:
+                raise ValueError("Not an RSA public key")
+            der = bytes(fields[1][1])[1:] # skip the unused-bits byte
+        elif label != "RSA PUBLIC KEY":
+            continue
+        fields = [decode_int(c) for t, c in children(unwrap(der, SEQUENCE)[1]) if t == INTEGER]
+        if len(fields) != 2:
+            raise ValueError("Malformed RSA public key")
+        return fields[0], fields[1]
+    numbers = load_rsa_private_key(pem)
+    return numbers['n'], numbers['e']
+
+
+def rsa_jwk(n, e):
+    """the JWK of an RSA public key, its members already in thumbprint (RFC 7638) order"""
+    return {"e": _b64(int_to_bytes(e)), "kty": "RSA", "n": _b64(int_to_bytes(n))}
+
+
+def account_jwk(pem):
+    """(alg, JWK) of the public half of a PEM account key, RSA or EC, private or public"""
+    curve = account_key_curve(pem)
+    if curve is not None:
+        return curve.alg, ec_jwk(curve, load_ec_private_key(pem)['point'])
+    for label, headers, der in pem_blocks(pem):
+        if label == "PUBLIC KEY" and decode_oid(children(children(unwrap(der, SEQUENCE)[1])[0][1])[0][1]) == EC_PUBLIC_KEY:
+            curve, point = load_ec_public_key(pem)
+            return curve.alg, ec_jwk(curve, point)
+    n, e = load_rsa_public_key(pem)
+    return "RS256", rsa_jwk(n, e)
+
+
+def jwk_thumbprint(jwk):
+    """RFC 7638 thumbprint of a JWK that holds only its required members"""
+    return _b64(hashlib.sha256(json.dumps(jwk, sort_keys=True, separators=(',', ':')).encode('utf8')).digest())
+
+
+class Signer(object):
+    """signs JWS signing input with the account key, `curve` is set for EC keys"""
+    alg = "RS256"
+    backend = None
+    curve = None
+
+    def sign(self, data):
+        raise NotImplementedError
+
+
+class OpenSSLSigner(Signer):
+    """the original backend: one `openssl dgst` process per signature"""
+    backend = "openssl"
+
+    def __init__(self, account_key, curve=None):
+        self.account_key = account_key
+        if curve is not None:
+            self.curve, self.alg = curve, curve.alg
+
+    def sign(self, data):
+        import subprocess # not needed at all by the in-process signers
+        digest = "-" + (self.curve.hash_name if self.curve else "sha256")
+        proc = subprocess.Popen(["openssl", "dgst", digest, "-sign", self.account_key],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate(data)
+        if proc.returncode != 0:
+            raise IOError("OpenSSL Error: {0}".format(err))
+        return ecdsa_der_to_jws(out, self.curve) if self.curve else out
+
+
+class RSASigner(Signer):
+    """RSASSA-PKCS1-v1_5 with SHA-256 in pure python, using CRT and blinding"""
+    backend = "python"
+
+    def __init__(self, numbers):
+        self.numbers = numbers
+        self.size = (numbers['n'].bit_length() + 7) // 8
+
+    def sign(self, data):
+        k, n = self.numbers, self.numbers['n']
+        digest = SHA256_DIGEST_INFO + hashlib.sha256(data).digest()
+        padded = b"\x00\x01" + b"\xff" * (self.size - len(digest) - 3) + b"\x00" + digest
+        m = int_from_bytes(padded)
+        # blind the message so the timing of the private operation leaks nothing useful
+        r = int_from_bytes(os.urandom(self.size)) % n
+        blinded = (m * pow(r, k['e'], n)) % n
+        m1, m2 = pow(blinded, k['dp'], k['p']), pow(blinded, k['dq'], k['q'])
+        s = (m2 + ((k['qinv'] * (m1 - m2)) % k['p']) * k['q']) * _modinv(r, n) % n
+        # a fault in one CRT half gives a signature that reveals a factor of n (Bellcore attack),
+        # so it never leaves here unchecked
+        if pow(s, k['e'], n) != m:
+            raise IOError("RSA signature failed verification, not using it")
+        return int_to_bytes(s, self.size)
+
+
+class ECSigner(Signer):
+    """ES256/ES384 in pure python with RFC 6979 nonces, so the same data always gets the same signature"""
+    backend = "python"
+
+    def __init__(self, numbers):
+        self.numbers = numbers
+        self.curve, self.alg = numbers['curve'], numbers['curve'].alg
+
+    def sign(self, data):
+        return ecdsa_sign(self.curve, self.numbers['d'], data)
+
+
+def _load_libcrypto():
+    import ctypes.util # pulls in subprocess, only needed the first time a key is loaded
+    # macOS aborts the process when the unversioned system libcrypto is loaded
+    path = ctypes.util.find_library("crypto") if sys.platform != "darwin" else None
+    if path is None:
+        return None
+    try:
+        lib = ctypes.CDLL(path)
+    except OSError:
+        return None
+    for name, restype, argtypes in [
+            ("BIO_new_mem_buf", ctypes.c_void_p, [ctypes.c_char_p, ctypes.c_int]),
+            ("BIO_free", ctypes.c_int, [ctypes.c_void_p]),
+            ("PEM_read_bio_PrivateKey", ctypes.c_void_p, [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]),
+            ("EVP_PKEY_free", None, [ctypes.c_void_p]),
+            ("EVP_get_digestbyname", ctypes.c_void_p, [ctypes.c_char_p]),
+            ("EVP_DigestSignInit", ctypes.c_int, [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]),
+            ("EVP_DigestUpdate", ctypes.c_int, [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_size_t]),
+            ("EVP_DigestSignFinal", ctypes.c_int, [ctypes.c_void_p, ctypes.c_char_p, ctypes.POINTER(ctypes.c_size_t)])]:
+        func = getattr(lib, name, None)
+        if func is None:
+            return None
+        func.restype, func.argtypes = restype, argtypes
+    # EVP_MD_CTX_create/destroy were renamed in OpenSSL 1.1
+    lib.md_ctx_new = getattr(lib, "EVP_MD_CTX_new", None) or getattr(lib, "EVP_MD_CTX_create", None)
+    lib.md_ctx_free = getattr(lib, "EVP_MD_CTX_free", None) or getattr(lib, "EVP_MD_CTX_destroy", None)
+    if lib.md_ctx_new is None or lib.md_ctx_free is None:
+        return None
+    lib.md_ctx_new.restype, lib.md_ctx_new.argtypes = ctypes.c_void_p, []
+    lib.md_ctx_free.restype, lib.md_ctx_free.argtypes = None, [ctypes.c_void_p]
+    return lib
+
+_LIBCRYPTO = []
+# never let OpenSSL prompt on the terminal for a passphrase
+_NO_PASSPHRASE = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_int, ctypes.c_void_p)(
+    lambda buf, size, rwflag, userdata: 0)
+
+
+def libcrypto():
+    """the libcrypto ctypes finds on the library path, which need not be the version python's ssl module
+    links against, or None"""
+    if not _LIBCRYPTO:
+        _LIBCRYPTO.append(_load_libcrypto())
+    return _LIBCRYPTO[0]
+
+
+class LibcryptoSigner(Signer):
+    """signs with libcrypto's EVP_DigestSign functions through ctypes, in-process instead of forking
+    `openssl dgst`"""
+    backend = "libcrypto"
+
+    def __init__(self, pem, curve=None):
+        # without a curve EC keys give DER signatures, as X.509 wants them
+        self.lib = libcrypto()
+        if self.lib is None:
+            raise ValueError("libcrypto is not available")
+        if curve is not None:
+            self.curve, self.alg = curve, curve.alg
+        self.digest = self.lib.EVP_get_digestbyname((curve.hash_name if curve else "sha256").encode('ascii'))
+        bio = self.lib.BIO_new_mem_buf(pem, len(pem))
+        try:
+            self.pkey = self.lib.PEM_read_bio_PrivateKey(bio, None, _NO_PASSPHRASE, None)
+        finally:
+            self.lib.BIO_free(bio)
+        if not self.pkey or not self.digest:
+            raise ValueError("libcrypto could not load the account key")
+
+    def sign(self, data):
+        ctx = self.lib.md_ctx_new()
+        try:
+            size = ctypes.c_size_t(0)
+            if (self.lib.EVP_DigestSignInit(ctx, None, self.digest, None, self.pkey) != 1
+                    or self.lib.EVP_DigestUpdate(ctx, data, len(data)) != 1
+                    or self.lib.EVP_DigestSignFinal(ctx, None, ctypes.byref(size)) != 1):
+                raise IOError("libcrypto failed to sign")
+            out = ctypes.create_string_buffer(size.value)
+            if self.lib.EVP_DigestSignFinal(ctx, out, ctypes.byref(size)) != 1:
+                raise IOError("libcrypto failed to sign")
+            out = out.raw[:size.value]
+            return ecdsa_der_to_jws(out, self.curve) if self.curve else out
+        finally:
+            self.lib.md_ctx_free(ctx)
+
+    def __del__(self):
+        if getattr(self, "pkey", None):
+            self.lib.EVP_PKEY_free(self.pkey)
+            self.pkey = None
+
+
+class CryptographySigner(Signer):
+    """uses the `cryptography` package when it is installed"""
+    backend = "cryptography"
+
+    def __init__(self, pem, curve=None):
+        self.key = serialization.load_pem_private_key(pem, password=None, backend=default_backend())
+        if curve is not None:
+            self.curve, self.alg = curve, curve.alg
+
+    def sign(self, data):
+        if self.curve is None:
+            return self.key.sign(data, padding.PKCS1v15(), hashes.SHA256())
+        hash_class = hashes.SHA256 if self.curve.hash_name == "sha256" else hashes.SHA384
+        r, s = utils.decode_dss_signature(self.key.sign(data, ec.ECDSA(hash_class())))
+        return int_to_bytes(r, self.curve.size) + int_to_bytes(s, self.curve.size)
+
+
+BACKENDS = ["auto", "cryptography", "libcrypto", "python", "openssl"]
+# "auto" tries these before falling back to openssl; the pure python signer is
+# slower than forking openssl for big keys, so it is only used when asked for
+AUTO_BACKENDS = ["cryptography", "libcrypto"]
+
+
+def account_key_curve(pem):
+    """the Curve of an EC account key, None for anything else"""
+    for label, headers, der in pem_blocks(pem):
+        if label == "EC PRIVATE KEY":
+            return load_ec_private_key(pem)['curve']
+        if label == "PRIVATE KEY":
+            algorithm = children(children(unwrap(der, SEQUENCE)[1])[1][1])
+            if decode_oid(algorithm[0][1]) != EC_PUBLIC_KEY:
+                return None
+            curve = CURVES.get(decode_oid(algorithm[1][1]))
+            if curve is None:
+                raise ValueError("Unsupported EC curve, only P-256 and P-384 can sign a JWS")
+            return curve
+    return None
+
+
+def load_signer(account_key, backend="auto", log=LOGGER):
+    """read the account key once and return the fastest signer that can use it"""
+    if backend not in BACKENDS:
+        raise ValueError("Unknown signing backend: {0}".format(backend))
+    with open(account_key, "rb") as key_file:
+        pem = key_file.read()
+    # RSA keys sign RS256, P-256 and P-384 keys ES256 and ES384
+    curve = account_key_curve(pem)
+    if backend == "openssl":
+        return OpenSSLSigner(account_key, curve)
+    for candidate in (AUTO_BACKENDS if backend == "auto" else [backend]):
+        try:
+            if candidate == "cryptography":
+                if serialization is None:
+                    raise ValueError("The cryptography package is not installed")
+                return CryptographySigner(pem, curve)
+            if candidate == "libcrypto":
+                return LibcryptoSigner(pem, curve)
+            if curve is not None:
+                return ECSigner(load_ec_private_key(pem))
+            return RSASigner(load_rsa_private_key(pem))
+        except (ValueError, TypeError) as e:
+            if backend != "auto":
+                raise
+            log.debug("Cannot sign with {0}: {1}".format(candidate, e))
+    log.debug("Falling back to openssl for signing")
+    return OpenSSLSigner(account_key, curve)
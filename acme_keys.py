@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# domain keys from a pre-generated pool and CSRs built in-process, so issuance never
+# waits on `openssl genrsa` and `openssl req`
+import argparse, binascii, logging, os, subprocess, sys, threading, time
+from acme_asn1 import (SEQUENCE, SET, BIT_STRING, OCTET_STRING, NULL, OID, UTF8_STRING, pem_blocks, pem_encode,
+    children, unwrap, decode_oid, encode, encode_int, encode_oid)
+from acme_jws import EC_PUBLIC_KEY, RSA_ENCRYPTION, LibcryptoSigner, RSASigner, libcrypto, load_rsa_private_key
+from acme_state import write_atomic
+from acme_x509 import COMMON_NAME, EXTENSION_REQUEST, SUBJECT_ALT_NAME
+try:
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+except ImportError: # optional, keys are generated with openssl and CSRs signed through libcrypto instead
+    serialization = None
+
+LOGGER = logging.getLogger(__name__)
+
+SHA256_WITH_RSA = "1.2.840.113549.1.1.11"
+ECDSA_WITH_SHA256 = "1.2.840.10045.4.3.2"
+# curve name in key types -> (openssl name, OID, cryptography class name)
+CURVES = {
+    "p256": ("P-256", "1.2.840.10045.3.1.7", "SECP256R1"),
+    "p384": ("P-384", "1.3.132.0.34", "SECP384R1"),
+}
+KEY_TYPES = ["rsa:2048", "rsa:3072", "rsa:4096", "ec:p256", "ec:p384"]
+
+
+def parse_key_type(key_type):
+    """"rsa:<bits>" or "ec:<curve>" to ("rsa", bits) or ("ec", curve)"""
+    kind, _, param = key_type.lower().partition(":")
+    if kind == "rsa" and param.isdigit() and int(param) >= 2048:
+        return kind, int(param)
+    if kind == "ec" and param in CURVES:
+        return kind, param
+    raise ValueError("Unsupported key type {0}, use one of {1}".format(key_type, ", ".join(KEY_TYPES)))
+
+
+def generate_key(key_type):
+    """a new unencrypted PKCS#8 PEM private key"""
+    kind, param = parse_key_type(key_type)
+    if serialization is not None:
+        if kind == "rsa":
+            key = rsa.generate_private_key(65537, param, default_backend())
+        else:
+            key = ec.generate_private_key(getattr(ec, CURVES[param][2])(), default_backend())
+        return key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption())
+    if kind == "rsa":
+        options = ["-algorithm", "RSA", "-pkeyopt", "rsa_keygen_bits:{0}".format(param)]
+    else:
+        options = ["-algorithm", "EC", "-pkeyopt", "ec_paramgen_curve:" + CURVES[param][0],
+            "-pkeyopt", "ec_param_enc:named_curve"]
+    proc = subprocess.Popen(["openssl", "genpkey"] + options, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    if proc.returncode != 0:
+        raise IOError("OpenSSL Error: {0}".format(err))
+    return out
+
+
+def public_key_info(pem):
+    """return ("rsa" or "ec", DER SubjectPublicKeyInfo) of a PEM private key"""
+    for label, headers, der in pem_blocks(pem):
+        if "ENCRYPTED" in label or "ENCRYPTED" in headers:
+            raise ValueError("Encrypted private keys are not supported")
+        curve = None
+        if label == "PRIVATE KEY":
+            fields = children(unwrap(der, SEQUENCE)[1])
+            algorithm = children(fields[1][1])
+            if decode_oid(algorithm[0][1]) == RSA_ENCRYPTION:
+                label = "RSA PRIVATE KEY"
+            elif decode_oid(algorithm[0][1]) == EC_PUBLIC_KEY:
+                label, der, curve = "EC PRIVATE KEY", fields[2][1], decode_oid(algorithm[1][1])
+            else:
+                raise ValueError("Only RSA and EC keys are supported")
+        if label == "RSA PRIVATE KEY":
+            numbers = load_rsa_private_key(pem)
+            algorithm = encode(SEQUENCE, encode_oid(RSA_ENCRYPTION) + encode(NULL, b""))
+            key = encode(SEQUENCE, encode_int(numbers['n']) + encode_int(numbers['e']))
+            return "rsa", encode(SEQUENCE, algorithm + encode(BIT_STRING, b"\x00" + key))
+        if label == "EC PRIVATE KEY":
+            # ECPrivateKey: version, privateKey, [0] parameters, [1] publicKey
+            point = None
+            for tag, content in children(unwrap(der, SEQUENCE)[1])[2:]:
+                if tag == 0xa0:
+                    curve = decode_oid(unwrap(content, OID)[1])
+                elif tag == 0xa1:
+                    point = unwrap(content, BIT_STRING)[1]
+            if curve is None or point is None:
+                raise ValueError("EC key without curve or public key")
+            algorithm = encode(SEQUENCE, encode_oid(EC_PUBLIC_KEY) + encode_oid(curve))
+            return "ec", encode(SEQUENCE, algorithm + encode(BIT_STRING, point))
+    raise ValueError("No private key found")
+
+
+def _sign(pem, kind, data):
+    if serialization is not None:
+        key = serialization.load_pem_private_key(pem, password=None, backend=default_backend())
+        if kind == "rsa":
+            return key.sign(data, padding.PKCS1v15(), hashes.SHA256())
+        return key.sign(data, ec.ECDSA(hashes.SHA256()))
+    if libcrypto() is not None:
+        # EVP_DigestSign gives PKCS#1 v1.5 for RSA and a DER ECDSA-Sig-Value for EC keys
+        return LibcryptoSigner(pem).sign(data)
+    if kind == "rsa":
+        return RSASigner(load_rsa_private_key(pem)).sign(data)
+    raise ValueError("Signing with an EC key needs libcrypto or the cryptography package")
+
+
+def make_csr(key_pem, domains):
+    """DER PKCS#10 request for domains (the first one is also the CN), signed with key_pem"""
+    if not domains:
+        raise ValueError("A CSR needs at least one domain")
+    kind, spki = public_key_info(key_pem)
+    # the CN is limited to 64 characters, the SAN carries all names anyway
+    subject = b""
+    if len(domains[0]) <= 64:
+        subject = encode(SET, encode(SEQUENCE, encode_oid(COMMON_NAME) + encode(UTF8_STRING, domains[0].encode('utf8'))))
+    sans = encode(SEQUENCE, b"".join(encode(0x82, d.encode('ascii')) for d in domains))
+    extensions = encode(SEQUENCE, encode(SEQUENCE, encode_oid(SUBJECT_ALT_NAME) + encode(OCTET_STRING, sans)))
+    attributes = encode(0xa0, encode(SEQUENCE, encode_oid(EXTENSION_REQUEST) + encode(SET, extensions)))
+    info = encode(SEQUENCE, encode_int(0) + encode(SEQUENCE, subject) + spki + attributes)
+    if kind == "rsa":
+        algorithm = encode(SEQUENCE, encode_oid(SHA256_WITH_RSA) + encode(NULL, b""))
+    else:
+        algorithm = encode(SEQUENCE, encode_oid(ECDSA_WITH_SHA256))
+    return encode(SEQUENCE, info + algorithm + encode(BIT_STRING, b"\x00" + _sign(key_pem, kind, info)))
+
+
+class KeyPool(object):
+    """Private keys of one type generated ahead of time into a directory.
+
+    Keys live in <directory>/<type>/ as 0600 files in a 0700 directory and
+    are claimed with an atomic rename, so several processes can share a pool
+    without ever handing out the same key twice. start() keeps `size` keys
+    in stock from `workers` background threads; take() only generates a key
+    itself when the pool has run dry. Keys a crashed process had claimed or
+    was writing are removed once they are `stale_after` seconds old.
+    """
+
+    def __init__(self, directory, key_type="rsa:2048", size=4, workers=1, stale_after=60, log=LOGGER):
+        kind, param = parse_key_type(key_type)
+        self.key_type = "{0}:{1}".format(kind, param)
+        self.path = os.path.join(directory, "{0}-{1}".format(kind, param))
+        self.size, self.workers, self.stale_after, self.log = size, workers, stale_after, log
+        self.generated = 0 # keys made by the refill threads
+        self.generated_inline = 0 # keys take() had to wait for
+        self._cond = threading.Condition()
+        self._stop = False
+        self._threads = []
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path, 0o700)
+        os.chmod(self.path, 0o700)
+        self.sweep()
+
+    def _keys(self):
+        return sorted(name for name in os.listdir(self.path) if name.endswith(".pem") and not name.startswith("."))
+
+    def available(self):
+        return len(self._keys())
+
+    def sweep(self, now=None):
+        """remove the claimed keys and half written ones a process left behind when it died, returns how many"""
+        now = time.time() if now is None else now
+        removed = 0
+        for name in os.listdir(self.path):
+            # .<key>.claimed between take()'s rename and remove, .<key>.<random> while write_atomic() writes
+            if not name.startswith("."):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                # a rename only changes the ctime, the mtime is when the key was generated
+                st = os.stat(path)
+                if max(st.st_mtime, st.st_ctime) > now - self.stale_after:
+                    continue
+                os.remove(path)
+                removed += 1
+            except OSError:
+                continue # taken care of by another process
+        if removed:
+            self.log.info("Removed {0} stale key file(s) from {1}".format(removed, self.path))
+        return removed
+
+    def _store(self, pem):
+        write_atomic(os.path.join(self.path, binascii.hexlify(os.urandom(8)).decode('ascii') + ".pem"), pem, mode=0o600)
+
+    def take(self):
+        """claim a key from the pool, returns its PEM"""
+        for name in self._keys():
+            claimed = os.path.join(self.path, ".{0}.claimed".format(name))
+            try:
+                os.rename(os.path.join(self.path, name), claimed)
+            except OSError:
+                continue # another process got it first
+            try:
+                with open(claimed, "rb") as key_file:
+                    return key_file.read()
+            finally:
+                os.remove(claimed)
+                with self._cond:
+                    self._cond.notify_all()
+        self.log.warning("Key pool {0} is empty, generating a {1} key inline".format(self.path, self.key_type))
+        self.generated_inline += 1
+        return generate_key(self.key_type)
+
+    def fill(self):
+        """generate keys until the pool holds `size` of them"""
+        self.sweep()
+        while self.available() < self.size:
+            self._store(generate_key(self.key_type))
+            self.generated += 1
+
+    def _refill(self):
+        while True:
+            with self._cond:
+                while not self._stop and self.available() + self._busy >= self.size:
+                    # also look again now and then for keys taken by other processes
+                    self._cond.wait(60)
+                if self._stop:
+                    return
+                self._busy += 1
+            try:
+                self._store(generate_key(self.key_type))
+                self.generated += 1
+            except (IOError, OSError, ValueError) as e:
+                self.log.error("Generating a {0} key failed: {1}".format(self.key_type, e))
+                with self._cond:
+                    self._cond.wait(60)
+            finally:
+                with self._cond:
+                    self._busy -= 1
+
+    def start(self):
+        self._stop, self._busy = False, 0
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._refill, name="acme-keypool-{0}".format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def new_key_and_csr(domains, keys=None, key_type="rsa:2048"):
+    """return (key PEM, DER CSR) for domains, the key comes from the KeyPool `keys` when given"""
+    key_pem = keys.take() if keys is not None else generate_key(key_type)
+    return key_pem, make_csr(key_pem, domains)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Fill a domain key pool, or make a key and CSR from it")
+    parser.add_argument("--pool-dir", required=True, help="directory holding the pre-generated keys")
+    parser.add_argument("--key-type", default="rsa:2048", help="one of {0}, default rsa:2048".format(", ".join(KEY_TYPES)))
+    parser.add_argument("--size", type=int, default=4, help="keys to keep in the pool, default 4")
+    parser.add_argument("--fill", action="store_true", help="top the pool up to --size keys and exit")
+    parser.add_argument("--domains", help="comma separated names for a new CSR")
+    parser.add_argument("--key-out", help="where the domain key for --domains goes")
+    parser.add_argument("--csr-out", help="where the PEM CSR for --domains goes")
+    args = parser.parse_args(argv)
+
+    LOGGER.addHandler(logging.StreamHandler())
+    pool = KeyPool(args.pool_dir, args.key_type, size=args.size)
+    if args.fill:
+        pool.fill()
+        sys.stderr.write("{0} {1} keys in {2}\n".format(pool.available(), pool.key_type, pool.path))
+    if args.domains:
+        if not args.key_out or not args.csr_out:
+            parser.error("--domains needs --key-out and --csr-out")
+        key_pem, csr_der = new_key_and_csr(args.domains.split(","), pool)
+        write_atomic(args.key_out, key_pem, mode=0o600)
+        write_atomic(args.csr_out, pem_encode(csr_der, "CERTIFICATE REQUEST"))
+
+if __name__ == "__main__": # pragma: no cover
+    main(sys.argv[1:])
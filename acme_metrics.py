@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# per-run timings and counters, written as JSON or as a Prometheus textfile
+import contextlib, json, threading, time
+from acme_state import write_atomic
+
+# upper bounds of the latency histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    "phase_seconds": "Wall time spent in each phase of issuance.",
+    "phase_runs": "Times each phase of issuance ran.",
+    "http_requests": "HTTP requests sent, to the CA and for the challenge self-checks.",
+    "http_request_seconds": "HTTP request latency including reading the response.",
+    "openssl_spawns": "openssl processes started.",
+    "signatures": "JWS signatures made with the account key.",
+    "challenge_polls": "Challenge status polls.",
+    "nonces_fetched": "Replay-Nonces that needed a request of their own.",
+    "nonces_reused": "Replay-Nonces taken from earlier CA responses.",
+    "certificates_issued": "Certificates issued.",
+    "certificates_failed": "Certificates that could not be issued.",
+    "ocsp_fetched": "OCSP responses fetched and installed for stapling.",
+    "ocsp_failed": "OCSP responses that could not be fetched or did not verify.",
+    "rate_limited": "Jobs the CA turned away with a 429 or 503.",
+    "jobs_retried": "Jobs tried again after being rate limited.",
+    "last_run_success": "1 if every certificate of the last run was issued.",
+    "last_run_timestamp_seconds": "When the last run finished.",
+}
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Metrics(object):
+    """Thread-safe counters, gauges, latency histograms and phase timers of one run.
+
+    Labels are keyword arguments, e.g. count("http_requests", method="POST").
+    Counters and histograms only ever grow while the object lives; write the
+    summary out at the end of a run.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {} # name -> {label key: value}
+        self._gauges = {}
+        self._histograms = {} # name -> {label key: [bucket counts..., sum, count]}
+        self.started = time.time()
+
+    def count(self, name, value=1, **labels):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.setdefault(_label_key(labels), [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """time the block as one run of phase `name`, also when it raises"""
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.count("phase_seconds", time.time() - started, phase=name)
+            self.count("phase_runs", phase=name)
+
+    def summary(self):
+        """everything recorded, as a JSON-friendly dict"""
+        def _series(values):
+            if list(values) == [()]:
+                return values[()]
+            return dict((",".join("{0}={1}".format(k, v) for k, v in key), value) for key, value in values.items())
+
+        with self._lock:
+            phases = {}
+            for key, seconds in self._counters.get("phase_seconds", {}).items():
+                phase = dict(key)["phase"]
+                phases[phase] = {"seconds": seconds, "runs": self._counters["phase_runs"][key]}
+            histograms = {}
+            for name, series in self._histograms.items():
+                histograms[name] = _series(dict((key, {
+                    "buckets": dict(("{0:g}".format(bound), h[i]) for i, bound in enumerate(self.buckets)),
+                    "sum": h[-2], "count": h[-1]}) for key, h in series.items()))
+            return {
+                "started": self.started,
+                "seconds": time.time() - self.started,
+                "phases": phases,
+                "counters": dict((name, _series(series)) for name, series in self._counters.items()
+                    if name not in ("phase_seconds", "phase_runs")),
+                "gauges": dict((name, _series(series)) for name, series in self._gauges.items()),
+                "histograms": histograms,
+            }
+
+    def prometheus(self, prefix="acme_", labels=None):
+        """the text exposition format, `labels` are added to every sample"""
+        def _labels(key, extra=()):
+            pairs = sorted((labels or {}).items()) + list(key) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join('{0}="{1}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                for k, v in pairs) + "}"
+
+        lines = []
+        with self._lock:
+            for kind, store, suffix in (("counter", self._counters, "_total"), ("gauge", self._gauges, "")):
+                for name in sorted(store):
+                    metric = prefix + name + suffix
+                    lines.append("# HELP {0} {1}".format(metric, HELP.get(name, name)))
+                    lines.append("# TYPE {0} {1}".format(metric, kind))
+                    for key, value in sorted(store[name].items()):
+                        lines.append("{0}{1} {2!r}".format(metric, _labels(key), value))
+            for name in sorted(self._histograms):
+                metric = prefix + name
+                lines.append("# HELP {0} {1}".format(metric, HELP.get(name, name)))
+                lines.append("# TYPE {0} histogram".format(metric))
+                for key, h in sorted(self._histograms[name].items()):
+                    for i, bound in enumerate(self.buckets):
+                        lines.append("{0}_bucket{1} {2}".format(metric, _labels(key, [("le", "{0:g}".format(bound))]), h[i]))
+                    lines.append("{0}_bucket{1} {2}".format(metric, _labels(key, [("le", "+Inf")]), h[-1]))
+                    lines.append("{0}_sum{1} {2!r}".format(metric, _labels(key), h[-2]))
+                    lines.append("{0}_count{1} {2}".format(metric, _labels(key), h[-1]))
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path):
+        write_atomic(path, json.dumps(self.summary(), indent=1, sort_keys=True) + "\n")
+
+    def write_prometheus(self, path, prefix="acme_", labels=None):
+        # the node exporter textfile collector must never see a half written file
+        write_atomic(path, self.prometheus(prefix=prefix, labels=labels))
+
+    def finish(self, success):
+        self.gauge("last_run_success", 1 if success else 0)
+        self.gauge("last_run_timestamp_seconds", int(time.time()))
+
+
+def write_reports(metrics, json_path=None, prometheus_path=None):
+    """write the summary to whichever of the two outputs the command line asked for"""
+    if json_path:
+        metrics.write_json(json_path)
+    if prometheus_path:
+        metrics.write_prometheus(prometheus_path)
@@ -0,0 +1,527 @@
+#!/usr/bin/env python
+# a local stand-in for the ACME v1 (Boulder) CA, to exercise and benchmark the clients offline
+import argparse, base64, hashlib, json, logging, os, random, subprocess, sys, threading, time, uuid
+try:
+    from http.client import HTTPConnection # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from httplib import HTTPConnection # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+from acme_asn1 import (SEQUENCE, SET, BIT_STRING, OCTET_STRING, NULL, UTF8_STRING, children, unwrap,
+    int_from_bytes, int_to_bytes, encode, encode_int, encode_oid, encode_time)
+from acme_jws import (RSA_ENCRYPTION, SHA256_DIGEST_INFO, CURVES_BY_NAME, RSASigner, ec_decode_point, ecdsa_verify,
+    load_rsa_private_key)
+from acme_responder import CHALLENGE_PATH, parse_listen
+from acme_x509 import (COMMON_NAME, SUBJECT_ALT_NAME, AUTHORITY_INFO_ACCESS, OCSP, CA_ISSUERS, URI, parse_csr,
+    parse_certificate)
+
+LOGGER = logging.getLogger(__name__)
+
+SHA256_WITH_RSA = encode(SEQUENCE, encode_oid("1.2.840.113549.1.1.11") + encode(NULL, b""))
+BASIC_CONSTRAINTS = "2.5.29.19"
+BOOLEAN = 0x01
+ENUMERATED = 0x0a
+OCSP_BASIC = "1.3.6.1.5.5.7.48.1.1"
+
+
+def _b64(b):
+    return base64.urlsafe_b64encode(b).decode('utf8').replace("=", "")
+
+
+def _b64decode(s):
+    s = s.encode('ascii') if not isinstance(s, bytes) else s
+    return base64.urlsafe_b64decode(s + b"=" * (-len(s) % 4))
+
+
+def _rfc3339(seconds):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(seconds))
+
+
+def _name(common_name):
+    attribute = encode(SEQUENCE, encode_oid(COMMON_NAME) + encode(UTF8_STRING, common_name.encode('utf8')))
+    return encode(SEQUENCE, encode(SET, attribute))
+
+
+def _extension(oid, value, critical=False):
+    flag = encode(BOOLEAN, b"\xff") if critical else b""
+    return encode(SEQUENCE, encode_oid(oid) + flag + encode(OCTET_STRING, value))
+
+
+class _Problem(Exception):
+    """an ACME error document to answer with"""
+
+    def __init__(self, code, kind, detail, headers=None):
+        Exception.__init__(self, detail)
+        self.code, self.kind, self.detail, self.headers = code, kind, detail, headers or {}
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        self.server.ca._count("connections")
+        BaseHTTPRequestHandler.setup(self)
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        code, headers, content = self.server.ca.handle(self.command, self.path, body)
+        self.send_response(code)
+        for name, value in sorted(headers.items()):
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(content)
+
+    def handle(self):
+        try:
+            BaseHTTPRequestHandler.handle(self)
+        except (IOError, OSError) as e:
+            # clients hang up on kept-alive connections whenever they like
+            LOGGER.debug("{0} went away: {1}".format(self.address_string(), e))
+
+    do_GET = do_HEAD = do_POST = _handle
+
+    def log_message(self, fmt, *args):
+        LOGGER.debug("{0} {1}".format(self.address_string(), fmt % args))
+
+
+class MockCA(object):
+    """An in-memory ACME v1 CA with the endpoints the clients use.
+
+    It implements directory, new-reg, new-authz, challenge, new-cert and
+    revoke-cert, plus an OCSP responder at /ocsp that signs a response valid
+    for `ocsp_validity` seconds for each certificate it issued. JWS signatures and single-use nonces are checked, HTTP-01
+    challenges are fetched for real (from `validation_host` instead of the
+    domain when set), and certificates are issued and signed in-process.
+
+    Failures are injected at random with the given rates: 500 serverInternal
+    and 429 rateLimited answers to POSTs, badNonce for otherwise good nonces
+    and challenges that come back invalid. Every response is delayed by
+    `latency` seconds. stats() counts requests per endpoint and connections.
+    """
+
+    def __init__(self, address=("127.0.0.1", 0), ca_key=None, latency=0.0, error_rate=0.0, bad_nonce_rate=0.0,
+            throttle_rate=0.0, invalid_rate=0.0, validation_delay=0.0, validate=True, http_port=80,
+            validation_host=None, cert_days=90, ocsp_validity=4 * 86400, seed=None, log=LOGGER):
+        self.address = address
+        self.latency, self.validation_delay = latency, validation_delay
+        self.error_rate, self.bad_nonce_rate, self.throttle_rate = error_rate, bad_nonce_rate, throttle_rate
+        self.invalid_rate = invalid_rate
+        self.validate, self.http_port, self.validation_host = validate, http_port, validation_host
+        self.cert_days, self.ocsp_validity = cert_days, ocsp_validity
+        self.log = log
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._nonces = set()
+        self._accounts = {} # thumbprint -> registration id
+        self._authzs = {} # authz id -> authorization
+        self._challenges = {} # challenge id -> authz id
+        self._certificates = {} # serial -> certificate record
+        self._stats = {}
+        self._server = self._thread = None
+
+        if ca_key is None:
+            proc = subprocess.Popen(["openssl", "genrsa", "2048"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            pem, err = proc.communicate()
+            if proc.returncode != 0:
+                raise IOError("OpenSSL Error: {0}".format(err))
+        else:
+            with open(ca_key, "rb") as key_file:
+                pem = key_file.read()
+        numbers = load_rsa_private_key(pem)
+        self.signer = RSASigner(numbers)
+        self.issuer_name = _name("Mock ACME CA")
+        rsa_key = encode(SEQUENCE, encode_int(numbers['n']) + encode_int(numbers['e']))
+        spki = encode(SEQUENCE, encode(SEQUENCE, encode_oid(RSA_ENCRYPTION) + encode(NULL, b""))
+            + encode(BIT_STRING, b"\x00" + rsa_key))
+        # the responder is identified by the hash of the key, as in the CertIDs it answers for
+        self.key_hash = hashlib.sha1(rsa_key).digest()
+        self.name_hash = hashlib.sha1(self.issuer_name).digest()
+        now = time.time()
+        self.certificate_der = self._sign_certificate(1, self.issuer_name, now - 3600, now + 10 * 365 * 86400, spki,
+            _extension(BASIC_CONSTRAINTS, encode(SEQUENCE, encode(BOOLEAN, b"\xff")), critical=True))
+
+    # --- server lifecycle ---
+
+    @property
+    def base_url(self):
+        host, port = (self._server.server_address if self._server is not None else self.address)[:2]
+        host = "127.0.0.1" if host in ("", "0.0.0.0") else host
+        return "http://{0}:{1}".format(host, port)
+
+    def start(self):
+        if self._server is not None:
+            return self
+        self._server = _ThreadingHTTPServer(self.address, _MockHandler)
+        self._server.ca = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name="acme-mockca")
+        self._thread.daemon = True
+        self._thread.start()
+        self.log.debug("Mock CA listening on {0}".format(self.base_url))
+        return self
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {}
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] = self._stats.get(key, 0) + 1
+
+    # --- request handling ---
+
+    def handle(self, method, path, body):
+        """answer one request, returns (status code, headers, body)"""
+        path = path.split("?", 1)[0]
+        self._count("requests")
+        self._count("{0} {1}".format(method, "/".join(path.split("/")[:3])))
+        if self.latency:
+            time.sleep(self.latency)
+        headers = {"Replay-Nonce": self._new_nonce()}
+        try:
+            if method == "HEAD":
+                code, result, extra = 200, b"", {}
+            elif method == "GET":
+                code, result, extra = self._get(path)
+            elif method == "POST" and path == "/ocsp":
+                code, result, extra = 200, self._ocsp(body), {"Content-Type": "application/ocsp-response"}
+            elif method == "POST":
+                code, result, extra = self._post(path, body)
+            else:
+                raise _Problem(405, "malformed", "Method not allowed")
+        except _Problem as e:
+            code, extra = e.code, e.headers
+            result = {"type": "urn:acme:error:" + e.kind, "detail": e.detail, "status": e.code}
+            headers["Content-Type"] = "application/problem+json"
+        headers.update(extra)
+        if isinstance(result, bytes):
+            headers.setdefault("Content-Type", "application/pkix-cert" if result else "text/plain")
+        else:
+            headers.setdefault("Content-Type", "application/json")
+            result = json.dumps(result).encode('utf8')
+        return code, headers, result
+
+    def _new_nonce(self):
+        nonce = _b64(os.urandom(16))
+        with self._lock:
+            self._nonces.add(nonce)
+        return nonce
+
+    def _get(self, path):
+        base = self.base_url
+        if path == "/directory":
+            return 200, {
+                "new-reg": base + "/acme/new-reg", "new-authz": base + "/acme/new-authz",
+                "new-cert": base + "/acme/new-cert", "revoke-cert": base + "/acme/revoke-cert",
+                "meta": {"terms-of-service": base + "/terms"},
+            }, {}
+        if path.startswith("/acme/authz/"):
+            authz = self._authzs.get(path[len("/acme/authz/"):])
+            if authz is not None:
+                return 200, self._authz_json(authz), {}
+        if path.startswith("/acme/challenge/"):
+            authz_id = self._challenges.get(path[len("/acme/challenge/"):])
+            if authz_id is not None:
+                authz = self._authzs[authz_id]
+                return 202, self._challenge_json(authz), {"Link": '<{0}/acme/authz/{1}>;rel="up"'.format(base, authz_id)}
+        if path.startswith("/acme/cert/"):
+            record = self._certificates.get(path[len("/acme/cert/"):])
+            if record is not None:
+                return 200, record["der"], {}
+        if path == "/acme/issuer-cert":
+            return 200, self.certificate_der, {}
+        raise _Problem(404, "malformed", "Not found")
+
+    def _post(self, path, body):
+        if self.throttle_rate and self._random.random() < self.throttle_rate:
+            raise _Problem(429, "rateLimited", "Too many requests", headers={"Retry-After": "1"})
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise _Problem(500, "serverInternal", "Injected failure")
+        thumbprint, jwk, payload = self._verify(body)
+        resource = payload.get("resource")
+        if path == "/acme/new-reg" and resource == "new-reg":
+            return self._new_reg(thumbprint, jwk)
+        if thumbprint not in self._accounts:
+            raise _Problem(403, "unauthorized", "No registration exists matching provided key")
+        if path == "/acme/new-authz" and resource == "new-authz":
+            return self._new_authz(thumbprint, payload)
+        if path.startswith("/acme/challenge/") and resource == "challenge":
+            return self._respond_challenge(thumbprint, path[len("/acme/challenge/"):], payload)
+        if path == "/acme/new-cert" and resource == "new-cert":
+            return self._new_cert(thumbprint, payload)
+        if path == "/acme/revoke-cert" and resource == "revoke-cert":
+            return self._revoke_cert(thumbprint, payload)
+        raise _Problem(400, "malformed", "Unexpected resource {0} for {1}".format(resource, path))
+
+    def _verify(self, body):
+        """check the JWS signature and nonce, returns (thumbprint, jwk, payload)"""
+        try:
+            jws = json.loads(body.decode('utf8'))
+            protected = json.loads(_b64decode(jws["protected"]).decode('utf8'))
+            jwk = protected.get("jwk") or jws.get("header", {}).get("jwk")
+            payload = json.loads(_b64decode(jws["payload"]).decode('utf8'))
+            signature = _b64decode(jws["signature"])
+        except (ValueError, KeyError, TypeError, AttributeError):
+            raise _Problem(400, "malformed", "Parse error reading JWS")
+        signing_input = "{0}.{1}".format(jws["protected"], jws["payload"]).encode('utf8')
+        if not self._signature_valid(jwk, protected.get("alg"), signing_input, signature):
+            raise _Problem(400, "malformed", "JWS verification error")
+        nonce = protected.get("nonce")
+        with self._lock:
+            known = nonce in self._nonces
+            self._nonces.discard(nonce)
+        if not known or (self.bad_nonce_rate and self._random.random() < self.bad_nonce_rate):
+            raise _Problem(400, "badNonce", "JWS has invalid anti-replay nonce {0}".format(nonce))
+        # RFC 7638: only the required members of the key go into the thumbprint
+        members = ("e", "kty", "n") if jwk["kty"] == "RSA" else ("crv", "kty", "x", "y")
+        key = json.dumps(dict((m, jwk[m]) for m in members), sort_keys=True, separators=(',', ':'))
+        return _b64(hashlib.sha256(key.encode('utf8')).digest()), jwk, payload
+
+    def _signature_valid(self, jwk, alg, signing_input, signature):
+        """RS256 with RSA keys, ES256 and ES384 with P-256 and P-384 keys"""
+        kty = (jwk or {}).get("kty")
+        curve = CURVES_BY_NAME.get(jwk.get("crv")) if kty == "EC" else None
+        if not (kty == "RSA" and alg == "RS256") and not (curve is not None and alg == curve.alg):
+            raise _Problem(400, "badSignatureAlgorithm", "Only RS256 with RSA keys and ES256/ES384 with P-256/P-384 "
+                "keys are supported")
+        try:
+            if curve is not None:
+                x, y = _b64decode(jwk["x"]), _b64decode(jwk["y"])
+                return ecdsa_verify(curve, ec_decode_point(curve, b"\x04" + x + y), signing_input, signature)
+            n, e = int_from_bytes(_b64decode(jwk["n"])), int_from_bytes(_b64decode(jwk["e"]))
+        except (ValueError, KeyError, TypeError):
+            raise _Problem(400, "malformed", "Invalid JWK")
+        size = (n.bit_length() + 7) // 8
+        digest = SHA256_DIGEST_INFO + hashlib.sha256(signing_input).digest()
+        expected = b"\x00\x01" + b"\xff" * (size - len(digest) - 3) + b"\x00" + digest
+        return len(signature) == size and int_to_bytes(pow(int_from_bytes(signature), e, n), size) == expected
+
+    def _new_reg(self, thumbprint, jwk):
+        with self._lock:
+            existing = self._accounts.get(thumbprint)
+            if existing is None:
+                self._accounts[thumbprint] = len(self._accounts) + 1
+        location = {"Location": "{0}/acme/reg/{1}".format(self.base_url, self._accounts[thumbprint])}
+        if existing is not None:
+            raise _Problem(409, "malformed", "Registration key is already in use", headers=location)
+        location["Link"] = '<{0}/terms>;rel="terms-of-service"'.format(self.base_url)
+        return 201, {"id": self._accounts[thumbprint], "key": jwk}, location
+
+    def _new_authz(self, thumbprint, payload):
+        identifier = payload.get("identifier") or {}
+        if identifier.get("type") != "dns" or not identifier.get("value"):
+            raise _Problem(400, "malformed", "Invalid identifier")
+        authz = {
+            "id": uuid.uuid4().hex, "challenge_id": uuid.uuid4().hex, "thumbprint": thumbprint,
+            "domain": identifier["value"], "token": _b64(os.urandom(32)), "status": "pending",
+            "expires": time.time() + 7 * 86400, "keyAuthorization": None,
+        }
+        with self._lock:
+            self._authzs[authz["id"]] = authz
+            self._challenges[authz["challenge_id"]] = authz["id"]
+        location = "{0}/acme/authz/{1}".format(self.base_url, authz["id"])
+        return 201, self._authz_json(authz), {"Location": location}
+
+    def _authz_json(self, authz):
+        return {
+            "identifier": {"type": "dns", "value": authz["domain"]}, "status": authz["status"],
+            "expires": _rfc3339(authz["expires"]), "challenges": [self._challenge_json(authz)],
+        }
+
+    def _challenge_json(self, authz):
+        challenge = {
+            "type": "http-01", "status": authz["status"], "token": authz["token"],
+            "uri": "{0}/acme/challenge/{1}".format(self.base_url, authz["challenge_id"]),
+        }
+        if authz["keyAuthorization"] is not None:
+            challenge["keyAuthorization"] = authz["keyAuthorization"]
+        return challenge
+
+    def _respond_challenge(self, thumbprint, challenge_id, payload):
+        authz = self._authzs.get(self._challenges.get(challenge_id))
+        if authz is None or authz["thumbprint"] != thumbprint:
+            raise _Problem(404, "malformed", "No such challenge")
+        if authz["status"] == "pending" and authz["keyAuthorization"] is None:
+            authz["keyAuthorization"] = payload.get("keyAuthorization")
+            if self.validation_delay:
+                timer = threading.Timer(self.validation_delay, self._validate, (authz,))
+                timer.daemon = True
+                timer.start()
+            else:
+                self._validate(authz)
+        return 202, self._challenge_json(authz), {
+            "Link": '<{0}/acme/authz/{1}>;rel="up"'.format(self.base_url, authz["id"])}
+
+    def _validate(self, authz):
+        expected = "{0}.{1}".format(authz["token"], authz["thumbprint"])
+        valid = authz["keyAuthorization"] == expected
+        if valid and self.validate:
+            connection = HTTPConnection(self.validation_host or authz["domain"], self.http_port, timeout=10)
+            try:
+                connection.request("GET", CHALLENGE_PATH + authz["token"], headers={"Host": authz["domain"]})
+                response = connection.getresponse()
+                valid = response.status == 200 and response.read().decode('utf8').strip() == expected
+            except (IOError, ValueError) as e:
+                self.log.debug("Validating {0} failed: {1}".format(authz["domain"], e))
+                valid = False
+            finally:
+                connection.close()
+        if valid and self.invalid_rate and self._random.random() < self.invalid_rate:
+            valid = False
+        if valid:
+            authz["expires"] = time.time() + 30 * 86400
+        authz["status"] = "valid" if valid else "invalid"
+
+    def _new_cert(self, thumbprint, payload):
+        try:
+            csr = _b64decode(payload["csr"])
+            common_names, sans = parse_csr(csr)
+            spki = children(children(unwrap(csr, SEQUENCE)[1])[0][1])[2]
+        except (KeyError, ValueError, IndexError, TypeError, UnicodeDecodeError):
+            raise _Problem(400, "malformed", "Error parsing certificate request")
+        domains = sorted(set(common_names) | set(sans))
+        now = time.time()
+        with self._lock:
+            authorized = set(a["domain"] for a in self._authzs.values()
+                if a["thumbprint"] == thumbprint and a["status"] == "valid" and a["expires"] > now)
+        missing = [d for d in domains if d not in authorized]
+        if not domains or missing:
+            raise _Problem(403, "unauthorized",
+                "Authorizations for these names not found or expired: {0}".format(", ".join(missing)))
+        serial = int_from_bytes(os.urandom(16)) >> 1
+        der = self._sign_certificate(serial, _name(common_names[0] if common_names else domains[0]),
+            now - 3600, now + self.cert_days * 86400, encode(*spki),
+            _extension(SUBJECT_ALT_NAME, encode(SEQUENCE, b"".join(encode(0x82, d.encode('ascii')) for d in domains))),
+            _extension(AUTHORITY_INFO_ACCESS, encode(SEQUENCE,
+                encode(SEQUENCE, encode_oid(OCSP) + encode(URI, (self.base_url + "/ocsp").encode('ascii')))
+                + encode(SEQUENCE, encode_oid(CA_ISSUERS)
+                    + encode(URI, (self.base_url + "/acme/issuer-cert").encode('ascii'))))))
+        key = "{0:x}".format(serial)
+        with self._lock:
+            self._certificates[key] = {"der": der, "thumbprint": thumbprint, "revoked": None}
+        return 201, der, {
+            "Location": "{0}/acme/cert/{1}".format(self.base_url, key),
+            "Link": '<{0}/acme/issuer-cert>;rel="up"'.format(self.base_url),
+        }
+
+    def _sign_certificate(self, serial, subject, not_before, not_after, spki, *extensions):
+        tbs = encode(SEQUENCE, b"".join([
+            encode(0xa0, encode_int(2)), encode_int(serial), SHA256_WITH_RSA, self.issuer_name,
+            encode(SEQUENCE, encode_time(not_before) + encode_time(not_after)), subject, spki,
+            encode(0xa3, encode(SEQUENCE, b"".join(extensions))),
+        ]))
+        return encode(SEQUENCE, tbs + SHA256_WITH_RSA + encode(BIT_STRING, b"\x00" + self.signer.sign(tbs)))
+
+    def _revoke_cert(self, thumbprint, payload):
+        try:
+            serial = parse_certificate(_b64decode(payload["certificate"]))["serial"]
+        except (KeyError, ValueError, IndexError, TypeError, UnicodeDecodeError):
+            raise _Problem(400, "malformed", "Error parsing certificate")
+        with self._lock:
+            record = self._certificates.get(serial)
+            if record is None:
+                raise _Problem(404, "malformed", "Certificate not found")
+            if record["thumbprint"] != thumbprint:
+                raise _Problem(403, "unauthorized", "Revocation requests must come from the issuing account")
+            if record["revoked"] is not None:
+                raise _Problem(409, "malformed", "Certificate already revoked")
+            record["revoked"] = {"at": time.time(), "reason": payload.get("reason", 0)}
+        return 200, b"", {}
+
+    def _ocsp(self, body):
+        """DER OCSPResponse to a DER OCSPRequest, with a signed status for each certificate asked about"""
+        try:
+            requests = children(children(unwrap(body, SEQUENCE)[1])[0][1])
+            requests = children(requests[1][1] if requests[0][0] == 0xa0 else requests[0][1])
+            cert_ids = [children(request[1])[0] for request in requests]
+            if not cert_ids:
+                raise ValueError("Empty OCSP request")
+        except (ValueError, IndexError):
+            return encode(SEQUENCE, encode(ENUMERATED, b"\x01")) # malformedRequest
+        self._count("ocsp")
+        now = time.time()
+        responses = []
+        for tag, cert_id in cert_ids:
+            algorithm, name_hash, key_hash, serial = children(cert_id)[:4]
+            with self._lock:
+                record = self._certificates.get("{0:x}".format(int_from_bytes(serial[1])))
+            if record is None or (name_hash[1], key_hash[1]) != (self.name_hash, self.key_hash):
+                status = encode(0x82, b"") # unknown
+            elif record["revoked"] is not None:
+                status = encode(0xa1, encode_time(record["revoked"]["at"], generalized=True))
+            else:
+                status = encode(0x80, b"") # good
+            responses.append(encode(SEQUENCE, encode(SEQUENCE, cert_id) + status + encode_time(now, generalized=True)
+                + encode(0xa0, encode_time(now + self.ocsp_validity, generalized=True))))
+        tbs = encode(SEQUENCE, encode(0xa2, encode(OCTET_STRING, self.key_hash)) + encode_time(now, generalized=True)
+            + encode(SEQUENCE, b"".join(responses)))
+        basic = encode(SEQUENCE, tbs + SHA256_WITH_RSA + encode(BIT_STRING, b"\x00" + self.signer.sign(tbs)))
+        return encode(SEQUENCE, encode(ENUMERATED, b"\x00")
+            + encode(0xa0, encode(SEQUENCE, encode_oid(OCSP_BASIC) + encode(OCTET_STRING, basic))))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Run a local mock ACME v1 CA for testing and benchmarking the clients")
+    parser.add_argument("--listen", type=parse_listen, default=("127.0.0.1", 4000), metavar="[HOST:]PORT",
+        help="address to serve the ACME API on, default 127.0.0.1:4000")
+    parser.add_argument("--ca-key", help="RSA key to issue with, a throwaway one is generated if omitted")
+    parser.add_argument("--latency", type=float, default=0.0, metavar="SECONDS", help="delay every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of POSTs failed with a 500")
+    parser.add_argument("--bad-nonce-rate", type=float, default=0.0, help="fraction of good nonces rejected")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of POSTs answered 429")
+    parser.add_argument("--invalid-rate", type=float, default=0.0, help="fraction of challenges failed")
+    parser.add_argument("--validation-delay", type=float, default=0.0, metavar="SECONDS",
+        help="validate challenges this long after they are triggered, default right away")
+    parser.add_argument("--no-validate", dest="validate", action="store_false",
+        help="accept a correct keyAuthorization without fetching the challenge")
+    parser.add_argument("--http-port", type=int, default=80, help="port HTTP-01 challenges are fetched from")
+    parser.add_argument("--validation-host", help="fetch challenges from this host instead of the domain")
+    parser.add_argument("--ocsp-validity", type=float, default=4 * 86400, metavar="SECONDS",
+        help="how long OCSP responses are valid, default 4 days")
+    parser.add_argument("--seed", type=int, help="seed for the injected failures")
+    args = parser.parse_args(argv)
+
+    LOGGER.addHandler(logging.StreamHandler())
+    LOGGER.setLevel(logging.INFO)
+    ca = MockCA(args.listen, ca_key=args.ca_key, latency=args.latency, error_rate=args.error_rate,
+        bad_nonce_rate=args.bad_nonce_rate, throttle_rate=args.throttle_rate, invalid_rate=args.invalid_rate,
+        validation_delay=args.validation_delay, validate=args.validate, http_port=args.http_port,
+        validation_host=args.validation_host, ocsp_validity=args.ocsp_validity, seed=args.seed).start()
+    LOGGER.info("Mock CA listening on {0}, use --ca {0}".format(ca.base_url))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ca.stop()
+
+if __name__ == "__main__": # pragma: no cover
+    main(sys.argv[1:])
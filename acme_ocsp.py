@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# fetch and verify OCSP responses and keep them next to the certificates for the web server to staple
+import argparse, copy, hashlib, logging, sys, threading, time
+from acme_asn1 import (SEQUENCE, INTEGER, OCTET_STRING, NULL, pem_blocks, children, unwrap, decode_int, decode_oid,
+    decode_time, encode, encode_oid, int_from_bytes, int_to_bytes)
+from acme_deploy import Deployment
+from acme_http import HTTPSession
+from acme_jws import CURVES, EC_PUBLIC_KEY, RSA_ENCRYPTION, ec_decode_point, ecdsa_der_to_jws, ecdsa_verify
+from acme_metrics import Metrics
+from acme_x509 import CERTIFICATE_LABELS, load_certificate, parse_certificate, read_der, split_certificate
+
+LOGGER = logging.getLogger(__name__)
+
+ENUMERATED = 0x0a
+OCSP_BASIC = "1.3.6.1.5.5.7.48.1.1"
+OCSP_SIGNING = "1.3.6.1.5.5.7.3.9"
+EXTENDED_KEY_USAGE = "2.5.29.37"
+HASH_OIDS = {"sha1": "1.3.14.3.2.26", "sha256": "2.16.840.1.101.3.4.2.1", "sha384": "2.16.840.1.101.3.4.2.2",
+    "sha512": "2.16.840.1.101.3.4.2.3"}
+# signature algorithm -> (key algorithm, hash)
+SIGNATURE_ALGORITHMS = {
+    "1.2.840.113549.1.1.5": (RSA_ENCRYPTION, "sha1"),
+    "1.2.840.113549.1.1.11": (RSA_ENCRYPTION, "sha256"),
+    "1.2.840.113549.1.1.12": (RSA_ENCRYPTION, "sha384"),
+    "1.2.840.113549.1.1.13": (RSA_ENCRYPTION, "sha512"),
+    "1.2.840.10045.4.3.2": (EC_PUBLIC_KEY, "sha256"),
+    "1.2.840.10045.4.3.3": (EC_PUBLIC_KEY, "sha384"),
+}
+# OCSPResponseStatus, 4 is unused
+RESPONSE_STATUSES = ["successful", "malformedRequest", "internalError", "tryLater", None, "sigRequired", "unauthorized"]
+# the [0] good, [1] revoked and [2] unknown choices of CertStatus
+CERT_STATUSES = {0x80: "good", 0xa1: "revoked", 0x82: "unknown"}
+# responses dated this far ahead of our clock are still taken
+CLOCK_SKEW = 300
+
+
+def _key_bits(spki):
+    """the subjectPublicKey bits of a DER SubjectPublicKeyInfo"""
+    return bytes(children(unwrap(spki, SEQUENCE)[1])[1][1])[1:]
+
+
+def cert_id(cert_der, issuer_der, hash_name="sha1"):
+    """DER CertID naming a certificate to its OCSP responder, see RFC 6960 section 4.1.1"""
+    cert, issuer = split_certificate(cert_der), split_certificate(issuer_der)
+    return encode(SEQUENCE, encode(SEQUENCE, encode_oid(HASH_OIDS[hash_name]) + encode(NULL, b""))
+        + encode(OCTET_STRING, hashlib.new(hash_name, issuer["subject"]).digest())
+        + encode(OCTET_STRING, hashlib.new(hash_name, _key_bits(issuer["spki"])).digest())
+        + encode(INTEGER, cert["serial"]))
+
+
+def ocsp_request(cert_der, issuer_der):
+    """DER OCSPRequest for one certificate, unsigned and without a nonce like the CAs expect"""
+    # OCSPRequest, TBSRequest, requestList, Request
+    return encode(SEQUENCE, encode(SEQUENCE, encode(SEQUENCE, encode(SEQUENCE, cert_id(cert_der, issuer_der)))))
+
+
+def verify_signature(spki, algorithm, data, signature):
+    """whether `signature` (as found in a certificate or OCSP response) over data verifies with the
+    DER SubjectPublicKeyInfo spki; algorithm is the OID of the signature algorithm"""
+    if algorithm not in SIGNATURE_ALGORITHMS:
+        raise ValueError("Unsupported signature algorithm {0}".format(algorithm))
+    key_algorithm, hash_name = SIGNATURE_ALGORITHMS[algorithm]
+    key_fields = children(children(unwrap(spki, SEQUENCE)[1])[0][1])
+    if decode_oid(key_fields[0][1]) != key_algorithm:
+        return False
+    bits = _key_bits(spki)
+    if key_algorithm == RSA_ENCRYPTION:
+        n, e = [decode_int(c) for t, c in children(unwrap(bits, SEQUENCE)[1])]
+        size = (n.bit_length() + 7) // 8
+        digest_info = encode(SEQUENCE, encode(SEQUENCE, encode_oid(HASH_OIDS[hash_name]) + encode(NULL, b""))
+            + encode(OCTET_STRING, hashlib.new(hash_name, data).digest()))
+        expected = b"\x00\x01" + b"\xff" * (size - len(digest_info) - 3) + b"\x00" + digest_info
+        return int_to_bytes(pow(int_from_bytes(signature), e, n), size) == expected
+    curve = CURVES.get(decode_oid(key_fields[1][1]))
+    if curve is None:
+        raise ValueError("Unsupported EC curve, only P-256 and P-384")
+    if curve.hash_name != hash_name:
+        # unlike JWS, X.509 pairs any hash with any curve
+        curve = copy.copy(curve)
+        curve.hash_name = hash_name
+    return ecdsa_verify(curve, ec_decode_point(curve, bits), data, ecdsa_der_to_jws(signature, curve))
+
+
+def _authorized_responder(responder_der, issuer, now):
+    """whether a certificate shipped in a response is one the issuer made for signing its OCSP responses"""
+    responder = split_certificate(responder_der)
+    if not verify_signature(issuer["spki"], responder["signature_algorithm"], responder["tbs"], responder["signature"]):
+        return None
+    fields = parse_certificate(responder_der)
+    if not fields["not_before"] <= now <= fields["not_after"]:
+        return None
+    for oid, critical, value in responder["extensions"]:
+        if oid == EXTENDED_KEY_USAGE and OCSP_SIGNING in [decode_oid(c) for t, c in children(unwrap(value, SEQUENCE)[1])]:
+            return responder
+    return None
+
+
+def _names_certificate(certid, cert, issuer):
+    """whether the content of a CertID from a response names cert"""
+    algorithm, name_hash, key_hash, serial = children(certid)[:4]
+    hash_name = dict((oid, name) for name, oid in HASH_OIDS.items()).get(decode_oid(children(algorithm[1])[0][1]))
+    return (hash_name is not None and serial[1] == cert["serial"]
+        and name_hash[1] == hashlib.new(hash_name, issuer["subject"]).digest()
+        and key_hash[1] == hashlib.new(hash_name, _key_bits(issuer["spki"])).digest())
+
+
+def parse_response(der, cert_der, issuer_der, now=None):
+    """check a DER OCSPResponse about cert and return its status (good, revoked or unknown),
+    this_update, next_update (None when the responder gave none), produced_at and revoked_at.
+    Raises ValueError unless it is a current, successful response for this certificate signed
+    by its issuer or by a responder the issuer delegated to"""
+    now = time.time() if now is None else now
+    fields = children(unwrap(der, SEQUENCE)[1])
+    status = decode_int(fields[0][1]) if fields[0][0] == ENUMERATED else None
+    if status != 0:
+        names = RESPONSE_STATUSES[status] if status is not None and 0 <= status < len(RESPONSE_STATUSES) else None
+        raise ValueError("OCSP responder answered {0}".format(names or status))
+    response_type, response = children(unwrap(fields[1][1], SEQUENCE)[1])
+    if decode_oid(response_type[1]) != OCSP_BASIC:
+        raise ValueError("Unsupported OCSP response type {0}".format(decode_oid(response_type[1])))
+    basic = children(unwrap(response[1], SEQUENCE)[1])
+    tbs, algorithm, signature = basic[:3]
+    tbs, algorithm, signature = encode(*tbs), decode_oid(children(algorithm[1])[0][1]), bytes(signature[1])[1:]
+
+    cert, issuer = split_certificate(cert_der), split_certificate(issuer_der)
+    if not verify_signature(issuer["spki"], algorithm, tbs, signature):
+        # or by a delegated responder, whose certificate comes with the response
+        included = [encode(*c) for t, content in basic[3:] if t == 0xa0 for c in children(unwrap(content, SEQUENCE)[1])]
+        responders = [r for r in (_authorized_responder(c, issuer, now) for c in included) if r is not None]
+        if not any(verify_signature(r["spki"], algorithm, tbs, signature) for r in responders):
+            raise ValueError("OCSP response is not signed by the issuer or a responder it authorized")
+
+    data = children(unwrap(tbs, SEQUENCE)[1])
+    if data[0][0] == 0xa0: # version, only ever v1
+        data = data[1:]
+    produced_at = decode_time(*data[1])
+    for tag, single in children(data[2][1]):
+        single = children(single)
+        if not _names_certificate(single[0][1], cert, issuer):
+            continue
+        if single[1][0] not in CERT_STATUSES:
+            raise ValueError("Malformed OCSP certificate status")
+        result = {"status": CERT_STATUSES[single[1][0]], "this_update": decode_time(*single[2]),
+            "next_update": None, "produced_at": produced_at, "revoked_at": None}
+        for extra_tag, extra in single[3:]:
+            if extra_tag == 0xa0:
+                result["next_update"] = decode_time(*unwrap(extra))
+        if result["status"] == "revoked":
+            result["revoked_at"] = decode_time(*children(single[1][1])[0])
+        if result["this_update"] > now + CLOCK_SKEW:
+            raise ValueError("OCSP response is not valid yet")
+        if result["next_update"] is not None and result["next_update"] <= now:
+            raise ValueError("OCSP response expired")
+        return result
+    raise ValueError("OCSP response does not cover this certificate")
+
+
+class Stapler(object):
+    """Keeps a verified OCSP response next to each certificate for the web server to staple.
+
+    The response for cert.pem goes to cert.pem.ocsp (with the default
+    `suffix`), where HAProxy looks for it and nginx's ssl_stapling_file can
+    point. refresh() fetches a new one only when there is none for the
+    current certificate yet, or `refresh` of its validity has passed: halfway
+    from thisUpdate to nextUpdate by default, as the CAs ask, or `max_age`
+    seconds for responses without a nextUpdate. Files go through the
+    Deployment, so a batch of staples costs a single reload. The issuer comes
+    from `issuer_path`, from the chain after the certificate in its file, or
+    from the caIssuers URL in the certificate.
+    """
+
+    def __init__(self, deploy=None, session=None, suffix=".ocsp", refresh=0.5, max_age=12 * 3600, issuer_path=None,
+            metrics=None, log=LOGGER):
+        self.deploy = deploy or Deployment(log=log)
+        self._own_session = session is None
+        self.session = session or HTTPSession()
+        self.suffix = suffix
+        self.refresh_at, self.max_age = refresh, max_age
+        self.issuer_path = issuer_path
+        self.metrics = metrics or Metrics()
+        self.log = log
+        self._issuers, self._lock = {}, threading.Lock() # caIssuers URL -> DER
+
+    def staple_path(self, cert_path):
+        return cert_path + self.suffix
+
+    def refresh_time(self, staple):
+        """when a staple should be replaced"""
+        if staple["next_update"] is None:
+            return staple["this_update"] + self.max_age
+        return staple["this_update"] + self.refresh_at * (staple["next_update"] - staple["this_update"])
+
+    def _issuer(self, cert_path, fields):
+        if self.issuer_path is not None:
+            return read_der(self.issuer_path, CERTIFICATE_LABELS)
+        with open(cert_path, "rb") as cert_file:
+            chain = [der for label, headers, der in pem_blocks(cert_file.read()) if label in CERTIFICATE_LABELS]
+        if len(chain) > 1:
+            return chain[1]
+        for url in fields["ca_issuers"]:
+            with self._lock:
+                if url in self._issuers:
+                    return self._issuers[url]
+            resp = self.session.request("GET", url)
+            if resp.code != 200:
+                self.log.warning("Cannot fetch issuer {0}: {1}".format(url, resp.code))
+                continue
+            blocks = [der for label, headers, der in pem_blocks(resp.body) if label in CERTIFICATE_LABELS]
+            with self._lock:
+                der = self._issuers[url] = blocks[0] if blocks else resp.body
+            return der
+        raise ValueError("No issuer certificate for {0}, deploy the full chain or give the issuer".format(cert_path))
+
+    def current(self, cert_path, cert_der, issuer_der, now=None):
+        """the staple in place for this certificate, None when there is none that is still good"""
+        try:
+            with open(self.staple_path(cert_path), "rb") as staple_file:
+                return parse_response(staple_file.read(), cert_der, issuer_der, now=now)
+        except (IOError, OSError, ValueError, IndexError):
+            return None
+
+    def refresh(self, cert_path, force=False):
+        """fetch and install a new staple for the certificate in cert_path if it is due, returns the
+        one in place afterwards; raises IOError or ValueError when none could be had"""
+        cert_der, fields = load_certificate(cert_path)
+        issuer_der = self._issuer(cert_path, fields)
+        current = self.current(cert_path, cert_der, issuer_der)
+        if current is not None and not force and time.time() < self.refresh_time(current):
+            return current
+        if not fields["ocsp_urls"]:
+            raise ValueError("{0} names no OCSP responder".format(cert_path))
+        try:
+            resp = self.session.request("POST", fields["ocsp_urls"][0], ocsp_request(cert_der, issuer_der),
+                {"Content-Type": "application/ocsp-request", "Accept": "application/ocsp-response"})
+            if resp.code != 200:
+                raise IOError("OCSP responder {0} answered {1}".format(fields["ocsp_urls"][0], resp.code))
+            staple = parse_response(resp.body, cert_der, issuer_der)
+        except (IOError, OSError, ValueError, IndexError) as e:
+            self.metrics.count("ocsp_failed")
+            if current is not None:
+                self.log.warning("Keeping the current staple of {0}: {1}".format(cert_path, e))
+                return current
+            raise ValueError("No OCSP response for {0}: {1}".format(cert_path, e))
+        self.metrics.count("ocsp_fetched")
+        if staple["status"] != "good":
+            self.log.error("OCSP responder says {0} is {1}".format(cert_path, staple["status"]))
+        self.deploy.install_file(self.staple_path(cert_path), resp.body)
+        return staple
+
+    def refresh_many(self, cert_paths, jobs=8, force=False):
+        """refresh the staples of many certificates at once, returns [(cert path, staple or error)]"""
+        from multiprocessing.pool import ThreadPool
+        def _refresh(cert_path):
+            try:
+                return cert_path, self.refresh(cert_path, force=force)
+            except (IOError, OSError, ValueError) as e:
+                self.log.warning(str(e))
+                return cert_path, e
+        if not cert_paths:
+            return []
+        pool = ThreadPool(max(1, min(jobs, len(cert_paths))))
+        try:
+            return pool.map(_refresh, cert_paths)
+        finally:
+            pool.close()
+            pool.join()
+
+    def close(self):
+        if self._own_session:
+            self.session.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Fetch OCSP responses for certificates and keep them next to "
+        "them as <certificate>.ocsp for stapling, only when the current one is due for a refresh",
+        epilog="e.g. acme_ocsp.py --cert /etc/ssl/site.crt --reload-hook 'systemctl reload nginx' from cron every hour")
+    parser.add_argument("--cert", action="append", default=[], metavar="PATH", help="certificate to staple, repeatable")
+    parser.add_argument("--manifest", help="also staple the certificates of this acme_batch.py manifest")
+    parser.add_argument("--issuer", metavar="PATH",
+        help="issuer certificate, default is the chain in the certificate file or its caIssuers URL")
+    parser.add_argument("--suffix", default=".ocsp", help="appended to the certificate path for the staple, default .ocsp")
+    parser.add_argument("--refresh", type=float, default=0.5, metavar="FRACTION",
+        help="fetch anew once this much of the current response's validity has passed, default 0.5")
+    parser.add_argument("--force", action="store_true", help="fetch new responses even when the current ones are fresh")
+    parser.add_argument("--jobs", type=int, default=8, help="responses fetched at once, default 8")
+    parser.add_argument("--reload-hook", metavar="COMMAND", help="shell command run once if any staple changed")
+    parser.add_argument("--quiet", action="store_const", const=logging.ERROR, help="suppress output except for errors")
+    args = parser.parse_args(argv)
+
+    cert_paths = list(args.cert)
+    if args.manifest:
+        from acme_batch import read_manifest
+        cert_paths.extend(job[-1] for job in read_manifest(args.manifest))
+    if not cert_paths:
+        parser.error("no --cert or --manifest given")
+
+    LOGGER.addHandler(logging.StreamHandler())
+    LOGGER.setLevel(args.quiet or logging.INFO)
+    with Deployment(args.reload_hook) as deployment:
+        stapler = Stapler(deployment, suffix=args.suffix, refresh=args.refresh, issuer_path=args.issuer)
+        try:
+            results = stapler.refresh_many(cert_paths, jobs=args.jobs, force=args.force)
+        finally:
+            stapler.close()
+    failures = 0
+    for cert_path, staple in results:
+        if isinstance(staple, Exception):
+            failures += 1
+            sys.stdout.write("FAILED  {0} ({1})\n".format(cert_path, staple))
+        else:
+            failures += staple["status"] != "good"
+            sys.stdout.write("{0:<7} {1} refresh after {2}\n".format(staple["status"], cert_path,
+                time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime(stapler.refresh_time(staple)))))
+    return 1 if failures else 0
+
+if __name__ == "__main__": # pragma: no cover
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# one polling schedule for every pending ACME challenge
+import heapq, json, logging, random, time
+from acme_http import RateLimited, parse_retry_after
+
+LOGGER = logging.getLogger(__name__)
+
+# unlike time.time() it never steps, so a clock adjustment can't stretch or cut a deadline (python 3.3+)
+MONOTONIC = getattr(time, "monotonic", time.time)
+
+
+class ChallengePoller(object):
+    """Poll many pending challenges from a single loop.
+
+    Each challenge starts at `initial` seconds between polls and backs off by
+    `factor` up to `maximum`, with +/- `jitter` so that a batch of challenges
+    does not hit the CA in lock step. A Retry-After header from the CA takes
+    precedence over the computed interval. run() raises ValueError once
+    `deadline` seconds have passed with challenges still pending. Time is
+    measured with `clock` and waited out with `sleep`.
+    """
+
+    def __init__(self, opener, initial=0.5, maximum=10.0, factor=2.0, jitter=0.2, deadline=300,
+            observe=None, log=LOGGER, clock=MONOTONIC, sleep=time.sleep):
+        self.opener = opener
+        self.clock, self.sleep = clock, sleep
+        self.initial, self.maximum, self.factor, self.jitter = initial, maximum, factor, jitter
+        self.deadline = deadline
+        self.observe = observe
+        self.log = log
+        self.polls = 0
+        self._queue = []
+        self._pending = {}
+
+    def add(self, key, uri, on_valid=None):
+        """schedule `uri` for polling, on_valid(key, status) runs once it turns valid"""
+        self._pending[key] = {"uri": uri, "interval": self.initial, "on_valid": on_valid}
+        heapq.heappush(self._queue, (self.clock() + self.initial, len(self._pending), key))
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _next_interval(self, entry, headers):
+        retry_after = parse_retry_after(headers.get('Retry-After') if headers is not None else None)
+        if retry_after is not None:
+            return retry_after
+        interval = entry["interval"]
+        entry["interval"] = min(self.maximum, interval * self.factor)
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def run(self, stop=None):
+        """poll until every challenge is valid, return {key: final status}"""
+        results, give_up = {}, self.clock() + self.deadline
+        while self._queue:
+            if stop is not None and stop.is_set():
+                break
+            due, seq, key = heapq.heappop(self._queue)
+            now = self.clock()
+            if now >= give_up:
+                raise ValueError("Timed out after {0}s waiting for challenges: {1}".format(
+                    self.deadline, ", ".join(sorted(str(k) for k in self._pending))))
+            # a last poll right at the deadline rather than sleeping past it
+            if min(due, give_up) > now:
+                self.sleep(min(due, give_up) - now)
+            entry = self._pending[key]
+            try:
+                resp = self.opener(entry["uri"])
+                headers = resp.headers
+                status = json.loads(resp.read().decode('utf8'))
+            except IOError as e:
+                code = getattr(e, "code", None)
+                message = "Error checking challenge: {0} {1}".format(code, getattr(e, "read", e.__str__)())
+                raise RateLimited(message, code, e.headers) if code in (429, 503) else ValueError(message)
+            finally:
+                self.polls += 1
+            if self.observe is not None:
+                self.observe(headers)
+            if status['status'] in ("pending", "processing"):
+                heapq.heappush(self._queue, (self.clock() + self._next_interval(entry, headers), seq, key))
+            elif status['status'] == "valid":
+                del self._pending[key]
+                results[key] = status
+                if entry["on_valid"] is not None:
+                    entry["on_valid"](key, status)
+            else:
+                raise ValueError("{0} challenge did not pass: {1}".format(key, status))
+        return results
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# long-running renewal scheduler, only certificates close to expiry are issued again
+import argparse, hashlib, heapq, logging, os, signal, sys, textwrap, threading, time
+from acme_batch import issue_batch, read_manifest
+from acme_challenges import add_arguments, session_args
+from acme_deploy import Deployment
+from acme_jws import BACKENDS
+from acme_keys import KEY_TYPES, KeyPool
+from acme_metrics import Metrics, write_reports
+from acme_ocsp import Stapler
+from acme_responder import ChallengeResponder, parse_listen
+from acme_tiny import AcmeSession, DEFAULT_CA, LOGGER
+from acme_x509 import load_certificate
+
+DAY = 86400
+
+
+class RenewalScheduler(object):
+    """Orders the certificates of a manifest by expiry.
+
+    A certificate is due `window` seconds before its notAfter, moved earlier
+    by up to `jitter` seconds so that certificates issued together are not
+    all renewed in the same minute. The spread is derived from the path, and
+    notAfter is read from the deployed file, so a restarted scheduler comes
+    up with exactly the same plan and never re-issues a fresh certificate.
+    Failed renewals are retried `retry` seconds later. `clock` gives the
+    current time in seconds since the epoch.
+    """
+
+    def __init__(self, load_jobs, window=30 * DAY, jitter=12 * 3600, retry=3600, log=LOGGER, clock=time.time):
+        self.load_jobs = load_jobs
+        self.window, self.jitter, self.retry = window, jitter, retry
+        self.log = log
+        self.clock = clock
+        self._index = {} # cert path -> (mtime, notAfter)
+        self._retry_at = {} # cert path -> no retry before this time
+
+    def not_after(self, cert_path):
+        """notAfter of the deployed certificate, None when there is none to renew"""
+        try:
+            mtime = os.stat(cert_path).st_mtime
+        except OSError:
+            return None
+        cached = self._index.get(cert_path)
+        if cached is None or cached[0] != mtime:
+            try:
+                not_after = load_certificate(cert_path)[1]["not_after"]
+            except (IOError, ValueError) as e:
+                self.log.warning("Cannot read {0}, renewing it: {1}".format(cert_path, e))
+                not_after = None
+            cached = self._index[cert_path] = (mtime, not_after)
+        return cached[1]
+
+    def due_time(self, cert_path):
+        not_after = self.not_after(cert_path)
+        if not_after is None:
+            due = 0
+        else:
+            spread = int(hashlib.sha256(cert_path.encode('utf8')).hexdigest()[:8], 16) / float(0xffffffff)
+            due = not_after - self.window - spread * self.jitter
+        return max(due, self._retry_at.get(cert_path, 0))
+
+    def queue(self):
+        """heap of (due time, cert path, job) for every job in the manifest"""
+        # the certificate path is always the last field of a job
+        queue = [(self.due_time(job[-1]), job[-1], job) for job in self.load_jobs()]
+        heapq.heapify(queue)
+        return queue
+
+    def due(self, now=None):
+        """return the manifest jobs due now and when the next one is due"""
+        now = self.clock() if now is None else now
+        queue, due = self.queue(), []
+        while queue and queue[0][0] <= now:
+            due.append(heapq.heappop(queue)[2])
+        return due, (queue[0][0] if queue else None)
+
+    def record(self, results, now=None):
+        # also after a success, so a certificate that still looks due (unreadable, or valid
+        # for less than the window) is not issued over and over
+        now = self.clock() if now is None else now
+        for result in results:
+            self._retry_at[result["output"]] = now + self.retry
+
+
+def staple(stapler, cert_paths, deploy, log=LOGGER):
+    """refresh the OCSP staples of the deployed certificates that are due, reload once if any changed,
+    returns when the next one is due (None when none could be had)"""
+    results = stapler.refresh_many([path for path in cert_paths if os.path.exists(path)])
+    try:
+        deploy.reload()
+    except (IOError, OSError) as e:
+        log.error(str(e))
+    refresh_times = [stapler.refresh_time(s) for path, s in results if not isinstance(s, Exception)]
+    return min(refresh_times) if refresh_times else None
+
+
+def run(scheduler, make_session, acme_dir, stop, once=False, check_interval=3600, log=LOGGER, on_round=None,
+        deploy=None, stapler=None, **issue_args):
+    """renew whatever is due, then sleep until the next certificate is (or check_interval passed),
+    on_round(results) is called after every round of renewals, the server is reloaded once per round.
+    With a Stapler the OCSP staples of all certificates are kept fresh too, through the same Deployment.
+    A round that fails as a whole, e.g. because the CA is down, is retried after check_interval
+    with a new session, except with `once`, which raises it"""
+    acme, deploy = None, deploy or Deployment(log=log)
+    try:
+        while not stop.is_set():
+            try:
+                due, next_due = scheduler.due()
+                if due:
+                    log.info("Renewing {0} certificate(s)...".format(len(due)))
+                    acme = acme or make_session()
+                    try:
+                        results = issue_batch(acme, due, acme_dir, log=log, deploy=deploy, stapler=stapler,
+                            **issue_args)
+                    finally:
+                        try:
+                            deploy.reload()
+                        except (IOError, OSError) as e:
+                            # the daemon carries on, the next round that changes something reloads again
+                            log.error(str(e))
+                    scheduler.record(results)
+                    for result in results:
+                        log.info("{0} {1}".format("Renewed" if result["ok"] else "Failed to renew", result["output"]))
+                    if on_round is not None:
+                        on_round(results)
+                    continue
+                if stapler is not None:
+                    next_staple = staple(stapler, [job[-1] for job in scheduler.load_jobs()], deploy, log=log)
+                    if next_staple is not None and (next_due is None or next_staple < next_due):
+                        next_due = next_staple
+            except (IOError, OSError, ValueError) as e:
+                if once:
+                    raise
+                log.error("Renewal round failed, retrying in {0:.0f}s: {1}".format(check_interval, e))
+                # whatever broke may have left the session's connections or nonces unusable
+                if acme is not None:
+                    acme.close()
+                acme = None
+                stop.wait(check_interval)
+                continue
+            if once:
+                break
+            wait = check_interval if next_due is None else min(check_interval, max(0, next_due - scheduler.clock()))
+            if next_due is not None:
+                log.info("Next renewal or staple due {0}".format(time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime(next_due))))
+            stop.wait(wait)
+    finally:
+        if acme is not None:
+            acme.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent("""\
+            Keep the certificates listed in a manifest (see acme_batch.py) renewed.
+            Only certificates within --renew-before days of expiry are issued again,
+            everything else is left alone, so it is safe to restart at any time.
+
+            ===Example Usage===
+            python acme_renew.py --account-key ./account.key --manifest ./sites.txt --acme-dir /var/www/html/.well-known/acme-challenge/
+            ===================
+
+            ===Example Crontab (instead of the daemon)===
+            0 * * * * python /path/to/acme_renew.py --once --account-key /path/to/account.key --manifest /path/to/sites.txt --acme-dir /var/www/html/.well-known/acme-challenge/ 2>> /var/log/acme_renew.log
+            =============================================
+            """)
+    )
+    parser.add_argument("--account-key", required=True, help="path to your account private key")
+    parser.add_argument("--manifest", required=True, help="file with one `csr_path certificate_path` pair per line")
+    challenges = parser.add_mutually_exclusive_group(required=True)
+    challenges.add_argument("--acme-dir", help="path to the .well-known/acme-challenge/ directory")
+    challenges.add_argument("--responder", type=parse_listen, metavar="[HOST:]PORT",
+        help="answer the challenges from a built-in HTTP server listening here instead")
+    add_arguments(parser)
+    parser.add_argument("--renew-before", type=float, default=30, metavar="DAYS",
+        help="renew certificates expiring within this many days, default 30")
+    parser.add_argument("--jitter", type=float, default=12, metavar="HOURS",
+        help="spread renewals up to this much earlier, default 12")
+    parser.add_argument("--retry-after", type=float, default=60, metavar="MINUTES",
+        help="wait this long before retrying a failed renewal, default 60")
+    parser.add_argument("--check-interval", type=float, default=60, metavar="MINUTES",
+        help="look at the manifest and certificates at least this often, default 60")
+    parser.add_argument("--once", action="store_true", help="renew what is due and exit, for cron")
+    parser.add_argument("--jobs", type=int, default=4, help="certificates issued at once, default 4")
+    parser.add_argument("--parallel", type=int, default=1, metavar="N", help="domains authorized at once per certificate")
+    parser.add_argument("--poll-timeout", type=float, default=300, metavar="SECONDS",
+        help="give up on a certificate when the CA has not validated it after this long, default 300")
+    parser.add_argument("--quiet", action="store_const", const=logging.ERROR, help="suppress output except for errors")
+    parser.add_argument("--ca", default=DEFAULT_CA, help="certificate authority, default is https://iisca.com")
+    parser.add_argument("--signer", default="auto", choices=BACKENDS,
+        help="how to sign requests with the account key, default picks the fastest available")
+    parser.add_argument("--state-dir", help="keep account, authorization and CA directory state here between runs")
+    parser.add_argument("--key-pool", metavar="DIR",
+        help="keep pre-generated keys here, `domain,... key_path output_path` jobs get a new key on every renewal")
+    parser.add_argument("--key-type", default="rsa:2048", help="one of {0}, default rsa:2048".format(", ".join(KEY_TYPES)))
+    parser.add_argument("--pool-size", type=int, default=8, help="keys kept ready in --key-pool, default 8")
+    parser.add_argument("--chain", action="store_true", help="append the issuer certificate, i.e. write full chains")
+    parser.add_argument("--reload-hook", metavar="COMMAND",
+        help="shell command run once after every round that changed a certificate, e.g. `apachectl -k graceful`")
+    parser.add_argument("--ocsp", action="store_true",
+        help="keep an OCSP response for stapling next to every certificate as <certificate>.ocsp")
+    parser.add_argument("--metrics-json", metavar="PATH", help="write timings and counters here after every round")
+    parser.add_argument("--metrics-prom", metavar="PATH",
+        help="write them as a Prometheus textfile too, e.g. for the node exporter textfile collector")
+
+    args = parser.parse_args(argv)
+    LOGGER.setLevel(args.quiet or LOGGER.level)
+    challenge_args = session_args(parser, args, log=LOGGER)
+
+    scheduler = RenewalScheduler(lambda: read_manifest(args.manifest), window=args.renew_before * DAY,
+        jitter=args.jitter * 3600, retry=args.retry_after * 60)
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda signum, frame: stop.set())
+    # counters keep growing over the life of the daemon, as Prometheus expects
+    metrics = Metrics()
+    def _report(results):
+        metrics.finish(all(r["ok"] for r in results))
+        write_reports(metrics, args.metrics_json, args.metrics_prom)
+
+    # the responder stays up between renewals, so port 80 is not lost to another process
+    responder = ChallengeResponder(args.responder).start() if args.responder else None
+    keys = KeyPool(args.key_pool, args.key_type, size=args.pool_size, log=LOGGER).start() if args.key_pool else None
+    deployment = Deployment(args.reload_hook, log=LOGGER)
+    stapler = Stapler(deployment, metrics=metrics, log=LOGGER) if args.ocsp else None
+    try:
+        run(scheduler, lambda: AcmeSession(args.account_key, CA=args.ca, log=LOGGER, signer_backend=args.signer,
+                nonce_prefetch=args.jobs * args.parallel, state_dir=args.state_dir, responder=responder,
+                metrics=metrics, **challenge_args),
+            args.acme_dir, stop, once=args.once, check_interval=args.check_interval * 60, on_round=_report,
+            deploy=deployment, stapler=stapler, jobs_at_once=args.jobs, parallel=args.parallel,
+            poll_timeout=args.poll_timeout, keys=keys, key_type=args.key_type, chain=args.chain)
+    finally:
+        if stapler is not None:
+            stapler.close()
+        if keys is not None:
+            keys.stop()
+        if responder is not None:
+            responder.stop()
+
+if __name__ == "__main__": # pragma: no cover
+    main(sys.argv[1:])
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# answer HTTP-01 challenges straight from memory, no web server or acme-dir needed
+import logging, threading
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer # Python 3
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer # Python 2
+    from SocketServer import ThreadingMixIn
+
+LOGGER = logging.getLogger(__name__)
+
+CHALLENGE_PATH = "/.well-known/acme-challenge/"
+
+
+def parse_listen(value):
+    """[HOST:]PORT as given on the command line to an (host, port) address"""
+    host, _, port = value.rpartition(":")
+    return host.strip("[]"), int(port)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _ChallengeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        responder = self.server.responder
+        path = self.path.split("?", 1)[0]
+        keyauthorization = None
+        if path.startswith(responder.path_prefix):
+            keyauthorization = responder.get(path[len(responder.path_prefix):])
+        body = (keyauthorization or "Not found").encode('utf8')
+        self.send_response(200 if keyauthorization is not None else 404)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    do_HEAD = do_GET
+
+    def log_message(self, fmt, *args):
+        LOGGER.debug("{0} {1}".format(self.address_string(), fmt % args))
+
+
+class ChallengeResponder(object):
+    """HTTP server answering /.well-known/acme-challenge/<token> from a token map.
+
+    Bind it to port 80 to run standalone, or to a local port with the web
+    server proxying /.well-known/acme-challenge/ to it (set path_prefix if
+    the proxy strips or rewrites that path). Tokens go live as soon as
+    add() returns, without touching the filesystem.
+    """
+
+    def __init__(self, address=("", 80), path_prefix=CHALLENGE_PATH):
+        self.address = address
+        self.path_prefix = path_prefix
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def add(self, token, keyauthorization):
+        with self._lock:
+            self._tokens[token] = keyauthorization
+
+    def remove(self, token):
+        with self._lock:
+            self._tokens.pop(token, None)
+
+    def get(self, token):
+        with self._lock:
+            return self._tokens.get(token)
+
+    def __len__(self):
+        return len(self._tokens)
+
+    @property
+    def server_address(self):
+        return self._server.server_address if self._server is not None else self.address
+
+    def start(self):
+        if self._server is not None:
+            return self
+        self._server = _ThreadingHTTPServer(self.address, _ChallengeHandler)
+        self._server.responder = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name="acme-responder")
+        self._thread.daemon = True
+        self._thread.start()
+        LOGGER.debug("Serving challenges on {0}:{1}".format(*self._server.server_address[:2]))
+        return self
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+# small on-disk stores that let repeated runs skip work the CA already knows about
+import calendar, contextlib, hashlib, json, logging, os, re, tempfile, threading, time
+try:
+    import fcntl
+except ImportError: # windows, the journal is then only safe within one process
+    fcntl = None
+
+LOGGER = logging.getLogger(__name__)
+
+RFC3339_RE = re.compile(r"^(\d{4})-(\d\d)-(\d\d)[Tt ](\d\d):(\d\d):(\d\d)(\.\d+)?([Zz]|[+-]\d\d:\d\d)$")
+
+
+def parse_timestamp(value):
+    """RFC 3339 timestamp as used by ACME to seconds since the epoch"""
+    match = RFC3339_RE.match(value.strip())
+    if match is None:
+        raise ValueError("Invalid timestamp: {0}".format(value))
+    year, month, day, hour, minute, second, fraction, zone = match.groups()
+    seconds = calendar.timegm((int(year), int(month), int(day), int(hour), int(minute), int(second)))
+    if zone not in ("Z", "z"):
+        offset = int(zone[1:3]) * 3600 + int(zone[4:6]) * 60
+        seconds -= offset if zone[0] == "+" else -offset
+    return seconds + float(fraction or 0)
+
+
+def write_atomic(path, data, mode=0o644, owner=None):
+    """replace path with data so readers only ever see the old or the new file, owner is an optional
+    (uid, gid) the new file is given before it is renamed into place"""
+    handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+        prefix=".{0}.".format(os.path.basename(path)))
+    try:
+        with os.fdopen(handle, "wb") as tmp_file:
+            tmp_file.write(data.encode('utf8') if not isinstance(data, bytes) else data)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+            current = os.fstat(tmp_file.fileno())
+        if owner is not None and tuple(owner) != (current.st_uid, current.st_gid):
+            os.chown(tmp_path, owner[0], owner[1])
+        # after the chown, which clears the setuid and setgid bits
+        os.chmod(tmp_path, mode)
+        getattr(os, "replace", os.rename)(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+@contextlib.contextmanager
+def locked_file(path, lock):
+    """open path for appending and hold it exclusively, with `lock` against other threads and flock
+    (where it exists) against other processes"""
+    with lock:
+        while True:
+            handle = os.fdopen(os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600), "a")
+            if fcntl is None:
+                break
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            # the file may have been replaced (see IssuanceJournal.compact) while we were waiting
+            if os.path.exists(path) and os.fstat(handle.fileno()).st_ino == os.stat(path).st_ino:
+                break
+            handle.close()
+        try:
+            yield handle
+        finally:
+            handle.close()
+
+
+class JSONStore(object):
+    """a JSON object on disk, rewritten atomically on every change. Changes are serialised through
+    <path>.lock, so processes sharing a state dir (the renew daemon and a cron run) keep each other's"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path) as store_file:
+                return json.load(store_file)
+        except (IOError, OSError):
+            return {}
+        except ValueError:
+            LOGGER.warning("Ignoring corrupt state file {0}".format(self.path))
+            return {}
+
+    def update(self, change):
+        """apply change(data) to a fresh copy of the file and write it back"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            os.makedirs(directory, 0o700)
+        except OSError:
+            if not os.path.isdir(directory): # else another process made it first
+                raise
+        with locked_file(self.path + ".lock", self._lock):
+            data = self.load()
+            change(data)
+            write_atomic(self.path, json.dumps(data, indent=1, sort_keys=True), mode=0o600)
+            return data
+
+
+class AuthzCache(object):
+    """Valid authorizations per CA, account thumbprint and domain.
+
+    Entries are only handed out while they are at least `margin` seconds away
+    from expiring, and invalidate() drops them once the CA refuses them. The
+    CA is part of the key like in RegistrationStore, so one state dir can be
+    used against staging and production without mixing up their authzs.
+    """
+
+    def __init__(self, path, margin=3600):
+        self.store = JSONStore(path)
+        self.margin = margin
+
+    def get(self, ca, thumbprint, domain, now=None):
+        entry = self.store.load().get(ca, {}).get(thumbprint, {}).get(domain)
+        if entry is None or entry["expires"] - self.margin <= (time.time() if now is None else now):
+            return None
+        return entry
+
+    def put(self, ca, thumbprint, domain, uri, expires):
+        def _put(data):
+            data.setdefault(ca, {}).setdefault(thumbprint, {})[domain] = {"uri": uri, "expires": expires}
+        self.store.update(_put)
+
+    def invalidate(self, ca, thumbprint, domains):
+        def _drop(data):
+            for domain in domains:
+                data.get(ca, {}).get(thumbprint, {}).pop(domain, None)
+        self.store.update(_drop)
+
+
+class RegistrationStore(object):
+    """Registration URI and status of each account key, per CA."""
+
+    def __init__(self, path):
+        self.store = JSONStore(path)
+
+    def get(self, ca, thumbprint):
+        return self.store.load().get(ca, {}).get(thumbprint)
+
+    def put(self, ca, thumbprint, uri, status="valid"):
+        def _put(data):
+            data.setdefault(ca, {})[thumbprint] = {"uri": uri, "status": status, "registered": time.time()}
+        self.store.update(_put)
+
+    def forget(self, ca, thumbprint):
+        self.store.update(lambda data: data.get(ca, {}).pop(thumbprint, None))
+
+
+class AccountKeyCache(object):
+    """Public JWK and thumbprint of each account key file.
+
+    An entry is keyed by the absolute path and only used while the file still
+    has the SHA-256 and mtime it was parsed with, so a replaced key is read
+    afresh.
+    """
+
+    def __init__(self, path):
+        self.store = JSONStore(path)
+
+    def get(self, key_path, digest, mtime):
+        entry = self.store.load().get(os.path.abspath(key_path))
+        if entry is None or entry.get("sha256") != digest or entry.get("mtime") != mtime:
+            return None
+        return entry
+
+    def put(self, key_path, digest, mtime, alg, jwk, thumbprint):
+        def _put(data):
+            data[os.path.abspath(key_path)] = {"sha256": digest, "mtime": mtime, "alg": alg, "jwk": jwk,
+                "thumbprint": thumbprint}
+        self.store.update(_put)
+
+
+class IssuanceJournal(object):
+    """Append-only JSONL record of the protocol steps of every order.
+
+    An order is one account asking one CA for one set of domains. Each line
+    is a step of it: start, authz (authz and challenge URI, token),
+    provisioned, triggered, validated, unprovisioned, then issued or failed.
+    resume() replays an unfinished order so a rerun can pick up the
+    authorizations of a run that died, and stale_tokens() finds challenge
+    files that nobody cleaned up. Lines are fsynced one by one, a torn last
+    line from a crash is skipped on reading.
+    """
+
+    # steps after which an order is no longer being worked on
+    FINISHED = ("issued", "failed")
+
+    def __init__(self, path, compact_after=1000):
+        self.path = path
+        self.compact_after = compact_after
+        self._lock = threading.Lock()
+        self._active = set() # orders being worked on by this process
+        self._torn = False
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+
+    @staticmethod
+    def order_id(ca, thumbprint, domains):
+        """the same account, CA and domains make the same order, whatever the CSR"""
+        return hashlib.sha256("\n".join([ca, thumbprint] + sorted(domains)).encode('utf8')).hexdigest()[:32]
+
+    def _locked(self):
+        """hold the journal exclusively, also against other processes where flock exists"""
+        return locked_file(self.path, self._lock)
+
+    def record(self, order, step, **fields):
+        fields.update(order=order, step=step, time=time.time())
+        if step == "start":
+            self._active.add(order)
+        elif step in self.FINISHED:
+            self._active.discard(order)
+        line = json.dumps(fields, sort_keys=True) + "\n"
+        with self._locked() as handle:
+            size = os.fstat(handle.fileno()).st_size
+            if size:
+                # don't glue the line onto one a crash left torn
+                with open(self.path, "rb") as journal_file:
+                    journal_file.seek(size - 1)
+                    if journal_file.read(1) != b"\n":
+                        line = "\n" + line
+            handle.write(line)
+            handle.flush()
+            os.fsync(handle.fileno())
+
+    def _records(self):
+        records = []
+        try:
+            with open(self.path) as journal_file:
+                for line in journal_file:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        if not self._torn:
+                            LOGGER.warning("Skipping torn line in {0}".format(self.path))
+                        self._torn = True
+        except (IOError, OSError):
+            pass
+        return records
+
+    def _orders(self, records):
+        """order -> its records, a start after it was issued begins afresh"""
+        orders = {}
+        for record in records:
+            steps = orders.setdefault(record["order"], [])
+            if record["step"] == "start" and steps and steps[-1]["step"] == "issued":
+                del steps[:]
+            steps.append(record)
+        return orders
+
+    @staticmethod
+    def _domains(records):
+        """replay the steps of one order, returns {domain: state}"""
+        domains = {}
+        for record in records:
+            domain = record.get("domain")
+            if domain is None:
+                continue
+            state = domains.setdefault(domain, {"provisioned": False, "triggered": False, "status": None})
+            step = record["step"]
+            if step == "authz":
+                state.update(authz_uri=record.get("authz_uri"), challenge_uri=record["challenge_uri"],
+                    token=record["token"], expires=record.get("expires"), status="pending", triggered=False)
+            elif step == "provisioned":
+                state.update(provisioned=True, token=record["token"], acme_dir=record.get("acme_dir"))
+            elif step == "unprovisioned":
+                state["provisioned"] = False
+            elif step == "triggered":
+                state["triggered"] = True
+            elif step == "validated":
+                state["status"] = "valid"
+        return domains
+
+    def resume(self, order):
+        """{domain: state} of the unfinished steps of order, empty when there is nothing to pick up"""
+        records = self._orders(self._records()).get(order, [])
+        # an order is redone from scratch once it was issued, a failed one is picked up
+        if not records or records[-1]["step"] == "issued":
+            return {}
+        return self._domains(records)
+
+    def stale_tokens(self, grace=3600, now=None):
+        """[(order, domain, acme_dir, token)] of challenge responses left in place by orders that
+        finished, or that no process has touched for `grace` seconds"""
+        now = time.time() if now is None else now
+        stale = []
+        for order, records in self._orders(self._records()).items():
+            if order in self._active:
+                continue
+            if records[-1]["step"] not in self.FINISHED and records[-1]["time"] > now - grace:
+                continue # maybe still running in another process
+            for domain, state in sorted(self._domains(records).items()):
+                if state["provisioned"]:
+                    stale.append((order, domain, state.get("acme_dir"), state["token"]))
+        return stale
+
+    def compact(self):
+        """drop the orders that were issued, once there are more than `compact_after` lines of them"""
+        with self._locked() as handle:
+            records = self._records()
+            orders = self._orders(records)
+            done = set(order for order, steps in orders.items() if steps[-1]["step"] == "issued"
+                and not any(state["provisioned"] for state in self._domains(steps).values()))
+            if len([r for r in records if r["order"] in done]) <= self.compact_after:
+                return
+            keep = [r for r in records if r["order"] not in done]
+            write_atomic(self.path, "".join(json.dumps(r, sort_keys=True) + "\n" for r in keep), mode=0o600)
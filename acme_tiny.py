@@ -1,9 +1,16 @@
 #!/usr/bin/env python
-import argparse, subprocess, json, os, sys, base64, binascii, time, hashlib, re, copy, textwrap, logging
-try:
-    from urllib.request import urlopen # Python 3
-except ImportError:
-    from urllib2 import urlopen # Python 2
+import json, os, sys, base64, time, hashlib, re, copy, logging, threading
+# only what every issuance needs is imported here, the CLI, key generation, thread pools,
+# the responder and deployment are imported where they are used so embedding and cron
+# runs start faster (see bench_startup.py)
+from acme_asn1 import pem_encode
+from acme_challenges import DirectoryBackend, PresenceCheck, ResponderBackend
+from acme_http import Directory, HTTPSession, NoncePool, RateLimited
+from acme_jws import BACKENDS, account_jwk, jwk_thumbprint, load_signer
+from acme_metrics import Metrics, write_reports
+from acme_poll import ChallengePoller
+from acme_state import AccountKeyCache, AuthzCache, IssuanceJournal, RegistrationStore, parse_timestamp, write_atomic
+from acme_x509 import load_csr
 
 #DEFAULT_CA = "https://acme-staging.api.letsencrypt.org"
 DEFAULT_CA = "https://iisca.com"
@@ -12,190 +19,625 @@ LOGGER = logging.getLogger(__name__)
 LOGGER.addHandler(logging.StreamHandler())
 LOGGER.setLevel(logging.INFO)
 
-def get_crt(account_key, csr, acme_dir, log=LOGGER, CA=DEFAULT_CA):
-    # helper function base64 encode for jose spec
-    def _b64(b):
-        return base64.urlsafe_b64encode(b).decode('utf8').replace("=", "")
-
-    # parse account key to get public key
-    log.info("Parsing account key...")
-
-    proc = subprocess.Popen(["openssl", "rsa", "-in", account_key, "-noout", "-text"],
-        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    out, err = proc.communicate()
-    if proc.returncode != 0:
-        raise IOError("OpenSSL Error: {0}".format(err))
-    pub_hex, pub_exp = re.search(
-        r"modulus:\n\s+00:([a-f0-9\:\s]+?)\npublicExponent: ([0-9]+)",
-        out.decode('utf8'), re.MULTILINE|re.DOTALL).groups()
-    pub_exp = "{0:x}".format(int(pub_exp))
-    pub_exp = "0{0}".format(pub_exp) if len(pub_exp) % 2 else pub_exp
-    header = {
-        "alg": "RS256",
-        "jwk": {
-            "e": _b64(binascii.unhexlify(pub_exp.encode("utf-8"))),
-            "kty": "RSA",
-            "n": _b64(binascii.unhexlify(re.sub(r"(\s|:)", "", pub_hex).encode("utf-8"))),
-        },
-    }
-    accountkey_json = json.dumps(header['jwk'], sort_keys=True, separators=(',', ':'))
-    thumbprint = _b64(hashlib.sha256(accountkey_json.encode('utf8')).digest())
-
-    # helper function make signed requests
-    def _send_signed_request(url, payload):
+# helper function base64 encode for jose spec
+def _b64(b):
+    return base64.urlsafe_b64encode(b).decode('utf8').replace("=", "")
+
+class AcmeSession(object):
+    """One account talking to one CA.
+
+    The account key is parsed, the connections and nonce pool are set up and
+    the account is registered once; get_crt() can then be called any number
+    of times, also from several threads at once. A long-running service keeps
+    one session per account and CA, so the key, registration, CA directory,
+    nonces and connections stay warm between certificates:
+
+        with AcmeSession("account.key", CA=ca, state_dir=state) as acme:
+            acme.register() # optional, done by the first get_crt() otherwise
+            crt = acme.get_crt("domain.csr", "/var/www/.well-known/acme-challenge")
+    """
+
+    def __init__(self, account_key, CA=DEFAULT_CA, log=LOGGER, session=None, nonce_prefetch=0,
+            signer_backend="auto", state_dir=None, directory_ttl=3600, responder=None, metrics=None, journal=None,
+            inventory=None, challenges=None, check_nodes=None, check_timeout=0):
+        self.CA, self.log = CA, log
+        # phase timings and request, signature and poll counts for --metrics-json/--metrics-prom
+        self.metrics = metrics or Metrics()
+        # a ChallengeResponder serves the tokens from memory instead of files in acme_dir
+        self.responder = responder
+        # or a backend (see acme_challenges.py) puts them on every web node, instead of acme_dir
+        self.challenges = challenges
+        # with a state dir, the registration, valid authorizations and the CA directory
+        # survive between runs
+        self.authz_cache = AuthzCache(os.path.join(state_dir, "authz.json")) if state_dir else None
+        self.registrations = RegistrationStore(os.path.join(state_dir, "registrations.json")) if state_dir else None
+        self.key_cache = AccountKeyCache(os.path.join(state_dir, "account_keys.json")) if state_dir else None
+        # every protocol step goes to the journal, so a run that dies halfway can be picked up
+        if journal is None and state_dir:
+            journal = os.path.join(state_dir, "journal.jsonl")
+        self.journal = IssuanceJournal(journal) if journal else None
+        # and every certificate issued or revoked to the inventory, sqlite3 is only loaded for it
+        if inventory is None and state_dir:
+            inventory = os.path.join(state_dir, "inventory.sqlite3")
+        self.inventory = None
+        if inventory:
+            from acme_inventory import Inventory
+            self.inventory = Inventory(inventory)
+
+        # parse account key to get public key
+        log.info("Parsing account key...")
+        with self.metrics.phase("account_key"):
+            self._load_account_key(account_key, signer_backend)
+
+        # all CA traffic goes over kept-alive connections, nonces come from earlier CA
+        # responses and a HEAD is only sent when we run dry
+        self._own_session = session is None
+        self.session = session or HTTPSession(metrics=self.metrics)
+        self.nonces = NoncePool(CA + "/directory", opener=self.session.urlopen, prefetch=nonce_prefetch)
+        self.nonces.start_prefetch()
+        self.directory = Directory(CA + "/directory", self.session, ttl=directory_ttl,
+            cache_path=os.path.join(state_dir, "directory.json") if state_dir else None,
+            observe=self.nonces.observe)
+        # every node must serve the tokens before the CA is asked to validate them
+        self.presence = PresenceCheck(self.session, nodes=check_nodes, timeout=check_timeout, log=log)
+        self.registered = False
+        self.registration_uri = None
+        self._registrations_done = 0
+        self._register_lock = threading.Lock()
+        self._issuers, self._issuers_lock = {}, threading.Lock() # issuer URL -> PEM, for full chains
+
+    def _load_account_key(self, account_key, signer_backend):
+        with open(account_key, "rb") as key_file:
+            pem = key_file.read()
+        digest, mtime = hashlib.sha256(pem).hexdigest(), os.stat(account_key).st_mtime
+        cached = self.key_cache.get(account_key, digest, mtime) if self.key_cache else None
+        if cached is not None:
+            alg, jwk, self.thumbprint = cached["alg"], cached["jwk"], cached["thumbprint"]
+        else:
+            alg, jwk = account_jwk(pem)
+            self.thumbprint = jwk_thumbprint(jwk)
+            if self.key_cache is not None:
+                self.key_cache.put(account_key, digest, mtime, alg, jwk, self.thumbprint)
+        self.header = {"alg": alg, "jwk": jwk}
+        self.signer = load_signer(account_key, signer_backend, log=self.log)
+
+    # helper function make signed requests, returns (status code, body, headers)
+    def _send_signed_request(self, url, payload, retry_bad_nonce=True, retry_unknown_account=True):
+        registrations_done = self._registrations_done
         payload64 = _b64(json.dumps(payload).encode('utf8'))
-        protected = copy.deepcopy(header)
-        protected["nonce"] = urlopen(CA + "/directory").headers['Replay-Nonce']
+        protected = copy.deepcopy(self.header)
+        protected["nonce"] = self.nonces.get()
         protected64 = _b64(json.dumps(protected).encode('utf8'))
-        proc = subprocess.Popen(["openssl", "dgst", "-sha256", "-sign", account_key],
-            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        out, err = proc.communicate("{0}.{1}".format(protected64, payload64).encode('utf8'))
-        if proc.returncode != 0:
-            raise IOError("OpenSSL Error: {0}".format(err))
+        signature = self.signer.sign("{0}.{1}".format(protected64, payload64).encode('utf8'))
+        self.metrics.count("signatures")
+        if self.signer.backend == "openssl":
+            self.metrics.count("openssl_spawns")
         data = json.dumps({
-            "header": header, "protected": protected64,
-            "payload": payload64, "signature": _b64(out),
+            "header": self.header, "protected": protected64,
+            "payload": payload64, "signature": _b64(signature),
         })
         try:
-            resp = urlopen(url, data.encode('utf8'))
-            return resp.getcode(), resp.read()
+            resp = self.session.urlopen(url, data.encode('utf8'))
+            self.nonces.observe(resp.headers)
+            return resp.getcode(), resp.read(), resp.headers
         except IOError as e:
-            return getattr(e, "code", None), getattr(e, "read", e.__str__)()
-
-    # find domains
-    log.info("Parsing CSR...")
-    proc = subprocess.Popen(["openssl", "req", "-in", csr, "-noout", "-text"],
-        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    out, err = proc.communicate()
-    if proc.returncode != 0:
-        raise IOError("Error loading {0}: {1}".format(csr, err))
-    domains = set([])
-    common_name = re.search(r"Subject:.*? CN\s?=\s?([^\s,;/]+)", out.decode('utf8'))
-    if common_name is not None:
-        domains.add(common_name.group(1))
-    subject_alt_names = re.search(r"X509v3 Subject Alternative Name: \n +([^\n]+)\n", out.decode('utf8'), re.MULTILINE|re.DOTALL)
-    if subject_alt_names is not None:
-        for san in subject_alt_names.group(1).split(", "):
-            if san.startswith("DNS:"):
-                domains.add(san[4:])
-
-    # get the certificate domains and expiration
-    log.info("Registering account...")
-    code, result = _send_signed_request(CA + "/acme/new-reg", {
-        "resource": "new-reg",
-        "agreement": json.loads(urlopen(CA + "/directory").read().decode('utf8'))['meta']['terms-of-service'],
-    })
-    if code == 201:
-        log.info("Registered!")
-    elif code == 409:
-        log.info("Already registered!")
-    else:
-        raise ValueError("Error registering: {0} {1}".format(code, result))
-
-    # verify each domain
-    for domain in domains:
-        log.info("Verifying {0}...".format(domain))
-
-        # get new challenge
-        code, result = _send_signed_request(CA + "/acme/new-authz", {
-            "resource": "new-authz",
-            "identifier": {"type": "dns", "value": domain},
-        })
-        if code != 201:
-            raise ValueError("Error requesting challenges: {0} {1}".format(code, result))
-
-        # make the challenge file
-        challenge = [c for c in json.loads(result.decode('utf8'))['challenges'] if c['type'] == "http-01"][0]
-        token = re.sub(r"[^A-Za-z0-9_\-]", "_", challenge['token'])
-        keyauthorization = "{0}.{1}".format(token, thumbprint)
-        wellknown_path = os.path.join(acme_dir, token)
-        with open(wellknown_path, "w") as wellknown_file:
-            wellknown_file.write(keyauthorization)
-
-        # check that the file is in place
-        wellknown_url = "http://{0}/.well-known/acme-challenge/{1}".format(domain, token)
+            headers = getattr(e, "headers", None)
+            self.nonces.observe(headers)
+            code, result = getattr(e, "code", None), getattr(e, "read", e.__str__)()
+        # a pooled nonce may have gone stale on the CA side, try once more with a fresh one
+        if code == 400 and retry_bad_nonce and b"badNonce" in result:
+            return self._send_signed_request(url, payload, retry_bad_nonce=False,
+                retry_unknown_account=retry_unknown_account)
+        # the CA lost or dropped the account our registration record points at
+        if (code in (400, 403) and retry_unknown_account and payload.get("resource") != "new-reg"
+                and (b"No registration exists" in result or b"accountDoesNotExist" in result)):
+            self._account_missing(registrations_done)
+            return self._send_signed_request(url, payload, retry_unknown_account=False)
+        # throttled or overloaded, whoever schedules the work decides when to come back
+        if code in (429, 503):
+            raise RateLimited("CA refused {0} with {1}: {2}".format(payload.get("resource"), code, result), code, headers)
+        return code, result, headers
+
+    def _account_missing(self, registrations_done):
+        with self._register_lock:
+            # another thread may have registered again in the meantime
+            if registrations_done == self._registrations_done:
+                self.log.info("CA does not know the account, registering again...")
+                self.registered = False
+                if self.registrations is not None:
+                    self.registrations.forget(self.CA, self.thumbprint)
+        self.register()
+
+    def register(self):
+        """register the account with the CA, only the first call does any work"""
+        with self._register_lock:
+            if self.registered:
+                return
+            record = self.registrations.get(self.CA, self.thumbprint) if self.registrations else None
+            if record is not None and record.get("status") == "valid":
+                self.log.info("Already registered as {0}".format(record["uri"]))
+                self.registration_uri, self.registered = record["uri"], True
+                return
+            self.log.info("Registering account...")
+            with self.metrics.phase("register"):
+                code, result, headers = self._send_signed_request(self.directory.resource("new-reg"), {
+                    "resource": "new-reg",
+                    "agreement": self.directory.terms_of_service(),
+                })
+            if code == 201:
+                self.log.info("Registered!")
+            elif code == 409:
+                self.log.info("Already registered!")
+            else:
+                raise ValueError("Error registering: {0} {1}".format(code, result))
+            # both 201 and 409 point at the registration, remember it to skip new-reg next time
+            self.registration_uri = headers.get('Location') if headers is not None else None
+            if self.registrations is not None and self.registration_uri:
+                self.registrations.put(self.CA, self.thumbprint, self.registration_uri)
+            self.registered = True
+            self._registrations_done += 1
+
+    def _backend(self, acme_dir):
+        """where the challenge responses of an order go"""
+        if self.challenges is not None:
+            return self.challenges
+        if self.responder is not None:
+            return ResponderBackend(self.responder)
+        return DirectoryBackend([acme_dir])
+
+    def _unprovision(self, backend, tokens):
+        """remove a batch of challenge responses, returns whether that worked; a failure is only
+        logged, the outcome of the order does not depend on it"""
         try:
-            resp = urlopen(wellknown_url)
-            resp_data = resp.read().decode('utf8').strip()
-            assert resp_data == keyauthorization
-        except (IOError, AssertionError):
-            os.remove(wellknown_path)
-            raise ValueError("Wrote file to {0}, but couldn't download {1}".format(
-                wellknown_path, wellknown_url))
-
-        # notify challenge are met
-        code, result = _send_signed_request(challenge['uri'], {
-            "resource": "challenge",
-            "keyAuthorization": keyauthorization,
-        })
-        if code != 202:
-            raise ValueError("Error triggering challenge: {0} {1}".format(code, result))
+            backend.unprovision(tokens)
+            return True
+        except (IOError, OSError) as e:
+            self.log.error("Cannot remove challenge responses {0}: {1}".format(", ".join(sorted(tokens)), e))
+            return False
 
-        # wait for challenge to be verified
-        while True:
-            try:
-                resp = urlopen(challenge['uri'])
-                challenge_status = json.loads(resp.read().decode('utf8'))
-            except IOError as e:
-                raise ValueError("Error checking challenge: {0} {1}".format(
-                    e.code, json.loads(e.read().decode('utf8'))))
-            if challenge_status['status'] == "pending":
-                time.sleep(2)
-            elif challenge_status['status'] == "valid":
-                log.info("{0} verified!".format(domain))
-                os.remove(wellknown_path)
-                break
+    def _sweep(self, tokens):
+        """remove the (order, domain, acme_dir, token) challenge files the journal says were left behind"""
+        stale = {} # journaled target -> its tokens
+        for order, domain, acme_dir, token in tokens:
+            # tokens served from memory died with the process that served them
+            if acme_dir is not None:
+                self.log.info("Removing stale token {0} for {1}".format(token, domain))
+                stale.setdefault(acme_dir, []).append(token)
+        removed = set()
+        for target, stale_tokens in sorted(stale.items()):
+            # the configured backend also reaches the other nodes, else the journaled directories are cleaned
+            if self.challenges is not None and self.challenges.target == target:
+                backend = self.challenges
+            else:
+                backend = DirectoryBackend(target.split(os.pathsep))
+            if self._unprovision(backend, stale_tokens):
+                removed.add(target)
+        for order, domain, acme_dir, token in tokens:
+            if acme_dir is None or acme_dir in removed:
+                self.journal.record(order, "unprovisioned", domain=domain, token=token)
+
+    def _resume_challenge(self, domain, state):
+        """the journaled challenge of domain if the CA still has it pending or valid, else None"""
+        try:
+            resp = self.session.urlopen(state['challenge_uri'])
+            self.nonces.observe(resp.headers)
+            challenge = json.loads(resp.read().decode('utf8'))
+        except (IOError, ValueError) as e:
+            self.log.info("Cannot resume {0}, requesting a new authorization: {1}".format(domain, e))
+            return None
+        if challenge.get('status') not in ("pending", "processing", "valid"):
+            return None
+        challenge.setdefault('uri', state['challenge_uri'])
+        return challenge
+
+    def get_crt(self, csr, acme_dir=None, parallel=1, poll_timeout=300, chain=False):
+        """sign the CSR file at `csr`, returns the PEM certificate (followed by its issuer with chain)"""
+        # find domains, the DER is kept for new-cert
+        self.log.info("Parsing CSR...")
+        with self.metrics.phase("parse_csr"):
+            csr_der, domains = load_csr(csr)
+        return self.sign_csr(csr_der, domains, acme_dir, parallel=parallel, poll_timeout=poll_timeout, chain=chain)
+
+    def issue(self, domains, acme_dir=None, keys=None, key_type="rsa:2048", parallel=1, poll_timeout=300,
+            chain=False):
+        """new key (from the KeyPool `keys` when given) and certificate for domains,
+        returns (key PEM, certificate PEM)"""
+        from acme_keys import new_key_and_csr
+        with self.metrics.phase("key_and_csr"):
+            key_pem, csr_der = new_key_and_csr(list(domains), keys=keys, key_type=key_type)
+        return key_pem, self.sign_csr(csr_der, set(domains), acme_dir, parallel=parallel, poll_timeout=poll_timeout,
+            chain=chain)
+
+    def _issuer_chain(self, headers):
+        """PEM of the issuer the CA links a new certificate to with rel="up", fetched once per session"""
+        links = (headers.get_all('Link') if hasattr(headers, 'get_all') else headers.getheaders('Link')) or []
+        ups = [m.group(1) for m in (re.match(r'\s*<([^>]+)>\s*;\s*rel="?up"?', l) for l in links) if m]
+        if not ups:
+            raise ValueError("The CA did not link the certificate to its issuer")
+        with self._issuers_lock:
+            if ups[0] not in self._issuers:
+                resp = self.session.urlopen(ups[0])
+                self._issuers[ups[0]] = pem_encode(resp.read(), "CERTIFICATE")
+            return self._issuers[ups[0]]
+
+    def sign_csr(self, csr_der, domains, acme_dir=None, parallel=1, poll_timeout=300, use_cache=True, chain=False):
+        if acme_dir is None and self.responder is None and self.challenges is None:
+            raise ValueError("Need an acme_dir, a challenge backend or a challenge responder")
+        log, session, nonces, thumbprint = self.log, self.session, self.nonces, self.thumbprint
+        _send_signed_request = self._send_signed_request
+
+        # get the certificate domains and expiration
+        self.register()
+
+        # authorizations the CA granted this account earlier don't need validating again
+        cached = set()
+        if self.authz_cache is not None and use_cache:
+            cached = set(d for d in domains if self.authz_cache.get(self.CA, thumbprint, d) is not None)
+            for domain in sorted(cached):
+                log.info("Reusing cached authorization for {0}".format(domain))
+
+        # pick up where an earlier run of the same order stopped, tokens it left behind are
+        # removed unless their challenge can be picked up again
+        journal, order, resumed = self.journal, None, {}
+        if journal is not None:
+            order = journal.order_id(self.CA, thumbprint, domains)
+            previous_run = journal.resume(order)
+            if use_cache:
+                resumed = dict((d, state) for d, state in previous_run.items()
+                    if d in domains and d not in cached and state.get('challenge_uri'))
+            self._sweep([(order, d, state.get('acme_dir'), state['token']) for d, state in
+                sorted(previous_run.items()) if state['provisioned'] and d not in resumed])
+            journal.record(order, "start", domains=sorted(domains), resumed=sorted(resumed))
+            self._sweep(journal.stale_tokens())
+            journal.compact()
+            for domain in sorted(resumed):
+                log.info("Resuming the authorization of {0} from the journal".format(domain))
+
+        def _journal(step, **fields):
+            if journal is not None:
+                journal.record(order, step, **fields)
+
+        # get a challenge for each domain, up to `parallel` of them at once, then put all tokens in place in
+        # one batch, check every node serves them and trigger them all
+        tokens, timings = {}, {} # provisioned token -> domain
+        backend = self._backend(acme_dir)
+        target = backend.target # where tokens go, for the journal
+        lock, failed = threading.Lock(), threading.Event()
+        poller = ChallengePoller(session.urlopen, deadline=poll_timeout, observe=nonces.observe, log=log)
+
+        def _prepare(domain):
+            """the challenge of domain to provision and trigger, None when it is valid already"""
+            started = time.time()
+            previous = resumed.get(domain)
+            challenge = self._resume_challenge(domain, previous) if previous else None
+            # a token of the earlier run stays in place only while it is still being validated
+            if previous is not None and previous['provisioned'] and (challenge is None
+                    or challenge.get('status') == "valid" or previous.get('acme_dir') != target):
+                self._sweep([(order, domain, previous.get('acme_dir'), previous['token'])])
+            if challenge is not None:
+                authz, authz_uri = {"expires": previous.get('expires')}, previous.get('authz_uri')
+            else:
+                previous = None
+                log.info("Verifying {0}...".format(domain))
+
+                # get new challenge
+                code, result, headers = _send_signed_request(self.directory.resource("new-authz"), {
+                    "resource": "new-authz",
+                    "identifier": {"type": "dns", "value": domain},
+                })
+                if code != 201:
+                    raise ValueError("Error requesting challenges: {0} {1}".format(code, result))
+                authz = json.loads(result.decode('utf8'))
+                authz_uri = headers.get('Location') if headers is not None else None
+                challenge = [c for c in authz['challenges'] if c['type'] == "http-01"][0]
+                _journal("authz", domain=domain, authz_uri=authz_uri, challenge_uri=challenge['uri'],
+                    token=challenge['token'], expires=authz.get('expires'))
+
+            token = re.sub(r"[^A-Za-z0-9_\-]", "_", challenge['token'])
+            keyauthorization = "{0}.{1}".format(token, thumbprint)
+            # the CA validated it before the earlier run died
+            if challenge.get('status') == "valid":
+                _verified(domain, challenge, started, authz_uri, authz)
+                return None
+            return {"domain": domain, "challenge": challenge, "previous": previous, "token": token,
+                "keyauthorization": keyauthorization, "started": started, "authz_uri": authz_uri, "authz": authz}
+
+        def _trigger(pending):
+            domain, challenge, previous = pending['domain'], pending['challenge'], pending['previous']
+            # notify challenge are met, a challenge the earlier run triggered is only polled
+            if previous is None or not previous['triggered']:
+                code, result, headers = _send_signed_request(challenge['uri'], {
+                    "resource": "challenge",
+                    "keyAuthorization": pending['keyauthorization'],
+                })
+                if code != 202:
+                    raise ValueError("Error triggering challenge: {0} {1}".format(code, result))
+                _journal("triggered", domain=domain)
+
+            # the shared poller waits for the CA to validate it
+            with lock:
+                poller.add(domain, challenge['uri'], on_valid=lambda domain, challenge_status: _verified(
+                    domain, challenge_status, pending['started'], pending['authz_uri'], pending['authz']))
+
+        def _verified(domain, challenge_status, started, authz_uri, authz):
+            timings[domain] = time.time() - started
+            log.info("{0} verified in {1:.2f}s!".format(domain, timings[domain]))
+            _journal("validated", domain=domain)
+            # the pending authz expiry is shorter than the valid one, so it is a safe bound
+            if self.authz_cache is not None and authz_uri and authz.get('expires'):
+                self.authz_cache.put(self.CA, thumbprint, domain, authz_uri, parse_timestamp(authz['expires']))
+
+        def _each(function, items):
+            """function(item) for every item, up to `parallel` at once, raises the first error once all are done"""
+            def _call(item):
+                if failed.is_set():
+                    return None, None
+                try:
+                    return function(item), None
+                except Exception as e:
+                    failed.set()
+                    return None, e
+            if parallel > 1 and len(items) > 1:
+                from multiprocessing.pool import ThreadPool
+                pool = ThreadPool(min(parallel, len(items)))
+                try:
+                    results = pool.map(_call, items)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                results = [_call(item) for item in items]
+            errors = [e for result, e in results if e is not None]
+            for e in errors[1:]:
+                log.error(e)
+            if errors:
+                raise errors[0]
+            return [result for result, e in results]
+
+        try:
+            with self.metrics.phase("authorize"):
+                pending = [p for p in _each(_prepare, sorted(domains - cached)) if p is not None]
+                if pending:
+                    # journaled first, so tokens of a run that dies while provisioning are swept later
+                    for p in pending:
+                        tokens[p['token']] = p['domain']
+                        _journal("provisioned", domain=p['domain'], token=p['token'], acme_dir=target)
+                    provisioned = backend.provision(dict((p['token'], p['keyauthorization']) for p in pending))
+                    try:
+                        self.presence.check([(p['domain'], p['token'], p['keyauthorization']) for p in pending])
+                    except ValueError as e:
+                        raise ValueError("{0}, but {1}".format(provisioned, e))
+                    _each(_trigger, pending)
+
+            # every challenge is triggered, wait for all of them on one schedule
+            with self.metrics.phase("poll"):
+                poller.run()
+        except Exception as e:
+            _journal("failed", error=str(e))
+            raise
+        finally:
+            self.metrics.count("challenge_polls", poller.polls)
+            # all tokens go in one batch once the order is through, also when some authorization failed
+            if tokens and self._unprovision(backend, sorted(tokens)):
+                for token, domain in sorted(tokens.items()):
+                    _journal("unprovisioned", domain=domain, token=token)
+        if timings:
+            log.info("Authorization times: {0}".format(", ".join(
+                "{0} {1:.2f}s".format(domain, timings[domain]) for domain in sorted(timings))))
+
+        # get the new certificate
+        log.info("Signing certificate...")
+        with self.metrics.phase("sign"):
+            code, result, headers = _send_signed_request(self.directory.resource("new-cert"), {
+                "resource": "new-cert",
+                "csr": _b64(csr_der),
+            })
+        if code == 403 and (cached or resumed):
+            # the CA no longer honours some cached or resumed authorization, validate afresh
+            log.warning("CA refused the reused authorizations, validating {0} again".format(
+                ", ".join(sorted(cached | set(resumed)))))
+            if cached:
+                self.authz_cache.invalidate(self.CA, thumbprint, cached)
+            return self.sign_csr(csr_der, domains, acme_dir, parallel=parallel, poll_timeout=poll_timeout,
+                use_cache=False, chain=chain)
+        if code != 201:
+            _journal("failed", error="new-cert {0}".format(code))
+            raise ValueError("Error signing certificate: {0} {1}".format(code, result))
+
+        # return signed certificate!
+        log.info("Certificate signed!")
+        location = headers.get('Location') if headers is not None else None
+        _journal("issued", location=location)
+        self.metrics.count("certificates_issued")
+        self._record("issued", result, csr_der=csr_der, thumbprint=thumbprint, ca=self.CA, location=location)
+        signed_crt = pem_encode(result, "CERTIFICATE")
+        return signed_crt + self._issuer_chain(headers) if chain else signed_crt
+
+    def revoke(self, certificate_der, reason=None):
+        """revoke a DER certificate issued to this account, returns False if it already was"""
+        self.register()
+        payload = {"resource": "revoke-cert", "certificate": _b64(certificate_der)}
+        if reason is not None:
+            payload["reason"] = reason
+        code, result, headers = self._send_signed_request(self.directory.resource("revoke-cert"), payload)
+        if code == 200:
+            self._record("revoked", certificate_der, reason=reason)
+            return True
+        if code == 409 or (code == 400 and b"already revoked" in result):
+            self._record("revoked", certificate_der)
+            return False
+        raise ValueError("Error revoking certificate: {0} {1}".format(code, result))
+
+    def _record(self, event, certificate_der, **fields):
+        """note an issued or revoked certificate in the inventory, the certificate is the caller's whatever happens"""
+        if self.inventory is None:
+            return
+        try:
+            if event == "issued":
+                self.inventory.record_issued(certificate_der, **fields)
             else:
-                raise ValueError("{0} challenge did not pass: {1}".format(
-                    domain, challenge_status))
-
-    # get the new certificate
-    log.info("Signing certificate...")
-    proc = subprocess.Popen(["openssl", "req", "-in", csr, "-outform", "DER"],
-        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    csr_der, err = proc.communicate()
-    code, result = _send_signed_request(CA + "/acme/new-cert", {
-        "resource": "new-cert",
-        "csr": _b64(csr_der),
-    })
-    if code != 201:
-        raise ValueError("Error signing certificate: {0} {1}".format(code, result))
-
-    # return signed certificate!
-    log.info("Certificate signed!")
-    return """-----BEGIN CERTIFICATE-----\n{0}\n-----END CERTIFICATE-----\n""".format(
-        "\n".join(textwrap.wrap(base64.b64encode(result).decode('utf8'), 64)))
+                self.inventory.record_revoked(certificate_der, **fields)
+        except Exception as e:
+            self.log.warning("Cannot record the {0} certificate in {1}: {2}".format(event, self.inventory.path, e))
+
+    def close(self):
+        if self.inventory is not None:
+            self.inventory.close()
+        self.nonces.close()
+        self.metrics.count("nonces_fetched", self.nonces.fetched)
+        self.metrics.count("nonces_reused", self.nonces.reused)
+        self.log.debug("HTTP connections opened: {connections_opened}, reused: {connections_reused}".format(
+            **self.session.stats()))
+        if self._own_session:
+            self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def get_crt(account_key, csr, acme_dir, log=LOGGER, CA=DEFAULT_CA, nonce_prefetch=0,
+        signer_backend="auto", session=None, parallel=1, poll_timeout=300, state_dir=None, responder=None,
+        metrics=None, journal=None, chain=False, inventory=None, challenges=None, check_nodes=None, check_timeout=0):
+    """one certificate with a throwaway session, keep an AcmeSession to issue more than one"""
+    with AcmeSession(account_key, CA=CA, log=log, session=session, nonce_prefetch=nonce_prefetch,
+            signer_backend=signer_backend, state_dir=state_dir, responder=responder, metrics=metrics,
+            journal=journal, inventory=inventory, challenges=challenges, check_nodes=check_nodes,
+            check_timeout=check_timeout) as acme:
+        return acme.get_crt(csr, acme_dir, parallel=parallel, poll_timeout=poll_timeout, chain=chain)
 
 def main(argv):
+    import argparse, textwrap
+    from acme_challenges import add_arguments, session_args
+    from acme_deploy import Deployment
+    from acme_keys import KEY_TYPES, KeyPool
+    from acme_responder import ChallengeResponder, parse_listen
     parser = argparse.ArgumentParser(
         formatter_class=argparse.RawDescriptionHelpFormatter,
         description=textwrap.dedent("""\
             This script automates the process of getting a signed TLS certificate from
             Let's Encrypt using the ACME protocol. It will need to be run on your server
-            and have access to your private account key, so PLEASE READ THROUGH IT! It's
-            only ~200 lines, so it won't take long.
+            and have access to your private account key, so PLEASE READ THROUGH IT! The
+            protocol is all in this file, the acme_*.py modules it imports hold the rest.
 
             ===Example Usage===
             python acme_tiny.py --account-key ./account.key --csr ./domain.csr --acme-dir /usr/share/nginx/html/.well-known/acme-challenge/ > signed.crt
             ===================
 
+            ===Without a web server (or with it proxying /.well-known/acme-challenge/ to port 8402)===
+            python acme_tiny.py --account-key ./account.key --csr ./domain.csr --responder 80 > signed.crt
+            python acme_tiny.py --account-key ./account.key --csr ./domain.csr --responder 127.0.0.1:8402 > signed.crt
+            ==========================================================================================
+
+            ===With a fresh key and CSR made in-process===
+            python acme_tiny.py --account-key ./account.key --domains example.com,www.example.com --key-out ./domain.key --key-pool ./keys --acme-dir /usr/share/nginx/html/.well-known/acme-challenge/ > signed.crt
+            ===============================================
+
+            ===Behind several web nodes, writing to a shared mount and syncing to another node===
+            python acme_tiny.py --account-key ./account.key --csr ./domain.csr --acme-dir /mnt/shared/acme-challenge/ --sync-hook 'rsync -a --delete "$ACME_CHALLENGE_DIR/" web3:/var/www/html/.well-known/acme-challenge/' --check-node http://10.0.0.1 --check-node http://10.0.0.2 --check-node http://10.0.0.3 --check-timeout 30 > signed.crt
+            =====================================================================================
+
+            ===Installing the certificate and its chain, then reloading the web server gracefully===
+            python acme_tiny.py --account-key ./account.key --csr ./domain.csr --acme-dir /var/www/html/.well-known/acme-challenge/ --chain --cert-out /etc/ssl/domain.crt --reload-hook "systemctl reload apache2"
+            =========================================================================================
+
             ===Example Crontab Renewal (once per month)===
             0 0 1 * * python /path/to/acme_tiny.py --account-key /path/to/account.key --csr /path/to/domain.csr --acme-dir /usr/share/nginx/html/.well-known/acme-challenge/ > /path/to/signed.crt 2>> /var/log/acme_tiny.log
             ==============================================
             """)
     )
     parser.add_argument("--account-key", required=True, help="path to your Let's Encrypt account private key")
-    parser.add_argument("--csr", required=True, help="path to your certificate signing request")
-    parser.add_argument("--acme-dir", required=True, help="path to the .well-known/acme-challenge/ directory")
+    request = parser.add_mutually_exclusive_group(required=True)
+    request.add_argument("--csr", help="path to your certificate signing request")
+    request.add_argument("--domains", help="comma separated names, a new key and CSR are made for them")
+    parser.add_argument("--key-out", help="where the new domain key goes with --domains")
+    parser.add_argument("--key-pool", metavar="DIR", help="take the new key from this pre-generated pool (see acme_keys.py)")
+    parser.add_argument("--key-type", default="rsa:2048", help="one of {0}, default rsa:2048".format(", ".join(KEY_TYPES)))
+    challenges = parser.add_mutually_exclusive_group(required=True)
+    challenges.add_argument("--acme-dir", help="path to the .well-known/acme-challenge/ directory")
+    challenges.add_argument("--responder", type=parse_listen, metavar="[HOST:]PORT",
+        help="answer the challenges from a built-in HTTP server listening here instead")
+    add_arguments(parser)
     parser.add_argument("--quiet", action="store_const", const=logging.ERROR, help="suppress output except for errors")
     parser.add_argument("--ca", default=DEFAULT_CA, help="certificate authority, default is Let's Encrypt")
+    parser.add_argument("--parallel", type=int, default=1, metavar="N",
+        help="authorize up to N domains at once, default is one after the other")
+    parser.add_argument("--poll-timeout", type=float, default=300, metavar="SECONDS",
+        help="give up when the CA has not validated every domain after this long, default 300")
+    parser.add_argument("--signer", default="auto", choices=BACKENDS,
+        help="how to sign requests with the account key, default picks the fastest available")
+    parser.add_argument("--state-dir",
+        help="keep account, authorization and CA directory state here between runs")
+    parser.add_argument("--journal", metavar="PATH",
+        help="log every protocol step here and resume an interrupted run from it, default journal.jsonl in --state-dir")
+    parser.add_argument("--inventory", metavar="PATH",
+        help="record the certificate in this SQLite inventory (see acme_inventory.py), default inventory.sqlite3 in --state-dir")
+    parser.add_argument("--chain", action="store_true", help="append the issuer certificate, i.e. write the full chain")
+    parser.add_argument("--cert-out", metavar="PATH", help="install the certificate here atomically instead of printing it")
+    parser.add_argument("--reload-hook", metavar="COMMAND",
+        help="shell command run once when --cert-out or --key-out changed, e.g. `systemctl reload nginx`")
+    parser.add_argument("--ocsp", action="store_true",
+        help="also fetch an OCSP response for stapling into <--cert-out>.ocsp, keep it fresh with acme_ocsp.py")
+    parser.add_argument("--metrics-json", metavar="PATH", help="write phase timings and counters of the run here")
+    parser.add_argument("--metrics-prom", metavar="PATH",
+        help="write them as a Prometheus textfile too, e.g. for the node exporter textfile collector")
 
     args = parser.parse_args(argv)
-    
+    if args.domains and not args.key_out:
+        parser.error("--domains needs --key-out")
+    if args.reload_hook and not args.cert_out:
+        parser.error("--reload-hook needs --cert-out")
+    if args.ocsp and not args.cert_out:
+        parser.error("--ocsp needs --cert-out")
+    challenge_args = session_args(parser, args, log=LOGGER)
 
     LOGGER.setLevel(args.quiet or LOGGER.level)
-    signed_crt = get_crt(args.account_key, args.csr, args.acme_dir, log=LOGGER, CA=args.ca)
-    sys.stdout.write(signed_crt)
+    metrics, success, key_pem = Metrics(), False, None
+    responder = ChallengeResponder(args.responder).start() if args.responder else None
+    try:
+        if args.csr:
+            signed_crt = get_crt(args.account_key, args.csr, args.acme_dir, log=LOGGER, CA=args.ca,
+                signer_backend=args.signer, parallel=args.parallel, poll_timeout=args.poll_timeout,
+                state_dir=args.state_dir, nonce_prefetch=args.parallel if args.parallel > 1 else 0,
+                responder=responder, metrics=metrics, journal=args.journal, chain=args.chain,
+                inventory=args.inventory, **challenge_args)
+        else:
+            keys = KeyPool(args.key_pool, args.key_type, log=LOGGER) if args.key_pool else None
+            acme = AcmeSession(args.account_key, CA=args.ca, log=LOGGER, signer_backend=args.signer,
+                state_dir=args.state_dir, nonce_prefetch=args.parallel if args.parallel > 1 else 0,
+                responder=responder, metrics=metrics, journal=args.journal, inventory=args.inventory,
+                **challenge_args)
+            try:
+                key_pem, signed_crt = acme.issue(args.domains.split(","), args.acme_dir, keys=keys,
+                    key_type=args.key_type, parallel=args.parallel, poll_timeout=args.poll_timeout, chain=args.chain)
+            finally:
+                acme.close()
+        if args.cert_out:
+            with Deployment(args.reload_hook, log=LOGGER) as deployment:
+                deployment.install(args.cert_out, signed_crt, key_path=args.key_out, key_pem=key_pem)
+                if args.ocsp:
+                    from acme_ocsp import Stapler
+                    stapler = Stapler(deployment, metrics=metrics, log=LOGGER)
+                    try:
+                        stapler.refresh(args.cert_out)
+                    except (IOError, OSError, ValueError) as e:
+                        # the certificate is good without a staple, the next acme_ocsp.py run can fetch it
+                        LOGGER.warning("Not stapling: {0}".format(e))
+                    finally:
+                        stapler.close()
+        elif key_pem is not None:
+            write_atomic(args.key_out, key_pem, mode=0o600)
+        success = True
+    finally:
+        if responder is not None:
+            responder.stop()
+        if not success:
+            metrics.count("certificates_failed")
+        metrics.finish(success)
+        write_reports(metrics, args.metrics_json, args.metrics_prom)
+    if not args.cert_out:
+        sys.stdout.write(signed_crt)
 
 if __name__ == "__main__": # pragma: no cover
     main(sys.argv[1:])
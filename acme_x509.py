@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# read CSRs and certificates natively instead of scraping `openssl -text` output
+import binascii
+from acme_asn1 import SEQUENCE, pem_blocks, children, unwrap, decode_oid, decode_string, decode_time, encode
+
+COMMON_NAME = "2.5.4.3"
+EXTENSION_REQUEST = "1.2.840.113549.1.9.14"
+MS_EXTENSION_REQUEST = "1.3.6.1.4.1.311.2.1.14"
+SUBJECT_ALT_NAME = "2.5.29.17"
+DNS_NAME = 0x82 # [2] IMPLICIT IA5String in GeneralName
+URI = 0x86 # [6] IMPLICIT IA5String in GeneralName
+AUTHORITY_INFO_ACCESS = "1.3.6.1.5.5.7.1.1"
+OCSP = "1.3.6.1.5.5.7.48.1"
+CA_ISSUERS = "1.3.6.1.5.5.7.48.2"
+CSR_LABELS = ("CERTIFICATE REQUEST", "NEW CERTIFICATE REQUEST")
+CERTIFICATE_LABELS = ("CERTIFICATE",)
+
+
+def read_der(path, labels):
+    """contents of a DER file, or of the first PEM block with one of `labels`"""
+    with open(path, "rb") as der_file:
+        data = der_file.read()
+    if b"-----BEGIN" not in data:
+        return data
+    for label, headers, der in pem_blocks(data):
+        if label in labels:
+            return der
+    raise ValueError("No {0} found in {1}".format(" or ".join(labels), path))
+
+
+def name_attributes(name, oid):
+    """values of every `oid` attribute in the content of an X.501 Name"""
+    values = []
+    for rdn_tag, rdn in children(name):
+        for attr_tag, attr in children(rdn):
+            attr_type, value = children(attr)[:2]
+            if decode_oid(attr_type[1]) == oid:
+                values.append(decode_string(*value))
+    return values
+
+
+def extensions(content):
+    """yield (oid, critical, value) for the content of a DER Extensions sequence"""
+    for ext_tag, ext in children(content):
+        fields = children(ext)
+        critical = len(fields) == 3 and fields[1][1] != b"\x00"
+        yield decode_oid(fields[0][1]), critical, fields[-1][1]
+
+
+def dns_names(general_names):
+    """dNSName entries of a DER GeneralNames value"""
+    return [name.decode('ascii') for tag, name in children(unwrap(general_names, SEQUENCE)[1])
+        if tag == DNS_NAME]
+
+
+def access_locations(value, method):
+    """URIs of `method` in a DER AuthorityInfoAccessSyntax value"""
+    locations = []
+    for tag, description in children(unwrap(value, SEQUENCE)[1]):
+        access_method, location = children(description)
+        if decode_oid(access_method[1]) == method and location[0] == URI:
+            locations.append(location[1].decode('ascii'))
+    return locations
+
+
+def parse_csr(der):
+    """return (common_names, dns_sans) of a DER PKCS#10 request"""
+    info = children(unwrap(der, SEQUENCE)[1])[0][1]
+    # version, subject, subjectPKInfo, [0] attributes
+    fields = children(info)
+    common_names, sans = name_attributes(fields[1][1], COMMON_NAME), []
+    for tag, attributes in fields[3:]:
+        if tag != 0xa0:
+            continue
+        for attr_tag, attr in children(attributes):
+            attr_type, values = children(attr)
+            if decode_oid(attr_type[1]) not in (EXTENSION_REQUEST, MS_EXTENSION_REQUEST):
+                continue
+            for value_tag, value in children(values[1]):
+                for oid, critical, ext_value in extensions(value):
+                    if oid == SUBJECT_ALT_NAME:
+                        sans.extend(dns_names(ext_value))
+    return common_names, sans
+
+
+def load_csr(path):
+    """read a PEM or DER CSR once, return (der, domains) where domains are the CN and DNS SANs"""
+    der = read_der(path, CSR_LABELS)
+    try:
+        common_names, sans = parse_csr(der)
+    except (ValueError, IndexError, UnicodeDecodeError) as e:
+        raise IOError("Error loading {0}: {1}".format(path, e))
+    return der, set(common_names) | set(sans)
+
+
+def split_certificate(der):
+    """the raw DER pieces of a certificate: tbs, signature_algorithm (its OID), signature, serial
+    (content octets), issuer, subject and spki (whole elements) and extensions [(oid, critical, value)]"""
+    tbs_element, algorithm, signature = children(unwrap(der, SEQUENCE)[1])[:3]
+    tbs = children(tbs_element[1])
+    # an explicit [0] version is only present for v2/v3 certificates
+    if tbs[0][0] == 0xa0:
+        tbs = tbs[1:]
+    exts = []
+    for tag, content in tbs[6:]:
+        if tag == 0xa3:
+            exts.extend(extensions(unwrap(content, SEQUENCE)[1]))
+    return {
+        "tbs": encode(*tbs_element),
+        "signature_algorithm": decode_oid(children(algorithm[1])[0][1]),
+        "signature": bytes(signature[1])[1:], # skip the unused-bits byte
+        "serial": tbs[0][1],
+        "issuer": encode(*tbs[2]),
+        "validity": tbs[3][1],
+        "subject": encode(*tbs[4]),
+        "spki": encode(*tbs[5]),
+        "extensions": exts,
+    }
+
+
+def parse_certificate(der):
+    """the fields of a DER X.509 certificate the clients care about"""
+    parts = split_certificate(der)
+    not_before, not_after = children(parts["validity"])
+    sans, ocsp_urls, ca_issuers = [], [], []
+    for oid, critical, value in parts["extensions"]:
+        if oid == SUBJECT_ALT_NAME:
+            sans.extend(dns_names(value))
+        elif oid == AUTHORITY_INFO_ACCESS:
+            ocsp_urls.extend(access_locations(value, OCSP))
+            ca_issuers.extend(access_locations(value, CA_ISSUERS))
+    subject, issuer = unwrap(parts["subject"])[1], unwrap(parts["issuer"])[1]
+    common_names = name_attributes(subject, COMMON_NAME)
+    return {
+        "serial": binascii.hexlify(parts["serial"]).decode('ascii').lstrip("0") or "0",
+        "issuer": ", ".join(name_attributes(issuer, COMMON_NAME)),
+        "not_before": decode_time(*not_before),
+        "not_after": decode_time(*not_after),
+        "common_names": common_names,
+        "domains": sorted(set(common_names) | set(sans)),
+        "ocsp_urls": ocsp_urls,
+        "ca_issuers": ca_issuers,
+    }
+
+
+def load_certificate(path):
+    """read the first certificate of a PEM (or DER) file, return (der, fields)"""
+    der = read_der(path, CERTIFICATE_LABELS)
+    try:
+        return der, parse_certificate(der)
+    except (ValueError, IndexError, UnicodeDecodeError) as e:
+        raise IOError("Error loading {0}: {1}".format(path, e))
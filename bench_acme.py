@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# end-to-end issuance benchmark against the local mock CA: wall time, CA round trips and
+# subprocess spawns per certificate, checked against a saved baseline
+import argparse, json, logging, os, platform, shutil, subprocess, sys, tempfile, time
+import acme_tiny, client_for_boulder, revoke
+from acme_batch import issue_batch
+from acme_mockca import MockCA
+from acme_responder import ChallengeResponder
+
+CLIENTS = ["acme_tiny", "acme_tiny-responder", "client_for_boulder", "revoke"]
+SIZES = [1, 10, 100]
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_acme_baseline.json")
+COUNTERS = ["round_trips", "connections", "spawns"]
+# nonce prefetching and connection reuse depend on thread timing, spawns do not
+COUNTER_SLACK = {"round_trips": 0.1, "connections": 0.25, "spawns": 0}
+
+
+class _DirectoryResponder(ChallengeResponder):
+    """also serves the token files clients write into acme_dir, like the site's web server would"""
+
+    def __init__(self, acme_dir, address):
+        ChallengeResponder.__init__(self, address)
+        self.acme_dir = acme_dir
+
+    def get(self, token):
+        keyauthorization = ChallengeResponder.get(self, token)
+        if keyauthorization is None:
+            try:
+                with open(os.path.join(self.acme_dir, os.path.basename(token))) as token_file:
+                    keyauthorization = token_file.read()
+            except IOError:
+                pass
+        return keyauthorization
+
+
+class _SpawnCounter(object):
+    """counts the child processes started while installed"""
+
+    def __init__(self):
+        self.count = 0
+        self._popen = None
+
+    def install(self):
+        counter, popen = self, subprocess.Popen
+        class CountingPopen(popen):
+            def __init__(self, *args, **kwargs):
+                counter.count += 1
+                popen.__init__(self, *args, **kwargs)
+        self._popen, subprocess.Popen = popen, CountingPopen
+
+    def uninstall(self):
+        subprocess.Popen = self._popen
+
+
+def domains_for(size):
+    # loopback addresses reach the challenge responder without any DNS setup
+    if size > 254:
+        raise ValueError("At most 254 names per certificate are supported")
+    return ["127.0.1.{0}".format(i) for i in range(1, size + 1)]
+
+
+def make_csr(workdir, domain_key, domains, name):
+    path = os.path.join(workdir, name)
+    subprocess.check_call(["openssl", "req", "-new", "-sha256", "-key", domain_key, "-subj", "/CN=" + domains[0],
+        "-addext", "subjectAltName=" + ",".join("DNS:" + d for d in domains), "-out", path])
+    return path
+
+
+def run_case(client, size, ca, ctx, spawns):
+    """issue (or revoke) once, returns the measurements"""
+    ca_url, account_key, acme_dir, responder = ctx["ca_url"], ctx["account_key"], ctx["acme_dir"], ctx["responder"]
+    ca.reset_stats()
+    spawns.count = 0
+    started = time.time()
+    if client == "acme_tiny":
+        acme_tiny.get_crt(account_key, ctx["csrs"][size], acme_dir, log=acme_tiny.LOGGER, CA=ca_url,
+            check_nodes=ctx["check_nodes"])
+    elif client == "acme_tiny-responder":
+        acme_tiny.get_crt(account_key, ctx["csrs"][size], None, log=acme_tiny.LOGGER, CA=ca_url,
+            parallel=ctx["parallel"], nonce_prefetch=ctx["parallel"], responder=responder,
+            check_nodes=ctx["check_nodes"])
+    elif client == "client_for_boulder":
+        client_for_boulder.get_crt(account_key, ctx["csrs"][size], acme_dir, CA=ca_url, check_nodes=ctx["check_nodes"])
+    elif client == "revoke":
+        # every run revokes `size` fresh certificates
+        certificates = ctx["revocable"][size][:size]
+        del ctx["revocable"][size][:size]
+        acme = acme_tiny.AcmeSession(account_key, CA=ca_url, nonce_prefetch=ctx["parallel"])
+        try:
+            results = revoke.revoke_batch(acme, certificates, jobs=ctx["parallel"])
+        finally:
+            acme.close()
+        if not all(r["ok"] for r in results):
+            raise ValueError("Revocation failed: {0}".format([r["error"] for r in results if not r["ok"]]))
+    seconds = time.time() - started
+    stats = ca.stats()
+    return {"seconds": seconds, "round_trips": stats.get("requests", 0), "connections": stats.get("connections", 0),
+        "spawns": spawns.count}
+
+
+def compare(results, baseline, tolerance):
+    """return the regressions of results against the baseline results"""
+    regressions = []
+    for key, result in sorted(results.items()):
+        base = baseline.get(key)
+        if base is None:
+            continue
+        for counter in COUNTERS:
+            if result[counter] > base.get(counter, result[counter]) * (1 + COUNTER_SLACK[counter]):
+                regressions.append("{0}: {1} {2} -> {3}".format(key, counter, base[counter], result[counter]))
+        # a little absolute slack so the fastest cases don't flap on scheduler noise
+        if result["seconds"] > base["seconds"] * (1 + tolerance) + 0.05:
+            regressions.append("{0}: seconds {1:.2f} -> {2:.2f}".format(key, base["seconds"], result["seconds"]))
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark full issuance and revocation against a local mock CA. "
+        "Challenges are answered on port 80 of 127.0.1.x, or on --http-port of 127.0.0.1 where port 80 can't be bound.")
+    parser.add_argument("--clients", default=",".join(CLIENTS), help="comma separated clients to run")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in SIZES), help="names per certificate, default 1,10,100")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case, the fastest one counts, default 3")
+    parser.add_argument("--parallel", type=int, default=8, help="--parallel for the clients that have it, default 8")
+    parser.add_argument("--latency", type=float, default=0.0, metavar="SECONDS", help="mock CA response delay")
+    parser.add_argument("--validation-delay", type=float, default=0.0, metavar="SECONDS",
+        help="how long the mock CA takes to validate a challenge")
+    parser.add_argument("--baseline", default=BASELINE, help="compare against these results, default {0}".format(
+        os.path.basename(BASELINE)))
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against the baseline, default 0.25")
+    parser.add_argument("--save", metavar="PATH", help="write the results here, e.g. to update the baseline")
+    parser.add_argument("--http-port", type=int, default=80, metavar="PORT",
+        help="answer challenges on this port of 127.0.0.1 instead of port 80, 0 picks a free one")
+    args = parser.parse_args(argv)
+
+    clients = args.clients.split(",")
+    sizes = [int(s) for s in args.sizes.split(",")]
+    for logger in (acme_tiny.LOGGER, client_for_boulder.LOGGER, revoke.LOGGER):
+        logger.setLevel(logging.WARNING)
+
+    workdir = tempfile.mkdtemp(prefix="bench_acme_")
+    acme_dir = os.path.join(workdir, "acme-challenge")
+    os.mkdir(acme_dir)
+    devnull = open(os.devnull, "w")
+    spawns = _SpawnCounter()
+    try:
+        account_key, domain_key = os.path.join(workdir, "account.key"), os.path.join(workdir, "domain.key")
+        for key in (account_key, domain_key):
+            subprocess.check_call(["openssl", "genrsa", "-out", key, "2048"], stderr=devnull)
+        csrs = dict((size, make_csr(workdir, domain_key, domains_for(size), "{0}.csr".format(size))) for size in sizes)
+
+        try:
+            responder = _DirectoryResponder(acme_dir, ("", 80) if args.http_port == 80
+                else ("127.0.0.1", args.http_port)).start()
+        except (IOError, OSError) as e:
+            sys.stderr.write("Cannot serve challenges on port {0}: {1}\n".format(args.http_port, e))
+            return 2
+        if args.http_port == 80:
+            ca = MockCA(latency=args.latency, validation_delay=args.validation_delay).start()
+            check_nodes = None
+        else:
+            # off port 80 the names can't be fetched as themselves, the CA and the clients' own
+            # checks ask the responder with the name as Host instead
+            port = responder.server_address[1]
+            ca = MockCA(latency=args.latency, validation_delay=args.validation_delay, http_port=port,
+                validation_host="127.0.0.1").start()
+            check_nodes = ["http://127.0.0.1:{0}".format(port)]
+        ctx = {"ca_url": ca.base_url, "account_key": account_key, "acme_dir": acme_dir, "responder": responder,
+            "csrs": csrs, "parallel": args.parallel, "revocable": {}, "check_nodes": check_nodes}
+        try:
+            if "revoke" in clients:
+                # `size` single-name certificates per run to revoke, issued up front and not measured
+                single = csrs.get(1) or make_csr(workdir, domain_key, domains_for(1), "1.csr")
+                acme = acme_tiny.AcmeSession(account_key, CA=ca.base_url, responder=responder, check_nodes=check_nodes)
+                try:
+                    for size in sizes:
+                        jobs = [(single, os.path.join(workdir, "revoke-{0}-{1}.crt".format(size, i)))
+                            for i in range(size * args.repeat)]
+                        issue_batch(acme, jobs, None, jobs_at_once=args.parallel)
+                        ctx["revocable"][size] = [output for csr, output in jobs]
+                finally:
+                    acme.close()
+
+            results = {}
+            spawns.install()
+            try:
+                for client in clients:
+                    for size in sizes:
+                        runs = []
+                        for attempt in range(args.repeat):
+                            runs.append(run_case(client, size, ca, ctx, spawns))
+                        best = min(runs, key=lambda r: r["seconds"])
+                        results["{0}/{1}".format(client, size)] = best
+                        sys.stdout.write("{0:<20} {1:>4} names {2:8.2f}s {3:5} round trips {4:4} connections "
+                            "{5:4} spawns\n".format(client, size, best["seconds"], best["round_trips"],
+                            best["connections"], best["spawns"]))
+            finally:
+                spawns.uninstall()
+        finally:
+            ca.stop()
+            responder.stop()
+    finally:
+        devnull.close()
+        shutil.rmtree(workdir)
+
+    status = 0
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file)["results"], args.tolerance)
+        for regression in regressions:
+            sys.stdout.write("REGRESSION {0}\n".format(regression))
+        sys.stdout.write("{0} regression(s) against {1}\n".format(len(regressions), args.baseline))
+        status = 1 if regressions else 0
+    if args.save:
+        with open(args.save, "w") as save_file:
+            json.dump({"python": platform.python_version(), "created": int(time.time()), "repeat": args.repeat,
+                "parallel": args.parallel, "latency": args.latency, "results": results},
+                save_file, indent=1, sort_keys=True)
+            save_file.write("\n")
+    return status
+
+if __name__ == "__main__": # pragma: no cover
+    sys.exit(main(sys.argv[1:]))
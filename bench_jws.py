@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# compare the per-request signing cost of the JWS signing backends for RSA and EC account keys
+import argparse, os, sys, tempfile, time
+from acme_jws import load_signer
+from acme_keys import KEY_TYPES, generate_key
+
+
+def bench(signer, seconds):
+    payload = b"eyJhbGciOiJSUzI1NiJ9.eyJyZXNvdXJjZSI6Im5ldy1hdXRoeiJ9"
+    count, start = 0, time.time()
+    while time.time() - start < seconds:
+        signer.sign(payload)
+        count += 1
+    return count / (time.time() - start)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the in-process and openssl JWS signers")
+    parser.add_argument("--account-key", help="key to sign with, throwaway keys of --key-types are generated if omitted")
+    parser.add_argument("--key-types", default="rsa:2048,rsa:4096,ec:p256,ec:p384",
+        help="comma separated account key types to compare, from {0}".format(", ".join(KEY_TYPES)))
+    parser.add_argument("--bits", type=int, help="only benchmark a generated RSA key of this size")
+    parser.add_argument("--seconds", type=float, default=3.0, help="time spent on each backend")
+    parser.add_argument("--backends", default="cryptography,libcrypto,python,openssl", help="comma separated backends to run")
+    args = parser.parse_args(argv)
+
+    keys, generated = [], []
+    if args.account_key is not None:
+        keys.append((os.path.basename(args.account_key), args.account_key))
+    else:
+        for key_type in (["rsa:{0}".format(args.bits)] if args.bits else args.key_types.split(",")):
+            handle, path = tempfile.mkstemp(suffix=".key")
+            os.write(handle, generate_key(key_type))
+            os.close(handle)
+            keys.append((key_type, path))
+            generated.append(path)
+    try:
+        for name, account_key in keys:
+            results = {}
+            for backend in args.backends.split(","):
+                try:
+                    signer = load_signer(account_key, backend)
+                except ValueError as e:
+                    sys.stdout.write("{0:<9} {1:<13} skipped: {2}\n".format(name, backend, e))
+                    continue
+                results[backend] = bench(signer, args.seconds)
+                sys.stdout.write("{0:<9} {1:<13} {2} {3:10.1f} signatures/s {4:8.3f} ms/request\n".format(
+                    name, backend, signer.alg, results[backend], 1000.0 / results[backend]))
+            if "openssl" in results:
+                for backend, rate in sorted(results.items()):
+                    if backend != "openssl":
+                        sys.stdout.write("{0:<9} {1} is {2:.1f}x openssl\n".format(name, backend, rate / results["openssl"]))
+    finally:
+        for path in generated:
+            os.remove(path)
+
+if __name__ == "__main__": # pragma: no cover
+    main(sys.argv[1:])
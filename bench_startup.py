@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# how long a fresh interpreter takes to get ready, what a cron run or a service embedding AcmeSession pays on start
+import argparse, os, subprocess, sys, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CASES = [
+    ("import acme_tiny", ["-c", "import acme_tiny"]),
+    ("import + modules", ["-c", "import sys, acme_tiny; sys.stdout.write(str(len(sys.modules)))"]),
+    ("acme_tiny.py --help", [os.path.join(HERE, "acme_tiny.py"), "--help"]),
+    ("python itself", ["-c", "pass"]),
+]
+
+
+def bench(args, runs):
+    """median wall time of `runs` fresh interpreters and the output of the last one"""
+    times, out = [], b""
+    for _ in range(runs):
+        start = time.time()
+        proc = subprocess.Popen([sys.executable] + args, cwd=HERE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        times.append(time.time() - start)
+        if proc.returncode != 0:
+            raise IOError("{0} failed: {1}".format(" ".join(args), err.decode('utf8', 'replace')))
+    return sorted(times)[len(times) // 2], out
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Measure the start-up time of acme_tiny")
+    parser.add_argument("--runs", type=int, default=20, help="interpreters started per case, the median counts, default 20")
+    args = parser.parse_args(argv)
+
+    for name, case in CASES:
+        median, out = bench(case, args.runs)
+        extra = " {0} modules loaded".format(out.decode('utf8')) if name == "import + modules" else ""
+        sys.stdout.write("{0:<20} {1:8.1f} ms{2}\n".format(name, median * 1000, extra))
+
+if __name__ == "__main__": # pragma: no cover
+    main(sys.argv[1:])
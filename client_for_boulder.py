@@ -1,10 +1,11 @@
 #!/usr/bin/env python
-import argparse, subprocess, json, os, sys, base64, binascii, time, hashlib, re, copy, textwrap, logging
+import argparse, json, os, sys, base64, re, copy, textwrap, logging
 
-try:
-    from urllib.request import urlopen  # Python 3
-except ImportError:
-    from urllib2 import urlopen  # Python 2
+from acme_challenges import PresenceCheck
+from acme_http import Directory, HTTPSession, NoncePool
+from acme_jws import BACKENDS, account_jwk, jwk_thumbprint, load_signer
+from acme_poll import ChallengePoller
+from acme_x509 import load_csr
 
 # based on the open source acme_tiny.py and adapted for boulder
 
@@ -15,176 +16,152 @@ LOGGER.addHandler(logging.StreamHandler())
 LOGGER.setLevel(logging.INFO)
 
 
-def get_crt(account_key, domain_csr, acme_dir, CA=DEFAULT_CA):
+def get_crt(account_key, domain_csr, acme_dir, CA=DEFAULT_CA, nonce_prefetch=0, signer_backend="auto",
+            session=None, check_nodes=None):
     # helper function base_64 encode
     def base_64(b):
         return base64.urlsafe_b64encode(b).decode('utf8').replace("=", "")
 
     # parse account key to get public key
     LOGGER.info("Parsing account key...")
-
-    process = subprocess.Popen(["openssl", "rsa", "-in", account_key, "-noout", "-text"],
-                            stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
-    output, error = process.communicate()
-    if process.returncode != 0:
-        raise IOError("OpenSSL Error: {}".format(error))
-    public_hexadecimal, public_exponent = re.search(
-        r"modulus:\n\s+00:([a-f0-9\:\s]+?)\npublicExponent: ([0-9]+)",
-        output.decode('utf8'), re.MULTILINE | re.DOTALL).groups()
-    public_exponent = "{0:x}".format(int(public_exponent))
-    public_exponent = "0{}".format(public_exponent) if len(public_exponent) % 2 else public_exponent
-    header = {
-        "alg": "RS256",
-        "jwk": {
-            "e": base_64(binascii.unhexlify(public_exponent.encode("utf-8"))),
-            "kty": "RSA",
-            "n": base_64(binascii.unhexlify(re.sub(r"(\s|:)", "", public_hexadecimal).encode("utf-8"))),
-        },
-    }
-    accountkey_json = json.dumps(header['jwk'], sort_keys = True, separators = (',', ':'))
-    thumbprint = base_64(hashlib.sha256(accountkey_json.encode('utf8')).digest())
+    with open(account_key, "rb") as key_file:
+        jwk = account_jwk(key_file.read())[1]
+    thumbprint = jwk_thumbprint(jwk)
+    signer = load_signer(account_key, signer_backend, log = LOGGER)
+    header = {"alg": signer.alg, "jwk": jwk}
+
+    # all CA traffic goes over kept-alive connections, nonces come from earlier CA
+    # responses and a HEAD is only sent when we run dry
+    own_session = session is None
+    session = session or HTTPSession()
+    nonces = NoncePool(CA + "/directory", opener = session.urlopen, prefetch = nonce_prefetch)
+    nonces.start_prefetch()
+    directory = Directory(CA + "/directory", session, observe = nonces.observe)
+    presence = PresenceCheck(session, nodes = check_nodes, log = LOGGER)
 
     # helper function make signed requests
-    def _send_signed_request(url, payload):
+    def _send_signed_request(url, payload, retry_bad_nonce = True):
         payload_64 = base_64(json.dumps(payload).encode('utf8'))
         protected = copy.deepcopy(header)
-        protected["nonce"] = urlopen(CA + "/directory").headers['Replay-Nonce']
+        protected["nonce"] = nonces.get()
         protected_64 = base_64(json.dumps(protected).encode('utf8'))
-        process = subprocess.Popen(["openssl", "dgst", "-sha256", "-sign", account_key],
-                                stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
-        output, error = process.communicate("{0}.{1}".format(protected_64, payload_64).encode('utf8'))
-        if process.returncode != 0:
-            raise IOError("OpenSSL Error: {}".format(error))
+        signature = signer.sign("{0}.{1}".format(protected_64, payload_64).encode('utf8'))
         data = json.dumps({
             "header": header, "protected": protected_64,
-            "payload": payload_64, "signature": base_64(output),
+            "payload": payload_64, "signature": base_64(signature),
         })
         try:
-            checker = urlopen(url, data.encode('utf8'))
+            checker = session.urlopen(url, data.encode('utf8'))
+            nonces.observe(checker.headers)
             return checker.getcode(), checker.read()
         except IOError as e:
-            return getattr(e, "code", None), getattr(e, "read", e.__str__)()
-
-    # find domains
-    LOGGER.info("Parsing certificate signing request...")
-    process = subprocess.Popen(["openssl", "req", "-in", domain_csr, "-noout", "-text"],
-                            stdout = subprocess.PIPE, stderr = subprocess.PIPE)
-    output, error = process.communicate()
-    if process.returncode != 0:
-        raise IOError("Error loading {0}: {1}".format(domain_csr, error))
-    domains = set([])
-    common_name = re.search(r"Subject:.*? CN\s?=\s?([^\s,;/]+)", output.decode('utf8'))
-    if common_name is not None:
-        domains.add(common_name.group(1))
-    subject_alt_names = re.search(r"X509v3 Subject Alternative Name: \n +([^\n]+)\n", output.decode('utf8'),
-                                  re.MULTILINE | re.DOTALL)
-    if subject_alt_names is not None:
-        for checker in subject_alt_names.group(1).split(", "):
-            if checker.startswith("DNS:"):
-                domains.add(checker[4:])
-
-    # get the certificate domains and expiration
-    LOGGER.info("Registering account...")
-    code, result = _send_signed_request(CA + "/acme/new-reg", {
-        "resource": "new-reg",
-        "agreement": json.loads(urlopen(CA + "/directory").read().decode('utf8'))['meta']['terms-of-service'],
-    })
-    if code == 201:
-        LOGGER.info("Registered!")
-    elif code == 409:
-        LOGGER.info("Already registered!")
-    else:
-        raise ValueError("Error registering: {0} {1}".format(code, result))
-
-    # verify each domain
-    for domain in domains:
-        LOGGER.info("Verifying {}...".format(domain))
-
-        # get new challenge
-        code, result = _send_signed_request(CA + "/acme/new-authz", {
-            "resource": "new-authz",
-            "identifier": {"type": "dns", "value": domain},
-        })
-        if code != 201:
-            raise ValueError("Error requesting challenges: {0} {1}".format(code, result))
-
-        # make the challenge file
-        challenge = [c for c in json.loads(result.decode('utf8'))['challenges'] if c['type'] == "http-01"][0]
-        token = re.sub(r"[^A-Za-z0-9_\-]", "_", challenge['token'])
-        keyauthorization = "{0}.{1}".format(token, thumbprint)
-        wellknown_path = os.path.join(acme_dir, token)
-        with open(wellknown_path, "w") as wellknown_file:
-            wellknown_file.write(keyauthorization)
-
-        # check that the file is in place
-        wellknown_url = "http://{0}/.well-known/acme-challenge/{1}".format(domain, token)
-        try:
-            checker = urlopen(wellknown_url)
-            checker_data = checker.read().decode('utf8').strip()
-            assert checker_data == keyauthorization
-        except (IOError, AssertionError):
-            os.remove(wellknown_path)
-            raise ValueError("Wrote file to {0}, but couldn't download {1}".format(
-                wellknown_path, wellknown_url))
-
-        # notify challenge are met
-        code, result = _send_signed_request(challenge['uri'], {
-            "resource": "challenge",
-            "keyAuthorization": keyauthorization,
+            nonces.observe(getattr(e, "headers", None))
+            code, result = getattr(e, "code", None), getattr(e, "read", e.__str__)()
+        # a pooled nonce may have gone stale on the CA side, try once more with a fresh one
+        if code == 400 and retry_bad_nonce and b"badNonce" in result:
+            return _send_signed_request(url, payload, retry_bad_nonce = False)
+        return code, result
+
+    # the prefetch thread and the pooled connections go away however the order ends
+    try:
+        # find domains, the DER is kept for new-cert
+        LOGGER.info("Parsing certificate signing request...")
+        domain_csr_der, domains = load_csr(domain_csr)
+
+        # get the certificate domains and expiration
+        LOGGER.info("Registering account...")
+        code, result = _send_signed_request(directory.resource("new-reg"), {
+            "resource": "new-reg",
+            "agreement": directory.terms_of_service(),
         })
-        if code != 202:
-            raise ValueError("Error triggering challenge: {0} {1}".format(code, result))
-
-        # wait for challenge to be verified
-        while True:
+        if code == 201:
+            LOGGER.info("Registered!")
+        elif code == 409:
+            LOGGER.info("Already registered!")
+        else:
+            raise ValueError("Error registering: {0} {1}".format(code, result))
+
+        # verify each domain
+        for domain in domains:
+            LOGGER.info("Verifying {}...".format(domain))
+
+            # get new challenge
+            code, result = _send_signed_request(directory.resource("new-authz"), {
+                "resource": "new-authz",
+                "identifier": {"type": "dns", "value": domain},
+            })
+            if code != 201:
+                raise ValueError("Error requesting challenges: {0} {1}".format(code, result))
+
+            # make the challenge file
+            challenge = [c for c in json.loads(result.decode('utf8'))['challenges'] if c['type'] == "http-01"][0]
+            token = re.sub(r"[^A-Za-z0-9_\-]", "_", challenge['token'])
+            keyauthorization = "{0}.{1}".format(token, thumbprint)
+            wellknown_path = os.path.join(acme_dir, token)
+            with open(wellknown_path, "w") as wellknown_file:
+                wellknown_file.write(keyauthorization)
+
+            # check that the file is in place, on the domain itself or on every one of check_nodes
             try:
-                checker = urlopen(challenge['uri'])
-                challenge_status = json.loads(checker.read().decode('utf8'))
-            except IOError as e:
-                raise ValueError("Error checking challenge: {0} {1}".format(
-                    e.code, json.loads(e.read().decode('utf8'))))
-            if challenge_status['status'] == "pending":
-                time.sleep(2)
-            elif challenge_status['status'] == "valid":
-                LOGGER.info("{} verified!".format(domain))
+                presence.check([(domain, token, keyauthorization)])
+            except ValueError as e:
                 os.remove(wellknown_path)
-                break
-            else:
-                raise ValueError("{0} challenge did not pass: {1}".format(
-                    domain, challenge_status))
-
-    # get the new certificate
-    LOGGER.info("Signing certificate...")
-    process = subprocess.Popen(["openssl", "req", "-in", domain_csr, "-outform", "DER"],
-                            stdout = subprocess.PIPE, stderr = subprocess.PIPE)
-    domain_csr_der, error = process.communicate()
-    code, result = _send_signed_request(CA + "/acme/new-cert", {
-        "resource": "new-cert",
-        "csr": base_64(domain_csr_der),
-    })
-    if code != 201:
-        raise ValueError("Error signing certificate: {0} {1}".format(code, result))
-
-    # return signed certificate!
-    LOGGER.info("Certificate signed!")
-    return """-----BEGIN CERTIFICATE-----\n{}\n-----END CERTIFICATE-----\n""".format(
-        "\n".join(textwrap.wrap(base64.b64encode(result).decode('utf8'), 64)))
+                raise ValueError("Wrote file to {0}, but {1}".format(wellknown_path, e))
+
+            # notify challenge are met
+            code, result = _send_signed_request(challenge['uri'], {
+                "resource": "challenge",
+                "keyAuthorization": keyauthorization,
+            })
+            if code != 202:
+                raise ValueError("Error triggering challenge: {0} {1}".format(code, result))
+
+            # wait for challenge to be verified, backing off as the CA asks
+            poller = ChallengePoller(session.urlopen, observe = nonces.observe, log = LOGGER)
+            poller.add(domain, challenge['uri'])
+            try:
+                poller.run()
+            finally:
+                os.remove(wellknown_path)
+            LOGGER.info("{} verified!".format(domain))
+
+        # get the new certificate
+        LOGGER.info("Signing certificate...")
+        code, result = _send_signed_request(directory.resource("new-cert"), {
+            "resource": "new-cert",
+            "csr": base_64(domain_csr_der),
+        })
+        if code != 201:
+            raise ValueError("Error signing certificate: {0} {1}".format(code, result))
+
+        # return signed certificate!
+        LOGGER.debug("HTTP connections opened: {connections_opened}, reused: {connections_reused}".format(**session.stats()))
+        LOGGER.info("Certificate signed!")
+        return """-----BEGIN CERTIFICATE-----\n{}\n-----END CERTIFICATE-----\n""".format(
+            "\n".join(textwrap.wrap(base64.b64encode(result).decode('utf8'), 64)))
+    finally:
+        nonces.close()
+        if own_session:
+            session.close()
 
 
 def main(argv):
     parser = argparse.ArgumentParser(
         description = "just a tiny_client"
     )
-    parser.add_argument("--account-key", required = True, help = "path to account private key")
+    parser.add_argument("--account-key", required = True, help = "path to account private key, RSA or EC (P-256, P-384)")
     parser.add_argument("--domain-csr", required = True, help = "path to certificate signing request")
     parser.add_argument("--acme-dir", required = True, help = "path to .well-known/acme-challenge/ directory")
     parser.add_argument("--quiet", action = "store_const", const = logging.ERROR, help = "suppress output except for errors")
     parser.add_argument("--ca", default = DEFAULT_CA, help = "certificate authority, default is https://iisca.com")
+    parser.add_argument("--signer", default = "auto", choices = BACKENDS,
+                        help = "how to sign requests with the account key, default picks the fastest available")
 
     arguments = parser.parse_args(argv)
 
     LOGGER.setLevel(arguments.quiet or LOGGER.level)
-    signed_crt = get_crt(arguments.account_key, arguments.domain_csr, arguments.acme_dir, CA=arguments.ca)
+    signed_crt = get_crt(arguments.account_key, arguments.domain_csr, arguments.acme_dir, CA=arguments.ca,
+                         signer_backend=arguments.signer)
     sys.stdout.write(signed_crt)
 
 
@@ -21,9 +21,5 @@ openssl req -new -sha256 -key iissite.com.key.pem -subj "/CN=iissite.com" > doma
 ##### python script ######
 python client_for_boulder.py --account-key ./account.key --domain-csr ./domain.csr --acme-dir /var/www/html/.well-known/acme-challenge/ > iissite.com.cert.pem
 
-##### final destination ######
-sudo cp -u ./iissite.com.key.pem /home/iis/certs/iissite
-sudo cp -u ./iissite.com.cert.pem /home/iis/certs/iissite
-
-##### reboot apache ######
-sudo systemctl restart apache2
+##### final destination, swapped in atomically, then a graceful reload of apache ######
+sudo python acme_deploy.py --install ./iissite.com.key.pem /home/iis/certs/iissite/iissite.com.key.pem --install ./iissite.com.cert.pem /home/iis/certs/iissite/iissite.com.cert.pem --reload-hook "systemctl reload apache2"
@@ -1,22 +1,30 @@
 #!/usr/bin/env python
 
 import argparse
-import subprocess
 import json
 import os
 import sys
 import base64
-import binascii
 import copy
+import glob
 import tempfile
-import re
-import urllib2
+import time
 import logging
+from multiprocessing.pool import ThreadPool
+from acme_http import Directory, HTTPSession
+from acme_jws import BACKENDS, CURVES_BY_NAME, account_jwk, ecdsa_der_to_jws
+from acme_tiny import AcmeSession
+from acme_x509 import load_certificate
 
 try:
-    from urllib.request import urlopen # Python 3
+    from urllib.request import Request # Python 3
 except ImportError:
-    from urllib2 import urlopen # Python 2
+    from urllib2 import Request # Python 2
+
+try:
+    input = raw_input # Python 2
+except NameError:
+    pass
 
 CA = "https://iisca.com"
 
@@ -24,9 +32,23 @@ LOGGER = logging.getLogger(__name__)
 LOGGER.addHandler(logging.StreamHandler())
 LOGGER.setLevel(logging.INFO)
 
-def revoke_certificate(account_key, signed_certificate):
+def revoke_certificate(account_key, signed_certificate, session=None, CA=CA, inventory=None):
+    """revoke one certificate, the operator signs the request by hand so the
+    account private key never has to be on this machine; it is then marked
+    revoked in the SQLite inventory at `inventory` if given"""
+    if session is not None:
+        return _revoke_certificate(account_key, signed_certificate, session, CA, inventory)
+    session = HTTPSession()
+    try:
+        return _revoke_certificate(account_key, signed_certificate, session, CA, inventory)
+    finally:
+        session.close()
+
+
+def _revoke_certificate(account_key, signed_certificate, session, CA, inventory):
+    directory = Directory("{0}/directory".format(CA), session)
 
-    nonce_req = urllib2.Request("{0}/directory".format(CA))
+    nonce_req = Request("{0}/directory".format(CA))
     nonce_req.get_method = lambda : 'HEAD'
 
     # tiny helper function base64 encoding
@@ -36,44 +58,26 @@ def revoke_certificate(account_key, signed_certificate):
 
     # Step 1: Get account public key
     LOGGER.info("Parsing account key ...")
-    process = subprocess.Popen(["openssl", "rsa", "-pubin", "-in", account_key, "-noout", "-text"],
-        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    out, err = process.communicate()
-    if process.returncode != 0:
-        raise IOError("Error loading {0}".format(account_key))
-    pub_hex, public_exponent = re.search("Modulus\:\s+00:([a-f0-9\:\s]+?)Exponent\: ([0-9]+)", out, re.MULTILINE|re.DOTALL).groups()
-    pub_mod = binascii.unhexlify(re.sub("(\s|:)", "", pub_hex))
-    pub_mod64 = base_64(pub_mod)
-    public_exponent = int(public_exponent)
-    public_exponent = "{0:x}".format(public_exponent)
-    public_exponent = "0{0}".format(public_exponent) if len(public_exponent) % 2 else public_exponent
-    public_exponent = binascii.unhexlify(public_exponent)
-    header = {
-        "alg": "RS256",
-        "jwk": {
-            "e": base_64(public_exponent),
-            "kty": "RSA",
-            "n": pub_mod64,
-        },
-    }
-    sys.stderr.write("Found public key!\n".format(header))
+    with open(account_key, "rb") as key_file:
+        alg, jwk = account_jwk(key_file.read())
+    header = {"alg": alg, "jwk": jwk}
+    curve = CURVES_BY_NAME.get(jwk.get("crv"))
+    sys.stderr.write("Found public key!\n")
 
     # Step 2: Generate the payload that needs to be signed
     # revocation request
-    process = subprocess.Popen(["openssl", "x509", "-in", signed_certificate, "-outform", "DER"],
-        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    crt_der, err = process.communicate()
+    crt_der = load_certificate(signed_certificate)[0]
     crt_der64 = base_64(crt_der)
     crt_raw = json.dumps({
         "resource": "revoke-cert",
         "certificate": crt_der64,
     }, sort_keys=True, indent=4)
-    crt_b64 = base_64(crt_raw)
+    crt_b64 = base_64(crt_raw.encode('utf8'))
     crt_protected = copy.deepcopy(header)
-    crt_protected.update({"nonce": urllib2.urlopen(nonce_req).headers['Replay-Nonce']})
-    crt_protected64 = base_64(json.dumps(crt_protected, sort_keys=True, indent=4))
+    crt_protected.update({"nonce": session.urlopen(nonce_req).headers['Replay-Nonce']})
+    crt_protected64 = base_64(json.dumps(crt_protected, sort_keys=True, indent=4).encode('utf8'))
     crt_file = tempfile.NamedTemporaryFile(dir=".", prefix="revoke_", suffix=".json")
-    crt_file.write("{0}.{1}".format(crt_protected64, crt_b64))
+    crt_file.write("{0}.{1}".format(crt_protected64, crt_b64).encode('utf8'))
     crt_file.flush()
     crt_file_name = os.path.basename(crt_file.name)
     crt_file_sig = tempfile.NamedTemporaryFile(dir=".", prefix="revoke_", suffix=".sig")
@@ -82,18 +86,20 @@ def revoke_certificate(account_key, signed_certificate):
     # Step 3: Ask the user to sign the revocation request
     sys.stderr.write("""\
 STEP 1: You need to sign a file (replace 'user.key' with your user private key)
-openssl dgst -sha256 -sign user.key -out {0} {1}
-""".format(crt_file_sig_name, crt_file_name))
+openssl dgst -{2} -sign user.key -out {0} {1}
+""".format(crt_file_sig_name, crt_file_name, curve.hash_name if curve is not None else "sha256"))
 
     temp_stdout = sys.stdout
     sys.stdout = sys.stderr
-    raw_input("Press Enter when you've run the command above in a new terminal window...")
+    input("Press Enter when you've run the command above in a new terminal window...")
     sys.stdout = temp_stdout
 
     # Step 4: Load the signature and send the revocation request
     sys.stderr.write("Requesting revocation...\n")
     crt_file_sig.seek(0)
-    crt_sig64 = _base_64(crt_file_sig.read())
+    crt_sig = crt_file_sig.read()
+    # openssl writes EC signatures as DER, the JWS wants r || s
+    crt_sig64 = base_64(ecdsa_der_to_jws(crt_sig, curve) if curve is not None else crt_sig)
     crt_data = json.dumps({
         "header": header,
         "protected": crt_protected64,
@@ -101,23 +107,119 @@ openssl dgst -sha256 -sign user.key -out {0} {1}
         "signature": crt_sig64,
     }, sort_keys=True, indent=4)
     try:
-        resp = urllib2.urlopen("{0}/acme/revoke-cert".format(CA), crt_data)
-        signed_der = resp.read()
-    except urllib2.HTTPError as e:
+        resp = session.urlopen(directory.resource("revoke-cert"), crt_data.encode('utf8'))
+        resp.read()
+    except IOError as e:
         sys.stderr.write("Error: crt_data:\n")
         sys.stderr.write(crt_data)
         sys.stderr.write("\n")
-        sys.stderr.write(e.read())
+        sys.stderr.write(getattr(e, "read", e.__str__)().decode('utf8', 'replace'))
         sys.stderr.write("\n")
         raise
     sys.stderr.write("Certificate revoked!\n")
-
-
+    if inventory:
+        from acme_inventory import Inventory
+        records = Inventory(inventory)
+        try:
+            records.record_revoked(crt_der)
+        finally:
+            records.close()
+
+
+def read_certificate_list(list_path):
+    """one certificate path per line, relative to the list file, # starts a comment"""
+    base, paths = os.path.dirname(os.path.abspath(list_path)), []
+    with open(list_path) as list_file:
+        for line in list_file:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                paths.append(os.path.join(base, line))
+    return paths
+
+
+def scan_certificate_dir(cert_dir):
+    return sorted(glob.glob(os.path.join(cert_dir, "*.crt")) + glob.glob(os.path.join(cert_dir, "*.pem")))
+
+
+def revoke_batch(acme, certificates, jobs=8, reason=None, log=LOGGER):
+    """revoke every certificate path with the shared AcmeSession, returns one summary dict per certificate"""
+    def _revoke(path):
+        started = time.time()
+        try:
+            der, fields = load_certificate(path)
+            outcome = "revoked" if acme.revoke(der, reason=reason) else "already revoked"
+        except Exception as e:
+            log.error("{0}: {1}".format(path, e))
+            return {"certificate": path, "ok": False, "outcome": "failed", "seconds": time.time() - started,
+                "error": str(e)}
+        log.info("{0}: {1} (serial {2})".format(path, outcome, fields["serial"]))
+        return {"certificate": path, "ok": True, "outcome": outcome, "seconds": time.time() - started,
+            "error": None}
+
+    # register before fanning out so the workers don't all queue on it
+    acme.register()
+    pool = ThreadPool(max(1, min(jobs, len(certificates))))
+    try:
+        return pool.map(_revoke, certificates)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description = 'Parsing arguments for revoking a signed TLS certificate',
+        epilog="With --public-key the single request is signed by hand, with --account-key any number "
+            "of certificates are revoked in-process, e.g. revoke.py --account-key account.key --cert-dir ./certs")
+    key = parser.add_mutually_exclusive_group(required=True)
+    key.add_argument("-p", "--public-key", help="path to your account public key, revoke one certificate interactively")
+    key.add_argument("-k", "--account-key", help="path to your account private key, revoke without prompting")
+    parser.add_argument("crt_path", nargs="*", help="path to your signed certificate")
+    parser.add_argument("--list", help="file with one certificate path per line")
+    parser.add_argument("--cert-dir", help="revoke every *.crt and *.pem in this directory")
+    parser.add_argument("--jobs", type=int, default=8, help="revocation requests in flight at once, default 8")
+    parser.add_argument("--reason", type=int, metavar="CODE",
+        help="RFC 5280 revocation reason code, e.g. 1 for keyCompromise")
+    parser.add_argument("--quiet", action="store_const", const=logging.ERROR, help="suppress output except for errors")
+    parser.add_argument("--ca", default=CA, help="certificate authority, default is https://iisca.com")
+    parser.add_argument("--signer", default="auto", choices=BACKENDS,
+        help="how to sign requests with the account key, default picks the fastest available")
+    parser.add_argument("--state-dir", help="keep account and CA directory state here between runs")
+    parser.add_argument("--inventory", metavar="PATH",
+        help="mark the certificates revoked in this SQLite inventory, default inventory.sqlite3 in --state-dir")
+
+    args = parser.parse_args(argv)
+    LOGGER.setLevel(args.quiet or LOGGER.level)
+
+    certificates = list(args.crt_path)
+    if args.list:
+        certificates.extend(read_certificate_list(args.list))
+    if args.cert_dir:
+        certificates.extend(scan_certificate_dir(args.cert_dir))
+    if not certificates:
+        parser.error("no certificates given")
+    if args.public_key:
+        if len(certificates) != 1:
+            parser.error("--public-key revokes exactly one certificate, use --account-key for more")
+        revoke_certificate(args.public_key, certificates[0], CA=args.ca,
+            inventory=args.inventory or (os.path.join(args.state_dir, "inventory.sqlite3") if args.state_dir else None))
+        return 0
+
+    acme = AcmeSession(args.account_key, CA=args.ca, log=LOGGER, signer_backend=args.signer,
+        nonce_prefetch=args.jobs, state_dir=args.state_dir, inventory=args.inventory)
+    try:
+        results = revoke_batch(acme, certificates, jobs=args.jobs, reason=args.reason)
+    finally:
+        acme.close()
+
+    for result in results:
+        sys.stdout.write("{0:<15} {1:6.2f}s {2}{3}\n".format(result["outcome"], result["seconds"],
+            result["certificate"], "" if result["ok"] else " ({0})".format(result["error"])))
+    counts = dict((outcome, len([r for r in results if r["outcome"] == outcome]))
+        for outcome in ("revoked", "already revoked", "failed"))
+    sys.stdout.write("{0} revoked, {1} already revoked, {2} failed\n".format(counts["revoked"],
+        counts["already revoked"], counts["failed"]))
+    # a certificate someone else revoked already is where we wanted it, only real failures count
+    return 1 if counts["failed"] else 0
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description = 'Parsing arguments for revoking a signed TLS certificate')
-    parser.add_argument("-p", "--public-key", required=True, help="path to your account public key")
-    parser.add_argument("crt_path", help="path to your signed certificate")
-
-    args = parser.parse_args()
-    revoke_certificate(args.public_key, args.crt_path)
+    sys.exit(main(sys.argv[1:]))
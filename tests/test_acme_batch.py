@@ -0,0 +1,128 @@
+import json, logging, os, stat, sys, unittest
+import acme_tiny
+from acme_batch import issue_batch, read_manifest, scan_csr_dir, main
+from acme_deploy import Deployment
+from acme_mockca import MockCA
+from acme_x509 import load_certificate
+from bench_acme import _DirectoryResponder
+from tests.util import TempDirTestCase, openssl
+try:
+    from StringIO import StringIO # Python 2
+except ImportError:
+    from io import StringIO # Python 3
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ManifestTest(TempDirTestCase):
+
+    def write(self, name, text):
+        path = os.path.join(self.tmp, name)
+        with open(path, "w") as manifest_file:
+            manifest_file.write(text)
+        return path
+
+    def test_read_manifest(self):
+        manifest = self.write("sites.txt", "# csr and certificate\ncsrs/a.csr certs/a.crt\n\n"
+            "b.example,www.b.example keys/b.key certs/b.crt # new key every time\n")
+        self.assertEqual(read_manifest(manifest), [
+            (os.path.join(self.tmp, "csrs/a.csr"), os.path.join(self.tmp, "certs/a.crt")),
+            (("b.example", "www.b.example"), os.path.join(self.tmp, "keys/b.key"), os.path.join(self.tmp, "certs/b.crt")),
+        ])
+
+    def test_bad_line(self):
+        manifest = self.write("bad.txt", "a.csr a.crt\nonly-one-field\n")
+        with self.assertRaises(ValueError) as raised:
+            read_manifest(manifest)
+        self.assertIn("bad.txt:2", str(raised.exception))
+
+    def test_scan_csr_dir(self):
+        csr_dir = os.path.join(self.tmp, "csrs")
+        os.mkdir(csr_dir)
+        for name in ("b.csr", "a.csr", "notes.txt"):
+            self.write(os.path.join("csrs", name), "")
+        self.assertEqual(scan_csr_dir(csr_dir), [(os.path.join(csr_dir, "a.csr"), os.path.join(csr_dir, "a.crt")),
+            (os.path.join(csr_dir, "b.csr"), os.path.join(csr_dir, "b.crt"))])
+        self.assertEqual(scan_csr_dir(csr_dir, "/certs")[0], (os.path.join(csr_dir, "a.csr"), "/certs/a.crt"))
+
+
+class BatchTest(TempDirTestCase):
+    """many certificates over one account session against the mock CA"""
+
+    @classmethod
+    def setUpClass(cls):
+        TempDirTestCase.setUpClass()
+        cls.acme_dir = os.path.join(cls.tmp, "acme-challenge")
+        os.mkdir(cls.acme_dir)
+        cls.responder = _DirectoryResponder(cls.acme_dir, ("127.0.0.1", 0)).start()
+        cls.check_node = "http://127.0.0.1:{0}".format(cls.responder.server_address[1])
+        cls.ca = MockCA(http_port=cls.responder.server_address[1], validation_host="127.0.0.1").start()
+        cls.account_key = os.path.join(cls.tmp, "account.key")
+        openssl("genrsa", "-out", cls.account_key, "2048")
+        cls.csrs = {}
+        for name, domains in (("a", "a.example"), ("b", "b.example,www.b.example")):
+            key, csr = os.path.join(cls.tmp, name + ".key"), os.path.join(cls.tmp, name + ".csr")
+            openssl("genpkey", "-algorithm", "EC", "-pkeyopt", "ec_paramgen_curve:P-256", "-out", key)
+            openssl("req", "-new", "-key", key, "-subj", "/CN=" + domains.split(",")[0], "-addext",
+                "subjectAltName=" + ",".join("DNS:" + d for d in domains.split(",")), "-out", csr)
+            cls.csrs[name] = csr
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.ca.stop()
+        cls.responder.stop()
+        TempDirTestCase.tearDownClass()
+
+    def domains(self, path):
+        return load_certificate(path)[1]["domains"]
+
+    def test_issue_batch(self):
+        out = os.path.join(self.tmp, "batch")
+        os.mkdir(out)
+        jobs = [(self.csrs["a"], os.path.join(out, "a.crt")),
+            (("c.example", "www.c.example"), os.path.join(out, "c.key"), os.path.join(out, "c.crt")),
+            (os.path.join(self.tmp, "missing.csr"), os.path.join(out, "missing.crt"))]
+        self.ca.reset_stats()
+        acme = acme_tiny.AcmeSession(self.account_key, CA=self.ca.base_url, log=LOGGER,
+            check_nodes=[self.check_node])
+        deploy = Deployment(log=LOGGER)
+        try:
+            results = issue_batch(acme, jobs, self.acme_dir, jobs_at_once=3, key_type="ec:p256", deploy=deploy,
+                log=LOGGER)
+        finally:
+            acme.close()
+        # one summary per job in manifest order, the failure does not stop the others
+        self.assertEqual([(r["output"], r["ok"]) for r in results], [(job[-1], i < 2) for i, job in enumerate(jobs)])
+        self.assertIn("missing.csr", results[2]["error"])
+        self.assertEqual(self.domains(jobs[0][1]), ["a.example"])
+        self.assertEqual(self.domains(jobs[1][2]), ["c.example", "www.c.example"])
+        self.assertEqual(stat.S_IMODE(os.stat(jobs[1][1]).st_mode), 0o600)
+        self.assertEqual(sorted(deploy.changed), sorted([jobs[0][1], jobs[1][1], jobs[1][2]]))
+        # registered once for the whole batch
+        stats = self.ca.stats()
+        self.assertEqual((stats.get("POST /acme/new-reg"), stats.get("POST /acme/new-cert")), (1, 2))
+        self.assertEqual(acme.metrics.summary()["counters"]["certificates_failed"], 1)
+        self.assertEqual(os.listdir(self.acme_dir), [])
+
+    def test_main(self):
+        out = os.path.join(self.tmp, "main")
+        os.mkdir(out)
+        manifest = os.path.join(out, "sites.txt")
+        with open(manifest, "w") as manifest_file:
+            manifest_file.write("{0} a.crt\n{1} b.crt\n".format(self.csrs["a"], self.csrs["b"]))
+        metrics = os.path.join(out, "metrics.json")
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            code = main(["--account-key", self.account_key, "--manifest", manifest, "--acme-dir", self.acme_dir,
+                "--ca", self.ca.base_url, "--check-node", self.check_node, "--quiet", "--metrics-json", metrics])
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(code, 0)
+        self.assertEqual(output.splitlines()[-1], "2 issued, 0 failed")
+        self.assertEqual(self.domains(os.path.join(out, "b.crt")), ["b.example", "www.b.example"])
+        with open(metrics) as metrics_file:
+            self.assertEqual(json.load(metrics_file)["counters"]["certificates_issued"], 2)
+
+if __name__ == "__main__": # pragma: no cover
+    unittest.main()
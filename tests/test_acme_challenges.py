@@ -0,0 +1,183 @@
+import argparse, logging, os, socket, stat, threading, unittest
+from acme_challenges import DirectoryBackend, HookBackend, PresenceCheck, add_arguments, session_args
+from acme_http import HTTPSession, _Response
+from acme_responder import ChallengeResponder
+from tests.util import TempDirTestCase
+
+LOGGER = logging.getLogger(__name__)
+
+
+class _GarbageNode(object):
+    """answers every connection with something that is not HTTP"""
+
+    def __init__(self):
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(8)
+        self.url = "http://127.0.0.1:{0}".format(self.sock.getsockname()[1])
+        thread = threading.Thread(target=self._serve)
+        thread.daemon = True
+        thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn = self.sock.accept()[0]
+            except (IOError, OSError):
+                return
+            conn.recv(4096)
+            conn.sendall(b"SSH-2.0-OpenSSH_9.6\r\n")
+            conn.close()
+
+    def close(self):
+        self.sock.close()
+
+
+class RecordingSession(object):
+    """answers 404 and remembers the url and Host of every request"""
+
+    def __init__(self):
+        self.requests = []
+
+    def request(self, method, url, body=None, headers=None):
+        self.requests.append((url, (headers or {}).get("Host")))
+        return _Response(url, 404, "", {}, b"")
+
+
+class BackendTest(TempDirTestCase):
+
+    def setUp(self):
+        self.dirs = [os.path.join(self.tmp, self.id().rsplit(".", 1)[1], name) for name in ("web1", "web2")]
+        for acme_dir in self.dirs:
+            os.makedirs(acme_dir)
+
+    def test_directories(self):
+        backend = DirectoryBackend(self.dirs)
+        self.assertEqual(backend.target, os.pathsep.join(self.dirs))
+        self.assertIn("2 challenge file(s)", backend.provision({"tok1": "tok1.thumb", "tok2": "tok2.thumb"}))
+        for acme_dir in self.dirs:
+            self.assertEqual(sorted(os.listdir(acme_dir)), ["tok1", "tok2"])
+            with open(os.path.join(acme_dir, "tok2")) as token_file:
+                self.assertEqual(token_file.read(), "tok2.thumb")
+            self.assertEqual(stat.S_IMODE(os.stat(os.path.join(acme_dir, "tok1")).st_mode), 0o644)
+        os.remove(os.path.join(self.dirs[1], "tok1"))
+        # cleaning up after a partial failure is not an error
+        backend.unprovision(["tok1", "tok2"])
+        self.assertEqual([os.listdir(acme_dir) for acme_dir in self.dirs], [[], []])
+
+    def test_hooks(self):
+        seen = os.path.join(self.tmp, self.id().rsplit(".", 1)[1], "seen")
+        hook = 'printf "%s|%s|%s\\n" "$ACME_CHALLENGE_ACTION" "$ACME_CHALLENGE_DIR" "$(ls "$ACME_CHALLENGE_DIR" | ' \
+            'tr "\\n" " ")$(printf %s "$ACME_TOKENS" | tr "\\n" ",")" >> {0}'.format(seen)
+        backend = HookBackend(DirectoryBackend(self.dirs), [hook, hook], log=LOGGER)
+        self.assertEqual(backend.target, os.pathsep.join(self.dirs))
+        self.assertIn("ran 2 hook(s)", backend.provision({"tok2": "tok2.thumb", "tok1": "tok1.thumb"}))
+        backend.unprovision(["tok1", "tok2"])
+        with open(seen) as seen_file:
+            lines = seen_file.read().splitlines()
+        # each hook once per batch, the files already written and then already gone
+        self.assertEqual(lines, ["provision|{0}|tok1 tok2 tok1,tok2".format(self.dirs[0])] * 2 +
+            ["cleanup|{0}|tok1,tok2".format(self.dirs[0])] * 2)
+
+    def test_hook_fails(self):
+        backend = HookBackend(DirectoryBackend(self.dirs), ["true", "echo no route to web2; exit 3"], log=LOGGER)
+        with self.assertRaises(IOError) as raised:
+            backend.provision({"tok": "tok.thumb"})
+        self.assertIn("Challenge provision hook failed", str(raised.exception))
+        self.assertIn("exited with 3: no route to web2", str(raised.exception))
+        # the files were written, so they can be cleaned up
+        self.assertEqual(os.listdir(self.dirs[1]), ["tok"])
+
+    def test_session_args(self):
+        parser = argparse.ArgumentParser()
+        parser.add_argument("--acme-dir")
+        add_arguments(parser)
+        args = parser.parse_args(["--acme-dir", self.dirs[0], "--mirror-dir", self.dirs[1], "--sync-hook", "true",
+            "--check-node", "http://10.0.0.2", "--check-timeout", "5"])
+        kwargs = session_args(parser, args, log=LOGGER)
+        self.assertEqual((kwargs["check_nodes"], kwargs["check_timeout"]), (["http://10.0.0.2"], 5))
+        self.assertEqual(kwargs["challenges"].backend.acme_dirs, self.dirs)
+        self.assertIsNone(session_args(parser, parser.parse_args([]))["challenges"])
+        parser.error = lambda message: self.fail(message)
+        with self.assertRaises(AssertionError):
+            session_args(parser, parser.parse_args(["--sync-hook", "true"]))
+
+
+class PresenceCheckTest(unittest.TestCase):
+
+    def setUp(self):
+        self.nodes = [ChallengeResponder(("127.0.0.1", 0)).start() for i in range(2)]
+        self.urls = ["http://127.0.0.1:{0}/".format(node.server_address[1]) for node in self.nodes]
+        self.session = HTTPSession()
+
+    def tearDown(self):
+        self.session.close()
+        for node in self.nodes:
+            node.stop()
+
+    def serve(self, nodes, token):
+        for node in nodes:
+            node.add(token, token + ".thumb")
+
+    def test_all_nodes(self):
+        challenges = [("a.example", "tok1", "tok1.thumb"), ("b.example", "tok2", "tok2.thumb")]
+        self.serve(self.nodes, "tok1")
+        self.serve(self.nodes, "tok2")
+        PresenceCheck(self.session, self.urls, log=LOGGER).check(challenges)
+        # one node without a token fails the check, naming the node
+        self.nodes[1].remove("tok2")
+        with self.assertRaises(ValueError) as raised:
+            PresenceCheck(self.session, self.urls, log=LOGGER).check(challenges)
+        self.assertEqual(str(raised.exception), "couldn't download {0}.well-known/acme-challenge/tok2 "
+            "(Host: b.example)".format(self.urls[1]))
+        # as does a wrong key authorization
+        self.nodes[0].add("tok1", "tok1.stale")
+        with self.assertRaises(ValueError) as raised:
+            PresenceCheck(self.session, self.urls[:1], log=LOGGER).check(challenges)
+        self.assertIn("tok1", str(raised.exception))
+
+    def test_garbage_node(self):
+        garbage = _GarbageNode()
+        try:
+            self.serve(self.nodes, "tok")
+            with self.assertRaises(ValueError) as raised:
+                PresenceCheck(self.session, self.urls + [garbage.url], log=LOGGER).check(
+                    [("a.example", "tok", "tok.thumb")])
+        finally:
+            garbage.close()
+        self.assertEqual(str(raised.exception), "couldn't download {0}/.well-known/acme-challenge/tok "
+            "(Host: a.example)".format(garbage.url))
+
+    def test_waits_for_slow_nodes(self):
+        self.serve(self.nodes[:1], "tok")
+        timer = threading.Timer(0.3, self.serve, (self.nodes[1:], "tok"))
+        timer.start()
+        try:
+            PresenceCheck(self.session, self.urls, timeout=5, interval=0.1, log=LOGGER).check(
+                [("a.example", "tok", "tok.thumb")])
+        finally:
+            timer.join()
+        # without a timeout there is one try only
+        self.nodes[1].remove("tok")
+        timer = threading.Timer(0.3, self.serve, (self.nodes[1:], "tok"))
+        timer.start()
+        try:
+            self.assertRaises(ValueError, PresenceCheck(self.session, self.urls, log=LOGGER).check,
+                [("a.example", "tok", "tok.thumb")])
+        finally:
+            timer.join()
+
+    def test_without_nodes(self):
+        session = RecordingSession()
+        with self.assertRaises(ValueError):
+            PresenceCheck(session, log=LOGGER).check([("a.example", "tok", "tok.thumb")])
+        self.assertEqual(session.requests, [("http://a.example/.well-known/acme-challenge/tok", None)])
+        session = RecordingSession()
+        with self.assertRaises(ValueError):
+            PresenceCheck(session, ["http://10.0.0.2/", "http://10.0.0.3"], log=LOGGER).check(
+                [("a.example", "tok", "tok.thumb")])
+        self.assertEqual(sorted(session.requests), [("http://10.0.0.2/.well-known/acme-challenge/tok", "a.example"),
+            ("http://10.0.0.3/.well-known/acme-challenge/tok", "a.example")])
+
+if __name__ == "__main__": # pragma: no cover
+    unittest.main()
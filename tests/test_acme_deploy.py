@@ -0,0 +1,57 @@
+import os, stat, unittest
+from acme_deploy import Deployment, replace_file
+from tests.util import TempDirTestCase
+
+
+class ReplaceFileTest(TempDirTestCase):
+    """a replaced file keeps what let the web server read it, a new one gets the requested mode"""
+
+    def path(self, name, data=None, mode=None):
+        path = os.path.join(self.tmp, name)
+        if os.path.exists(path):
+            os.remove(path)
+        if data is not None:
+            with open(path, "w") as new_file:
+                new_file.write(data)
+            os.chmod(path, mode)
+        return path
+
+    def assertFile(self, path, data, mode):
+        with open(path) as current_file:
+            self.assertEqual(current_file.read(), data)
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), mode)
+
+    def test_new_files(self):
+        deployment = Deployment()
+        key, cert = self.path("new.key"), self.path("new.crt")
+        self.assertTrue(deployment.install(cert, "cert", key, "key"))
+        self.assertFile(key, "key", 0o600)
+        self.assertFile(cert, "cert", 0o644)
+        self.assertEqual(deployment.changed, [key, cert])
+
+    def test_keeps_mode(self):
+        key, cert = self.path("old.key", "old", 0o640), self.path("old.crt", "old", 0o444)
+        self.assertTrue(Deployment().install(cert, "cert", key, "key"))
+        self.assertFile(key, "key", 0o640)
+        self.assertFile(cert, "cert", 0o444)
+        self.assertFalse(replace_file(key, "key", mode=0o600))
+
+    @unittest.skipUnless(getattr(os, "geteuid", lambda: None)() == 0, "only root can give files away")
+    def test_keeps_owner(self):
+        key = self.path("owned.key", "old", 0o640)
+        os.chown(key, 33, 33)
+        self.assertTrue(replace_file(key, "key", mode=0o600))
+        current = os.stat(key)
+        self.assertEqual((current.st_uid, current.st_gid), (33, 33))
+        self.assertFile(key, "key", 0o640)
+
+    def test_symlink(self):
+        target = self.path("target.crt", "old", 0o640)
+        link = self.path("link.crt")
+        os.symlink(target, link)
+        self.assertTrue(replace_file(link, "cert"))
+        self.assertTrue(os.path.islink(link))
+        self.assertFile(target, "cert", 0o640)
+
+if __name__ == "__main__": # pragma: no cover
+    unittest.main()
@@ -0,0 +1,187 @@
+import logging, os, threading, time, unittest
+from acme_fleet import Fleet, TokenBucket, ca_base_url, read_fleet_manifest
+from acme_http import RateLimited
+from tests.util import TempDirTestCase
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ManifestTest(TempDirTestCase):
+
+    def test_ca_base_url(self):
+        for ca in ("https://acme.example", "https://acme.example/", "https://acme.example/directory",
+                "https://acme.example/directory/"):
+            self.assertEqual(ca_base_url(ca), "https://acme.example")
+        self.assertEqual(ca_base_url("https://acme.example/acme/directory"), "https://acme.example/acme")
+
+    def test_options(self):
+        manifest = os.path.join(self.tmp, "fleet.txt")
+        with open(manifest, "w") as manifest_file:
+            manifest_file.write("account=keys/a.key ca=https://acme.example/directory a.csr a.crt\n"
+                "b.example,www.b.example b.key b.crt\n")
+        jobs = list(read_fleet_manifest(manifest, "default.key", "https://default.example/directory"))
+        self.assertEqual(jobs, [
+            (os.path.join(self.tmp, "keys/a.key"), "https://acme.example",
+                (os.path.join(self.tmp, "a.csr"), os.path.join(self.tmp, "a.crt"))),
+            ("default.key", "https://default.example",
+                (("b.example", "www.b.example"), os.path.join(self.tmp, "b.key"), os.path.join(self.tmp, "b.crt"))),
+        ])
+
+    def test_no_account(self):
+        manifest = os.path.join(self.tmp, "noaccount.txt")
+        with open(manifest, "w") as manifest_file:
+            manifest_file.write("a.csr a.crt\n")
+        self.assertRaises(ValueError, list, read_fleet_manifest(manifest))
+
+class TokenBucketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+
+    def clock(self):
+        return self.now
+
+    def test_pacing(self):
+        bucket = TokenBucket(2, burst=2, clock=self.clock)
+        # the burst right away, then evenly spaced in the order asked
+        self.assertEqual([bucket.reserve() for _ in range(5)], [0, 0, 0.5, 1.0, 1.5])
+        self.now += 1.5
+        self.assertEqual(bucket.reserve(), 0.5)
+        # a lull only saves up the burst
+        self.now += 60
+        self.assertEqual([bucket.reserve() for _ in range(3)], [0, 0, 0.5])
+
+    def test_pause(self):
+        bucket = TokenBucket(1, burst=4, clock=self.clock)
+        bucket.pause(10)
+        self.assertEqual(bucket.blocked(), 10)
+        self.assertEqual(bucket.reserve(), 11)
+        # a shorter pause does not cut a longer one short
+        bucket.pause(5)
+        self.assertEqual(bucket.blocked(), 10)
+        self.now += 10
+        self.assertEqual(bucket.blocked(), 0)
+        # nothing was saved up while paused, so no burst follows the pause: the token
+        # reserved during it is used a second after it, the next ones a second apart
+        self.assertEqual([bucket.reserve() for _ in range(2)], [2, 3])
+
+
+class FakeSession(object):
+    """stands in for AcmeSession, get_crt() answers with the next of `answers` (an exception raises)"""
+
+    def __init__(self, answers, calls):
+        self.answers, self.calls = answers, calls
+        self.closed = False
+
+    def register(self):
+        pass
+
+    def get_crt(self, csr, acme_dir, **kwargs):
+        self.calls.append((csr, time.time()))
+        answer = self.answers.pop(0) if self.answers else "cert"
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    def close(self):
+        self.closed = True
+
+
+class FleetTest(TempDirTestCase):
+    """pacing, pauses and retries of the orchestrator with sessions that answer as told"""
+
+    def fleet(self, answers, **kwargs):
+        calls = []
+        def make_session(account_key, ca):
+            return FakeSession(answers, calls)
+        make_session = kwargs.pop("make_session", make_session)
+        args = dict(concurrency=2, ca_rate=1000, account_rate=1000, backoff=0.05, log=LOGGER)
+        args.update(kwargs)
+        return Fleet(make_session, self.tmp, **args), calls
+
+    def job(self, name, account="a.key", ca="https://ca.example"):
+        return (account, ca, (name + ".csr", os.path.join(self.tmp, name + ".crt")))
+
+    def test_account_limited(self):
+        fleet, calls = self.fleet([RateLimited("slow down", 429, {"Retry-After": "1"})])
+        results = []
+        self.assertEqual(fleet.run([self.job("one")], on_result=results.append),
+            {"issued": 1, "failed": 0, "retries": 1})
+        self.assertEqual(results[0]["attempts"], 2)
+        # as long as the CA asked, on the account only
+        self.assertTrue(calls[1][1] - calls[0][1] >= 1)
+        self.assertTrue(fleet._buckets[("a.key", "https://ca.example")].paused_until > 0)
+        self.assertEqual(fleet._buckets["https://ca.example"].paused_until, 0)
+        fleet.close()
+
+    def test_ca_unavailable(self):
+        fleet, calls = self.fleet([RateLimited("down", 503)])
+        self.assertEqual(fleet.run([self.job("one")])["issued"], 1)
+        self.assertEqual(fleet._buckets[("a.key", "https://ca.example")].paused_until, 0)
+        self.assertTrue(fleet._buckets["https://ca.example"].paused_until > 0)
+        fleet.close()
+
+    def test_backoff_and_attempts(self):
+        fleet, calls = self.fleet([RateLimited("slow down", 429) for _ in range(10)], attempts=4)
+        results = []
+        self.assertEqual(fleet.run([self.job("one")], on_result=results.append),
+            {"issued": 0, "failed": 1, "retries": 3})
+        self.assertEqual((results[0]["attempts"], results[0]["error"]), (4, "slow down"))
+        # 0.05, 0.1 and 0.2 seconds between the attempts
+        gaps = [later[1] - earlier[1] for earlier, later in zip(calls, calls[1:])]
+        self.assertEqual(len(gaps), 3)
+        for gap, backoff in zip(gaps, (0.05, 0.1, 0.2)):
+            self.assertTrue(backoff <= gap < backoff + 0.1, gaps)
+
+    def test_other_errors_are_not_retried(self):
+        fleet, calls = self.fleet([ValueError("Error signing certificate: 400")])
+        self.assertEqual(fleet.run([self.job("one")]), {"issued": 0, "failed": 1, "retries": 0})
+        self.assertEqual(len(calls), 1)
+
+    def test_session_errors(self):
+        # a directory the CA won't serve right now is retried like any other 503
+        failures = [RateLimited("Error fetching directory: 503", 503)]
+        calls = []
+        def make_session(account_key, ca):
+            if failures:
+                raise failures.pop()
+            return FakeSession([], calls)
+        fleet, _ = self.fleet([], make_session=make_session)
+        self.assertEqual(fleet.run([self.job("one")]), {"issued": 1, "failed": 0, "retries": 1})
+        fleet.close()
+
+    def test_sessions_are_made_in_parallel(self):
+        calls, made = [], []
+        def make_session(account_key, ca):
+            if account_key == "slow.key":
+                time.sleep(0.5)
+            made.append(FakeSession([], calls))
+            return made[-1]
+        fleet, _ = self.fleet([], make_session=make_session)
+        started = time.time()
+        fleet.run([self.job("slow", account="slow.key"), self.job("fast", account="fast.key")])
+        self.assertEqual([csr for csr, at in calls], ["fast.csr", "slow.csr"])
+        self.assertTrue(calls[0][1] - started < 0.4)
+        fleet.close()
+        self.assertTrue(all(acme.closed for acme in made))
+
+    def test_bounded_queue(self):
+        read, seen = [], []
+        def jobs():
+            for i in range(20):
+                read.append(i)
+                yield self.job("job{0}".format(i))
+        class Slow(FakeSession):
+            def get_crt(self, csr, acme_dir, **kwargs):
+                time.sleep(0.05) # the manifest is read ahead meanwhile
+                seen.append(len(read))
+                return FakeSession.get_crt(self, csr, acme_dir, **kwargs)
+        fleet, _ = self.fleet([], make_session=lambda account_key, ca: Slow([], []), concurrency=1,
+            queue_size=2)
+        self.assertEqual(fleet.run(jobs())["issued"], 20)
+        # one job being issued, two queued and one waiting to be queued, one more read as each finishes
+        self.assertEqual(seen[:3], [4, 5, 6])
+        fleet.close()
+
+if __name__ == "__main__": # pragma: no cover
+    unittest.main()
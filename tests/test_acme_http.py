@@ -0,0 +1,213 @@
+import json, os, threading, time, unittest
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer # Python 3
+    from socketserver import ThreadingMixIn
+except ImportError: # pragma: no cover
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer # Python 2
+    from SocketServer import ThreadingMixIn
+from acme_http import Directory, HTTPException, HTTPSession, RateLimited, _Response
+from tests.util import TempDirTestCase
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """answers /ok, closes the connection after /close is answered, and reads a /drop that is not the
+    first request of its connection to the end before closing without an answer, like a server that
+    acted on it and died. /dropall is never answered, /garbage gets no HTTP and /short half its body"""
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.handled = 0
+
+    def _handle(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.handled += 1
+        with self.server.lock:
+            self.server.seen.append((self.command, self.path))
+        if (self.path == "/drop" and self.handled > 1) or self.path == "/dropall":
+            self.close_connection = True
+            return
+        if self.path in ("/garbage", "/short"):
+            self.wfile.write(b"garbage\r\n\r\n" if self.path == "/garbage"
+                else b"HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\nok")
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        if self.path == "/close":
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(b"ok")
+        self.wfile.flush()
+        if self.path == "/close":
+            self.close_connection = True
+
+    do_GET = do_POST = _handle
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+class ReplayTest(unittest.TestCase):
+    """a request is only sent twice when that is harmless"""
+
+    def setUp(self):
+        self.server = _Server(("127.0.0.1", 0), _Handler)
+        self.server.lock, self.server.seen = threading.Lock(), []
+        threading.Thread(target=self.server.serve_forever).start()
+        self.url = "http://127.0.0.1:{0}".format(self.server.server_address[1])
+        self.session = HTTPSession(timeout=5)
+
+    def tearDown(self):
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def seen(self, method, path):
+        time.sleep(0.1) # the server thread may still be reading
+        with self.server.lock:
+            return self.server.seen.count((method, path))
+
+    def test_keep_alive(self):
+        for _ in range(3):
+            self.assertEqual(self.session.request("POST", self.url + "/ok", b"{}").code, 200)
+        self.assertEqual((self.session.connections_opened, self.session.connections_reused), (1, 2))
+
+    def test_post_is_not_replayed(self):
+        self.session.request("GET", self.url + "/ok")
+        self.assertRaises(IOError, self.session.request, "POST", self.url + "/drop", b"{}")
+        self.assertEqual(self.seen("POST", "/drop"), 1)
+
+    def test_get_is_replayed(self):
+        self.session.request("GET", self.url + "/ok")
+        # the fresh connection answers, /drop only goes unanswered as the second request of a connection
+        self.assertEqual(self.session.request("GET", self.url + "/drop").code, 200)
+        self.assertEqual(self.seen("GET", "/drop"), 2)
+
+    def test_dropped_idle_connection(self):
+        # the server answered with Connection: close but without us noticing, as after an idle timeout
+        self.session.request("GET", self.url + "/ok")
+        conn = self.session._checkout(("http", "127.0.0.1", self.server.server_address[1]))[0]
+        conn.request("GET", "/close")
+        conn.getresponse().read()
+        self.session._checkin(("http", "127.0.0.1", self.server.server_address[1]), conn, True)
+        time.sleep(0.1)
+        # the closed connection is noticed before anything is sent, so the POST goes out once and succeeds
+        self.assertEqual(self.session.request("POST", self.url + "/ok", b"{}").code, 200)
+        self.assertEqual(self.seen("POST", "/ok"), 1)
+
+    def test_bad_responses(self):
+        for path in ("/garbage", "/short"):
+            with self.assertRaises(IOError) as raised:
+                self.session.request("GET", self.url + path)
+            self.assertNotIsInstance(raised.exception, HTTPException)
+            self.assertIn("Bad response", str(raised.exception))
+        # and the session goes on working
+        self.assertEqual(self.session.request("GET", self.url + "/ok").code, 200)
+
+    def test_failed_replay_is_closed(self):
+        self.session.request("GET", self.url + "/ok")
+        fresh, connect = [], self.session._connect
+        def _connect(key):
+            fresh.append(connect(key))
+            return fresh[-1]
+        self.session._connect = _connect
+        self.assertRaises(IOError, self.session.request, "GET", self.url + "/dropall")
+        self.assertEqual(len(fresh), 1)
+        self.assertIsNone(fresh[0].sock)
+        self.assertEqual(self.seen("GET", "/dropall"), 2)
+
+
+class CannedSession(object):
+    """answers every request with the next of `responses`, (code, headers, body) each"""
+
+    def __init__(self, responses):
+        self.responses, self.requests = list(responses), []
+
+    def request(self, method, url, body=None, headers=None):
+        self.requests.append((method, url, dict(headers or {})))
+        code, headers, body = self.responses.pop(0)
+        return _Response(url, code, "", headers, body)
+
+
+DIRECTORY = {"new-reg": "https://ca.example/acme/new-reg", "meta": {"terms-of-service": "https://ca.example/tos"}}
+VALIDATORS = {"ETag": '"v1"', "Last-Modified": "Sat, 17 Oct 2026 10:00:00 GMT"}
+
+
+class DirectoryTest(TempDirTestCase):
+
+    def canned(self, *responses):
+        return CannedSession([(code, headers, json.dumps(DIRECTORY).encode("utf8") if code == 200 else b"")
+            for code, headers in responses])
+
+    def test_ttl(self):
+        session = self.canned((200, VALIDATORS))
+        directory = Directory("https://ca.example/directory", session=session, ttl=3600)
+        self.assertEqual(directory.resource("new-reg"), DIRECTORY["new-reg"])
+        self.assertEqual(directory.terms_of_service(), "https://ca.example/tos")
+        self.assertEqual((directory.fetches, len(session.requests)), (1, 1))
+        self.assertEqual(session.requests[0][2], {})
+        self.assertRaises(ValueError, directory.resource, "new-cert")
+
+    def test_revalidate(self):
+        changed = dict(DIRECTORY, **{"new-cert": "https://ca.example/acme/new-cert"})
+        session = self.canned((200, VALIDATORS), (304, {}))
+        session.responses.append((200, {"ETag": '"v2"'}, json.dumps(changed).encode("utf8")))
+        directory = Directory("https://ca.example/directory", session=session, ttl=0)
+        directory.get()
+        # past the ttl an unchanged directory is a 304 and the cached copy is kept
+        self.assertEqual(directory.get(), DIRECTORY)
+        self.assertEqual(session.requests[1][2], {"If-None-Match": '"v1"',
+            "If-Modified-Since": VALIDATORS["Last-Modified"]})
+        # a changed one replaces it, validators included
+        self.assertEqual(directory.resource("new-cert"), changed["new-cert"])
+        self.assertEqual(session.requests[2][2], {"If-None-Match": '"v1"',
+            "If-Modified-Since": VALIDATORS["Last-Modified"]})
+        self.assertEqual(directory.fetches, 3)
+        self.assertEqual(directory._cached["etag"], '"v2"')
+        self.assertIsNone(directory._cached["last_modified"])
+
+    def test_disk_cache(self):
+        path = os.path.join(self.tmp, "directory.json")
+        first = Directory("https://ca.example/directory", session=self.canned((200, VALIDATORS)), cache_path=path)
+        first.get()
+        # another process within the ttl does not ask the CA at all
+        session = self.canned()
+        self.assertEqual(Directory("https://ca.example/directory", session=session, cache_path=path).get(), DIRECTORY)
+        self.assertEqual(session.requests, [])
+        # past it, the validators saved on disk make it a 304
+        session = self.canned((304, {}))
+        self.assertEqual(Directory("https://ca.example/directory", session=session, cache_path=path, ttl=0).get(),
+            DIRECTORY)
+        self.assertEqual(session.requests[0][2]["If-None-Match"], '"v1"')
+        # a cache written for another CA is ignored
+        session = self.canned((200, {}))
+        Directory("https://other.example/directory", session=session, cache_path=path).get()
+        self.assertEqual(session.requests[0][2], {})
+        with open(path) as cache_file:
+            self.assertEqual(json.load(cache_file)["url"], "https://other.example/directory")
+
+    def test_observe(self):
+        seen = []
+        directory = Directory("https://ca.example/directory", session=self.canned((200, {"Replay-Nonce": "abc"})),
+            observe=seen.append)
+        directory.get()
+        self.assertEqual(seen, [{"Replay-Nonce": "abc"}])
+
+    def test_unavailable(self):
+        for code in (429, 503):
+            directory = Directory("https://ca.example/directory", session=CannedSession([(code,
+                {"Retry-After": "120"}, b"busy")]))
+            with self.assertRaises(RateLimited) as raised:
+                directory.get()
+            self.assertEqual((raised.exception.code, raised.exception.retry_after), (code, 120))
+        directory = Directory("https://ca.example/directory", session=CannedSession([(500, {}, b"oops")]))
+        self.assertRaises(IOError, directory.get)
+
+if __name__ == "__main__": # pragma: no cover
+    unittest.main()
@@ -0,0 +1,113 @@
+import json, os, sys, time, unittest
+from acme_inventory import DAY, Inventory, main, read_certificate_file, status
+from tests.util import TempDirTestCase, openssl
+try:
+    from StringIO import StringIO # Python 2
+except ImportError:
+    from io import StringIO # Python 3
+
+
+class InventoryTest(TempDirTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        TempDirTestCase.setUpClass()
+        cls.key = os.path.join(cls.tmp, "key.pem")
+        openssl("genpkey", "-algorithm", "EC", "-pkeyopt", "ec_paramgen_curve:P-256", "-out", cls.key)
+        cls.certs = {}
+        for name, serial, days, domains in (("short", "0x0abc", 10, "a.example"),
+                ("long", "0x0def", 90, "A.example,*.b.example"), ("other", "0x123", 30, "c.example")):
+            path = os.path.join(cls.tmp, "certs", name + ".crt")
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            openssl("req", "-x509", "-new", "-key", cls.key, "-subj", "/O=Test/CN=" + domains.split(",")[0],
+                "-set_serial", serial, "-days", str(days), "-addext",
+                "subjectAltName=" + ",".join("DNS:" + d for d in domains.split(",")), "-out", path)
+            cls.certs[name] = (path, read_certificate_file(path))
+
+    def setUp(self):
+        self.db = os.path.join(self.tmp, self.id().rsplit(".", 1)[1], "inventory.sqlite3")
+        self.inventory = Inventory(self.db)
+
+    def tearDown(self):
+        self.inventory.close()
+
+    def test_covering(self):
+        for name in ("short", "long", "other"):
+            self.inventory.record_issued(self.certs[name][1], ca="https://ca.example/directory")
+        # longest valid first, names compared without case or a trailing dot
+        found = self.inventory.covering("A.Example.")
+        self.assertEqual([record["serial"] for record in found], ["def", "abc"])
+        self.assertEqual(found[0]["domains"], ["*.b.example", "a.example"])
+        self.assertEqual(found[0]["ca"], "https://ca.example/directory")
+        self.assertEqual([record["serial"] for record in self.inventory.covering("www.b.example")], ["def"])
+        self.assertEqual(self.inventory.covering("b.example"), [])
+        later = time.time() + 20 * DAY
+        self.assertEqual([record["serial"] for record in self.inventory.covering("a.example", now=later)], ["def"])
+        self.assertEqual(len(self.inventory.covering("a.example", now=later, include_expired=True)), 2)
+        self.assertEqual(status(found[1], now=later), "expired")
+        self.assertEqual(status(found[0]), "valid")
+
+    def test_expiring(self):
+        for name in ("short", "long", "other"):
+            self.inventory.record_issued(self.certs[name][1])
+        self.assertEqual([record["serial"] for record in self.inventory.expiring(time.time() + 40 * DAY)],
+            ["abc", "123"])
+        self.assertEqual([record["serial"] for record in self.inventory.expiring(time.time() + 100 * DAY,
+            since=time.time() + 20 * DAY)], ["123", "def"])
+
+    def test_record_twice(self):
+        der = self.certs["short"][1]
+        fingerprint = self.inventory.record_issued(der, thumbprint="thumb", location="/etc/ssl/a.crt")
+        # a second record only fills in what the first one did not know
+        self.assertEqual(self.inventory.record_issued(der, thumbprint="other", ca="https://ca.example/directory"),
+            fingerprint)
+        record, = self.inventory.by_serial("0ABC")
+        self.assertEqual((record["thumbprint"], record["ca"], record["location"]),
+            ("thumb", "https://ca.example/directory", "/etc/ssl/a.crt"))
+        self.assertEqual(self.inventory.import_paths([self.certs["short"][0]]), (0, 1, 0))
+        self.assertEqual(self.inventory.by_serial("abc")[0]["path"], os.path.abspath(self.certs["short"][0]))
+
+    def test_revoked(self):
+        self.inventory.record_issued(self.certs["short"][1])
+        self.inventory.record_revoked(self.certs["short"][1], reason=1, at=1000.0)
+        self.inventory.record_revoked(self.certs["short"][1], reason=4)
+        # revoking a certificate issued elsewhere records it too
+        self.inventory.record_revoked(self.certs["long"][1])
+        self.assertEqual(self.inventory.covering("a.example"), [])
+        self.assertEqual(self.inventory.expiring(time.time() + 100 * DAY), [])
+        record, = self.inventory.by_serial("abc")
+        self.assertEqual((record["revoked_at"], record["revocation_reason"], status(record)), (1000.0, 1, "revoked"))
+        self.assertEqual(self.inventory.by_serial("def")[0]["domains"], ["*.b.example", "a.example"])
+
+    def test_import_dir(self):
+        nested = os.path.join(self.tmp, "certs", "nested")
+        if not os.path.isdir(nested):
+            os.mkdir(nested)
+            with open(os.path.join(nested, "broken.pem"), "w") as broken:
+                broken.write("-----BEGIN CERTIFICATE-----\nnot base64 at all\n-----END CERTIFICATE-----\n")
+            with open(os.path.join(nested, "key.pem"), "w") as key_file, open(self.key) as key:
+                key_file.write(key.read())
+        self.assertEqual(self.inventory.import_dir(os.path.join(self.tmp, "certs")), (3, 0, 2))
+        self.assertEqual(self.inventory.import_dir(os.path.join(self.tmp, "certs")), (0, 3, 2))
+        # another process sees what this one recorded
+        other = Inventory(self.db)
+        try:
+            self.assertEqual(other.by_serial("123")[0]["path"], os.path.abspath(self.certs["other"][0]))
+        finally:
+            other.close()
+
+    def test_main(self):
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            main(["--db", self.db, "--quiet", "--import", os.path.join(self.tmp, "certs"), "--domain", "a.example",
+                "--expiring", "40", "--json"])
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        records = [json.loads(line) for line in output.splitlines()]
+        self.assertEqual([(record["serial"], record["status"]) for record in records],
+            [("def", "valid"), ("abc", "valid"), ("abc", "valid"), ("123", "valid")])
+
+if __name__ == "__main__": # pragma: no cover
+    unittest.main()
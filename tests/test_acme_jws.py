@@ -0,0 +1,165 @@
+import base64, binascii, os, unittest
+import acme_jws
+from acme_asn1 import (SEQUENCE, BIT_STRING, OCTET_STRING, encode, encode_int, encode_oid, int_from_bytes,
+    int_to_bytes, pem_encode)
+from acme_jws import (CURVES_BY_NAME, RSASigner, account_jwk, ec_multiply, ecdsa_verify, jwk_thumbprint, libcrypto,
+    load_ec_private_key, load_rsa_private_key, load_signer, rfc6979_nonces)
+from tests.util import TempDirTestCase, openssl
+
+# every backend that can run here, "auto" is one of the others
+BACKENDS = ["python", "openssl"] + (["libcrypto"] if libcrypto() is not None else []) + (
+    ["cryptography"] if acme_jws.serialization is not None else [])
+MESSAGE = b"eyJhbGciOiJFUzI1NiJ9.eyJyZXNvdXJjZSI6Im5ldy1yZWcifQ"
+# RFC 6979 appendix A.2.5 and A.2.6: curve, private key, then message, nonce and r || s
+RFC6979_VECTORS = [
+    ("P-256", "C9AFA9D845BA75166B5C215767B1D6934E50C3DB36E89B127B8A622B120F6721", [
+        (b"sample", "A6E3C57DD01ABE90086538398355DD4C3B17AA873382B0F24D6129493D8AAD60",
+            "EFD48B2AACB6A8FD1140DD9CD45E81D69D2C877B56AAF991C34D0EA84EAF3716"
+            "F7CB1C942D657C41D436C7A1B6E29F65F3E900DBB9AFF4064DC4AB2F843ACDA8"),
+        (b"test", "D16B6AE827F17175E040871A1C7EC3500192C4C92677336EC2537ACAEE0008E0",
+            "F1ABB023518351CD71D881567B1EA663ED3EFCF6C5132B354F28D3B0B7D38367"
+            "019F4113742A2B14BD25926B49C649155F267E60D3814B4C0CC84250E46F0083"),
+    ]),
+    ("P-384", "6B9D3DAD2E1B8C1C05B19875B6659F4DE23C3B667BF297BA9AA47740787137D8"
+        "96D5724E4C70A825F872C9EA60D2EDF5", [
+        (b"sample", "94ED910D1A099DAD3254E9242AE85ABDE4BA15168EAF0CA87A555FD56D10FBCA"
+            "2907E3E83BA95368623B8C4686915CF9",
+            "94EDBB92A5ECB8AAD4736E56C691916B3F88140666CE9FA73D64C4EA95AD133C81A648152E44ACF96E36DD1E80FABE46"
+            "99EF4AEB15F178CEA1FE40DB2603138F130E740A19624526203B6351D0A3A94FA329C145786E679E7B82C71A38628AC8"),
+        (b"test", "015EE46A5BF88773ED9123A5AB0807962D193719503C527B031B4C2D225092AD"
+            "A71F4A459BC0DA98ADB95837DB8312EA",
+            "8203B63D3C853E8D77227FB377BCF7B7B772E97892A80F36AB775D509D7A5FEB0542A7F0812998DA8F1DD3CA3CF023DB"
+            "DDD0760448D42D8A43AF45AF836FCE4DE8BE06B485E9B61B827C2F13173923E06A739F040649A667BF3B828246BAA5A5"),
+    ]),
+]
+
+
+def der_signature(signature):
+    """the DER ECDSA-Sig-Value openssl verifies, of a JWS r || s"""
+    size = len(signature) // 2
+    return encode(SEQUENCE, encode_int(int_from_bytes(signature[:size])) + encode_int(int_from_bytes(signature[size:])))
+
+
+class SignerTest(TempDirTestCase):
+    """every backend signs what the others, and openssl, accept"""
+
+    @classmethod
+    def setUpClass(cls):
+        TempDirTestCase.setUpClass()
+        cls.keys = {}
+        for name, args in (("rsa", ["-algorithm", "RSA", "-pkeyopt", "rsa_keygen_bits:2048"]),
+                ("P-256", ["-algorithm", "EC", "-pkeyopt", "ec_paramgen_curve:P-256"]),
+                ("P-384", ["-algorithm", "EC", "-pkeyopt", "ec_paramgen_curve:P-384"])):
+            path = os.path.join(cls.tmp, name + ".key")
+            openssl("genpkey", *(args + ["-out", path]))
+            cls.keys[name] = path
+        # the traditional SEC1 encoding too, as `openssl ecparam -genkey` writes it
+        cls.keys["P-256 sec1"] = os.path.join(cls.tmp, "sec1.key")
+        openssl("ec", "-in", cls.keys["P-256"], "-out", cls.keys["P-256 sec1"])
+
+    def openssl_verify(self, key, digest, signature):
+        public, sig = os.path.join(self.tmp, "public.pem"), os.path.join(self.tmp, "signature")
+        openssl("pkey", "-in", key, "-pubout", "-out", public)
+        with open(sig, "wb") as sig_file:
+            sig_file.write(signature)
+        return b"Verified OK" in openssl("dgst", "-" + digest, "-verify", public, "-signature", sig, data=MESSAGE)
+
+    def test_rsa(self):
+        signatures = {}
+        for backend in BACKENDS:
+            signer = load_signer(self.keys["rsa"], backend)
+            self.assertEqual((signer.backend, signer.alg, signer.curve), (backend, "RS256", None))
+            signatures[backend] = signer.sign(MESSAGE)
+        # PKCS#1 v1.5 is deterministic, so every backend gives the same bytes
+        self.assertEqual(len(set(signatures.values())), 1, signatures)
+        self.assertTrue(self.openssl_verify(self.keys["rsa"], "sha256", signatures["python"]))
+
+    def test_ec(self):
+        for name, alg, digest in (("P-256", "ES256", "sha256"), ("P-384", "ES384", "sha384"),
+                ("P-256 sec1", "ES256", "sha256")):
+            with open(self.keys[name], "rb") as key_file:
+                pem = key_file.read()
+            point = load_ec_private_key(pem)["point"]
+            curve = CURVES_BY_NAME[name.split()[0]]
+            for backend in BACKENDS:
+                signer = load_signer(self.keys[name], backend)
+                self.assertEqual((signer.backend, signer.alg, signer.curve), (backend, alg, curve))
+                signature = signer.sign(MESSAGE)
+                self.assertEqual(len(signature), 2 * curve.size)
+                self.assertTrue(ecdsa_verify(curve, point, MESSAGE, signature), (name, backend))
+                self.assertFalse(ecdsa_verify(curve, point, MESSAGE + b".", signature), (name, backend))
+                self.assertTrue(self.openssl_verify(self.keys[name], digest, der_signature(signature)), (name, backend))
+
+    def test_jwk(self):
+        for name in self.keys:
+            public = os.path.join(self.tmp, "public.pem")
+            openssl("pkey", "-in", self.keys[name], "-pubout", "-out", public)
+            with open(self.keys[name], "rb") as key_file, open(public, "rb") as public_file:
+                private_jwk, public_jwk = account_jwk(key_file.read()), account_jwk(public_file.read())
+            self.assertEqual(private_jwk, public_jwk)
+        with open(self.keys["rsa"], "rb") as key_file:
+            alg, jwk = account_jwk(key_file.read())
+        modulus = openssl("rsa", "-in", self.keys["rsa"], "-noout", "-modulus").decode('ascii').strip().split("=")[1]
+        self.assertEqual(int_from_bytes(base64.urlsafe_b64decode(jwk["n"] + "==")), int(modulus, 16))
+        self.assertEqual(jwk["e"], "AQAB")
+
+    def test_thumbprint(self):
+        # RFC 7638 section 3.1
+        jwk = {"e": "AQAB", "kty": "RSA", "n": (
+            "0vx7agoebGcQSuuPiLJXZptN9nndrQmbXEps2aiAFbWhM78LhWx4cbbfAAtVT86zwu1RK7aPFFxuhDR1L6tSoc"
+            "_BJECPebWKRXjBZCiFV4n3oknjhMstn64tZ_2W-5JsGY4Hc5n9yBXArwl93lqt7_RN5w6Cf0h4QyQ5v-65YGjQ"
+            "R0_FDW2QvzqY368QQMicAtaSqzs8KJZgnYb9c7d0zgdAZHzu6qMQvRL5hajrn1n91CbOpbISD08qNLyrdkt-bF"
+            "TWhAI4vMQFh6WeZu0fM4lFd2NcRwr3XPksINHaQ-G_xBniIqbw0Ls1jF44-csFCur-kEgU8awapJzKnqDKgw")}
+        self.assertEqual(jwk_thumbprint(jwk), "NzbLsXh8uDCcd-6MNwXF4W_7noWXFZAfHkxZsRGC9Xs")
+
+    def test_ec_is_deterministic(self):
+        signer = load_signer(self.keys["P-256"], "python")
+        self.assertEqual(signer.sign(MESSAGE), signer.sign(MESSAGE))
+        self.assertNotEqual(signer.sign(MESSAGE), signer.sign(MESSAGE + b"."))
+
+    def test_rsa_fault(self):
+        with open(self.keys["rsa"], "rb") as key_file:
+            numbers = load_rsa_private_key(key_file.read())
+        self.assertTrue(self.openssl_verify(self.keys["rsa"], "sha256", RSASigner(numbers).sign(MESSAGE)))
+        # a signature with one CRT half computed wrong would give away a factor of n
+        faulty = dict(numbers, dp=numbers['dp'] + 1)
+        self.assertRaises(IOError, RSASigner(faulty).sign, MESSAGE)
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, load_signer, self.keys["rsa"], "gpg")
+
+class RFC6979Test(TempDirTestCase):
+    """the python backend gives the RFC 6979 known answers, which the other backends and openssl accept"""
+
+    def write_key(self, curve, d):
+        x, y = ec_multiply(curve, d)
+        der = encode(SEQUENCE, encode_int(1) + encode(OCTET_STRING, int_to_bytes(d, curve.size))
+            + encode(0xa0, encode_oid(curve.oid))
+            + encode(0xa1, encode(BIT_STRING, b"\x00\x04" + int_to_bytes(x, curve.size) + int_to_bytes(y, curve.size))))
+        path = os.path.join(self.tmp, curve.name + ".key")
+        with open(path, "w") as key_file:
+            key_file.write(pem_encode(der, "EC PRIVATE KEY"))
+        return path, (x, y)
+
+    def test_vectors(self):
+        for name, d, cases in RFC6979_VECTORS:
+            curve, d = CURVES_BY_NAME[name], int(d, 16)
+            path, point = self.write_key(curve, d)
+            signers = [load_signer(path, backend) for backend in BACKENDS]
+            for message, k, signature in cases:
+                signature = binascii.unhexlify(signature)
+                self.assertEqual(next(rfc6979_nonces(curve, d, message)), int(k, 16))
+                self.assertEqual(signers[0].sign(message), signature, (name, message))
+                self.assertTrue(ecdsa_verify(curve, point, message, signature))
+                # libcrypto and openssl draw random nonces, so their signatures differ but must check out the same way
+                public, sig = os.path.join(self.tmp, "public.pem"), os.path.join(self.tmp, "signature")
+                openssl("pkey", "-in", path, "-pubout", "-out", public)
+                with open(sig, "wb") as sig_file:
+                    sig_file.write(der_signature(signature))
+                self.assertIn(b"Verified OK", openssl("dgst", "-" + curve.hash_name, "-verify", public,
+                    "-signature", sig, data=message))
+                for signer in signers[1:]:
+                    self.assertTrue(ecdsa_verify(curve, point, message, signer.sign(message)), (name, signer.backend))
+
+if __name__ == "__main__": # pragma: no cover
+    unittest.main()
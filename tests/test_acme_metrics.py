@@ -0,0 +1,81 @@
+import json, os, unittest
+from acme_metrics import Metrics, write_reports
+from tests.util import TempDirTestCase
+
+
+class MetricsTest(TempDirTestCase):
+
+    def metrics(self):
+        metrics = Metrics(buckets=(0.1, 1.0))
+        metrics.count("signatures")
+        metrics.count("signatures", 2)
+        metrics.count("http_requests", method="POST")
+        metrics.count("http_requests", method="GET")
+        metrics.count("http_requests", method="POST")
+        metrics.observe("http_request_seconds", 0.05, method="POST")
+        metrics.observe("http_request_seconds", 0.5, method="POST")
+        metrics.observe("http_request_seconds", 3.0, method="POST")
+        metrics.gauge("certificates", 4)
+        return metrics
+
+    def test_summary(self):
+        metrics = self.metrics()
+        with self.assertRaises(KeyError):
+            with metrics.phase("finalize"):
+                raise KeyError("timed anyway")
+        with metrics.phase("finalize"):
+            pass
+        summary = metrics.summary()
+        self.assertEqual(summary["counters"], {"signatures": 3, "http_requests": {"method=GET": 1, "method=POST": 2}})
+        self.assertEqual(summary["gauges"], {"certificates": 4})
+        self.assertEqual(summary["histograms"]["http_request_seconds"]["method=POST"],
+            {"buckets": {"0.1": 1, "1": 2}, "sum": 3.55, "count": 3})
+        self.assertEqual(summary["phases"]["finalize"]["runs"], 2)
+        self.assertGreaterEqual(summary["phases"]["finalize"]["seconds"], 0)
+        json.dumps(summary)
+
+    def test_prometheus(self):
+        metrics = self.metrics()
+        metrics.gauge("custom", 1, path='C:\\"x"')
+        text = metrics.prometheus(labels={"host": "web1"})
+        self.assertTrue(text.endswith("\n"))
+        lines = text.splitlines()
+        for expected in [
+                "# HELP acme_signatures_total JWS signatures made with the account key.",
+                "# TYPE acme_signatures_total counter",
+                'acme_signatures_total{host="web1"} 3',
+                'acme_http_requests_total{host="web1",method="GET"} 1',
+                "# TYPE acme_certificates gauge",
+                "# HELP acme_custom custom",
+                'acme_custom{host="web1",path="C:\\\\\\"x\\""} 1',
+                "# TYPE acme_http_request_seconds histogram",
+                'acme_http_request_seconds_bucket{host="web1",method="POST",le="0.1"} 1',
+                'acme_http_request_seconds_bucket{host="web1",method="POST",le="1"} 2',
+                'acme_http_request_seconds_bucket{host="web1",method="POST",le="+Inf"} 3',
+                'acme_http_request_seconds_sum{host="web1",method="POST"} 3.55',
+                'acme_http_request_seconds_count{host="web1",method="POST"} 3']:
+            self.assertIn(expected, lines)
+        # every sample belongs to a metric declared above it
+        declared = set()
+        for line in lines:
+            if line.startswith("# TYPE "):
+                declared.add(line.split()[2])
+            elif not line.startswith("#"):
+                name = line.split("{")[0].split(" ")[0]
+                self.assertTrue(name in declared or name.rsplit("_", 1)[0] in declared, line)
+        self.assertEqual(Metrics().prometheus(), "\n")
+
+    def test_write_reports(self):
+        metrics = self.metrics()
+        metrics.finish(False)
+        json_path, prom_path = os.path.join(self.tmp, "run.json"), os.path.join(self.tmp, "acme.prom")
+        write_reports(metrics, json_path=json_path, prometheus_path=prom_path)
+        with open(json_path) as json_file:
+            self.assertEqual(json.load(json_file)["gauges"]["last_run_success"], 0)
+        with open(prom_path) as prom_file:
+            self.assertIn("acme_last_run_success 0", prom_file.read().splitlines())
+        self.assertEqual(sorted(os.listdir(self.tmp)), ["acme.prom", "run.json"])
+        write_reports(metrics)
+
+if __name__ == "__main__": # pragma: no cover
+    unittest.main()
@@ -0,0 +1,131 @@
+import logging, os, time, unittest
+import acme_tiny
+from acme_asn1 import SEQUENCE, BIT_STRING, OCTET_STRING, children, encode, encode_oid, pem_blocks, unwrap
+from acme_http import HTTPSession
+from acme_mockca import ENUMERATED, OCSP_BASIC, SHA256_WITH_RSA, MockCA
+from acme_ocsp import Stapler, ocsp_request, parse_response
+from acme_responder import ChallengeResponder
+from tests.util import TempDirTestCase, openssl
+
+LOGGER = logging.getLogger(__name__)
+
+
+def resign(response, signer):
+    """the same OCSPResponse with its tbsResponseData signed by someone else"""
+    response_bytes = children(unwrap(response, SEQUENCE)[1])[1][1]
+    basic = children(unwrap(response_bytes, SEQUENCE)[1])[1][1]
+    tbs = encode(*children(unwrap(basic, SEQUENCE)[1])[0])
+    basic = encode(SEQUENCE, tbs + SHA256_WITH_RSA + encode(BIT_STRING, b"\x00" + signer.sign(tbs)))
+    return encode(SEQUENCE, encode(ENUMERATED, b"\x00")
+        + encode(0xa0, encode(SEQUENCE, encode_oid(OCSP_BASIC) + encode(OCTET_STRING, basic))))
+
+
+class OcspTest(TempDirTestCase):
+    """parse_response() and the Stapler against the mock CA's OCSP responder"""
+
+    @classmethod
+    def setUpClass(cls):
+        TempDirTestCase.setUpClass()
+        cls.responder = ChallengeResponder(("127.0.0.1", 0)).start()
+        port = cls.responder.server_address[1]
+        cls.ca = MockCA(http_port=port, validation_host="127.0.0.1", ocsp_validity=3600).start()
+        cls.other_ca = MockCA()
+        account_key = os.path.join(cls.tmp, "account.key")
+        openssl("genrsa", "-out", account_key, "2048")
+        acme = acme_tiny.AcmeSession(account_key, CA=cls.ca.base_url, log=LOGGER, responder=cls.responder,
+            check_nodes=["http://127.0.0.1:{0}".format(port)])
+        try:
+            cls.certs = []
+            for domain in ("a.example", "b.example"):
+                key_pem, cert_pem = acme.issue([domain], chain=True)
+                path = os.path.join(cls.tmp, domain + ".crt")
+                with open(path, "w") as cert_file:
+                    cert_file.write(cert_pem)
+                cls.certs.append((path, [der for label, headers, der in pem_blocks(cert_pem)]))
+        finally:
+            acme.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.ca.stop()
+        cls.responder.stop()
+        TempDirTestCase.tearDownClass()
+
+    def assertRejected(self, message, *args, **kwargs):
+        with self.assertRaises(ValueError) as raised:
+            parse_response(*args, **kwargs)
+        self.assertIn(message, str(raised.exception))
+
+    def fetch(self, cert_der, issuer_der):
+        session = HTTPSession()
+        try:
+            resp = session.request("POST", self.ca.base_url + "/ocsp", ocsp_request(cert_der, issuer_der),
+                {"Content-Type": "application/ocsp-request"})
+        finally:
+            session.close()
+        self.assertEqual(resp.code, 200)
+        return resp.body
+
+    def test_good(self):
+        path, (cert_der, issuer_der) = self.certs[0]
+        self.assertEqual(issuer_der, self.ca.certificate_der)
+        response = self.fetch(cert_der, issuer_der)
+        staple = parse_response(response, cert_der, issuer_der)
+        self.assertEqual(staple["status"], "good")
+        self.assertAlmostEqual(staple["next_update"] - staple["this_update"], 3600, delta=1)
+        self.assertTrue(staple["this_update"] <= time.time())
+        # and openssl agrees
+        for name, der in (("issuer.der", issuer_der), ("response.der", response)):
+            with open(os.path.join(self.tmp, name), "wb") as der_file:
+                der_file.write(der)
+        issuer_pem = os.path.join(self.tmp, "issuer.pem")
+        openssl("x509", "-inform", "DER", "-in", os.path.join(self.tmp, "issuer.der"), "-out", issuer_pem)
+        text = openssl("ocsp", "-respin", os.path.join(self.tmp, "response.der"), "-issuer", issuer_pem,
+            "-VAfile", issuer_pem, "-cert", path, "-no_nonce")
+        self.assertIn(b": good", text)
+
+    def test_wrong_issuer(self):
+        path, (cert_der, issuer_der) = self.certs[0]
+        response = self.fetch(cert_der, issuer_der)
+        forged = resign(response, self.other_ca.signer)
+        self.assertRejected("not signed", forged, cert_der, issuer_der)
+        # nor does the real response check out against another issuer
+        self.assertRaises(ValueError, parse_response, response, cert_der, self.other_ca.certificate_der)
+        # resigning with the real key gives the response back, so the check above is the signature's
+        self.assertEqual(resign(response, self.ca.signer), response)
+
+    def test_stale(self):
+        path, (cert_der, issuer_der) = self.certs[0]
+        response = self.fetch(cert_der, issuer_der)
+        staple = parse_response(response, cert_der, issuer_der)
+        self.assertRejected("expired", response, cert_der, issuer_der, now=staple["next_update"])
+        self.assertRejected("not valid yet", response, cert_der, issuer_der, now=staple["this_update"] - 3600)
+
+    def test_other_certificate(self):
+        (path_a, (cert_a, issuer_der)), (path_b, (cert_b, _)) = self.certs
+        response = self.fetch(cert_a, issuer_der)
+        self.assertRejected("does not cover", response, cert_b, issuer_der)
+
+    def test_stapler(self):
+        path, (cert_der, issuer_der) = self.certs[1]
+        stapler = Stapler(log=LOGGER)
+        try:
+            staple = stapler.refresh(path)
+            self.assertEqual(staple["status"], "good")
+            with open(stapler.staple_path(path), "rb") as staple_file:
+                self.assertEqual(parse_response(staple_file.read(), cert_der, issuer_der), staple)
+            # fresh, so nothing is fetched until half its validity has passed
+            self.assertEqual(stapler.refresh(path), staple)
+            self.assertEqual(stapler.metrics.summary()["counters"]["ocsp_fetched"], 1)
+            self.assertIsNone(stapler.current(path, cert_der, issuer_der, now=staple["next_update"]))
+            # a staple that no longer checks out is replaced
+            with open(stapler.staple_path(path), "wb") as staple_file:
+                staple_file.write(resign(self.fetch(cert_der, issuer_der), self.other_ca.signer))
+            self.assertIsNone(stapler.current(path, cert_der, issuer_der))
+            self.assertEqual(stapler.refresh(path)["status"], "good")
+            self.assertEqual(stapler.metrics.summary()["counters"]["ocsp_fetched"], 2)
+        finally:
+            stapler.close()
+
+if __name__ == "__main__": # pragma: no cover
+    unittest.main()
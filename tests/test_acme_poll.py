@@ -0,0 +1,93 @@
+import io, json, time, unittest
+try:
+    from urllib.error import HTTPError # Python 3
+except ImportError: # pragma: no cover
+    from urllib2 import HTTPError # Python 2
+from acme_http import RateLimited, _Response
+from acme_poll import ChallengePoller
+
+
+class FakeCA(object):
+    """an opener answering each challenge URI with its next (status, headers), and a clock that only
+    moves when the poller sleeps; polls lists (time, uri) of every request"""
+
+    def __init__(self, answers):
+        self.answers, self.now, self.polls = answers, 1000.0, []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def opener(self, uri):
+        self.polls.append((self.now, uri))
+        answers = self.answers[uri]
+        status, headers = answers.pop(0) if len(answers) > 1 else answers[0]
+        if isinstance(status, int):
+            raise HTTPError(uri, status, "error", headers, io.BytesIO(b"{}"))
+        return _Response(uri, 200, "OK", headers, json.dumps({"status": status}).encode('utf8'))
+
+    def poller(self, **kwargs):
+        return ChallengePoller(self.opener, clock=self.clock, sleep=self.sleep, **kwargs)
+
+    def gaps(self, uri):
+        times = [at for at, polled in self.polls if polled == uri]
+        return [later - earlier for earlier, later in zip(times, times[1:])]
+
+
+class PollerTest(unittest.TestCase):
+
+    def test_backoff_and_jitter(self):
+        ca = FakeCA({"a": [("pending", {})] * 9 + [("valid", {})]})
+        poller = ca.poller(initial=0.5, maximum=4, factor=2, jitter=0.2)
+        valid = []
+        poller.add("a", "a", on_valid=lambda key, status: valid.append(key))
+        self.assertEqual(list(poller.run()), ["a"])
+        self.assertEqual(valid, ["a"])
+        self.assertEqual(poller.polls, 10)
+        # the first poll after `initial`, then doubling up to `maximum`, each within the jitter
+        self.assertEqual(ca.polls[0][0], 1000.5)
+        for gap, interval in zip(ca.gaps("a"), [0.5, 1, 2, 4, 4, 4, 4, 4, 4]):
+            self.assertTrue(interval * 0.8 <= gap <= interval * 1.2, (gap, interval))
+
+    def test_retry_after(self):
+        ca = FakeCA({"a": [("pending", {"Retry-After": "7"}), ("pending", {}), ("valid", {})]})
+        poller = ca.poller(initial=0.5, jitter=0)
+        poller.add("a", "a")
+        poller.run()
+        # the CA's 7 seconds instead of the computed 0.5, which then still applies
+        self.assertEqual(ca.gaps("a"), [7, 0.5])
+
+    def test_deadline(self):
+        ca = FakeCA({"a": [("pending", {})], "b": [("valid", {})]})
+        poller = ca.poller(initial=1, maximum=10, jitter=0, deadline=30)
+        poller.add("a", "a")
+        poller.add("b", "b")
+        with self.assertRaises(ValueError) as raised:
+            poller.run()
+        self.assertIn("Timed out after 30s", str(raised.exception))
+        self.assertIn("a", str(raised.exception))
+        self.assertNotIn("b", str(raised.exception).split(":", 1)[1])
+        # the last poll is right at the deadline, not after sleeping past it
+        self.assertEqual(ca.polls[-1][0], 1030)
+        self.assertEqual(ca.now, 1030)
+
+    def test_errors(self):
+        ca = FakeCA({"a": [("invalid", {})]})
+        poller = ca.poller()
+        poller.add("a", "a")
+        self.assertRaises(ValueError, poller.run)
+        ca = FakeCA({"a": [(429, {"Retry-After": "60"})]})
+        poller = ca.poller()
+        poller.add("a", "a")
+        with self.assertRaises(RateLimited) as raised:
+            poller.run()
+        self.assertEqual((raised.exception.code, raised.exception.retry_after), (429, 60))
+
+    def test_monotonic(self):
+        if hasattr(time, "monotonic"):
+            self.assertIs(ChallengePoller(None).clock, time.monotonic)
+
+if __name__ == "__main__": # pragma: no cover
+    unittest.main()
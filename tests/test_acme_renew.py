@@ -0,0 +1,166 @@
+import logging, os, unittest
+from acme_renew import DAY, RenewalScheduler, run
+from acme_x509 import load_certificate
+from tests.util import TempDirTestCase, openssl
+
+LOGGER = logging.getLogger(__name__)
+
+
+class FakeClock(object):
+    """a clock that only moves when told to, and a stop event whose wait() moves it"""
+
+    def __init__(self, now, rounds):
+        self.now, self.rounds, self.waits = now, rounds, []
+
+    def __call__(self):
+        return self.now
+
+    def is_set(self):
+        return len(self.waits) >= self.rounds
+
+    def wait(self, seconds):
+        self.waits.append(seconds)
+        self.now += seconds
+
+
+class StubSession(object):
+    """stands in for AcmeSession, get_crt hands out the next of `certificates`"""
+
+    def __init__(self, certificates=(), error=None):
+        self.certificates, self.error = list(certificates), error
+        self.closed, self.signed = False, []
+
+    def register(self):
+        if self.error is not None:
+            raise self.error
+
+    def get_crt(self, csr, acme_dir, **kwargs):
+        self.signed.append(csr)
+        return self.certificates.pop(0)
+
+    def close(self):
+        self.closed = True
+
+
+class RenewTestCase(TempDirTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        TempDirTestCase.setUpClass()
+        cls.key = os.path.join(cls.tmp, "key.pem")
+        openssl("genpkey", "-algorithm", "EC", "-pkeyopt", "ec_paramgen_curve:P-256", "-out", cls.key)
+
+    def certificate(self, name, days):
+        """a certificate valid for `days` more days at `path`, returns the path and its PEM"""
+        path = os.path.join(self.tmp, name)
+        openssl("req", "-x509", "-new", "-key", self.key, "-subj", "/CN=" + name, "-days", str(days), "-out", path)
+        with open(path) as cert_file:
+            return path, cert_file.read()
+
+    def not_after(self, path):
+        return load_certificate(path)[1]["not_after"]
+
+
+class SchedulerTest(RenewTestCase):
+
+    def scheduler(self, jobs, clock, **kwargs):
+        return RenewalScheduler(lambda: jobs, clock=clock, log=LOGGER, **kwargs)
+
+    def test_window_and_order(self):
+        paths = [self.certificate(name, days)[0] for name, days in (("60.crt", 60), ("10.crt", 10), ("20.crt", 20))]
+        missing = os.path.join(self.tmp, "missing.crt")
+        jobs = [("csr", path) for path in paths + [missing]]
+        now = self.not_after(paths[1]) - 10 * DAY
+        scheduler = self.scheduler(jobs, lambda: now, window=30 * DAY, jitter=0)
+        due, next_due = scheduler.due()
+        # the one without a certificate first, then by expiry; the 60 day one only 30 days before it expires
+        self.assertEqual(due, [("csr", missing), ("csr", paths[1]), ("csr", paths[2])])
+        self.assertEqual(next_due, self.not_after(paths[0]) - 30 * DAY)
+        self.assertEqual(scheduler.due(now=next_due), ([jobs[3], jobs[1], jobs[2], jobs[0]], None))
+
+    def test_jitter(self):
+        paths = [self.certificate("jitter{0}.crt".format(i), 50)[0] for i in range(4)]
+        jobs = [("csr", path) for path in paths]
+        scheduler = self.scheduler(jobs, None, window=30 * DAY, jitter=12 * 3600)
+        due_times = [scheduler.due_time(path) for path in paths]
+        for path, due in zip(paths, due_times):
+            self.assertTrue(self.not_after(path) - 30 * DAY - 12 * 3600 <= due <= self.not_after(path) - 30 * DAY)
+        # spread out, yet the same in a new process
+        self.assertEqual(len(set(due_times)), len(paths))
+        self.assertEqual([self.scheduler(jobs, None, window=30 * DAY, jitter=12 * 3600).due_time(path)
+            for path in paths], due_times)
+
+    def test_restart_after_renewal(self):
+        path = self.certificate("renewed.crt", 5)[0]
+        jobs = [("csr", path)]
+        now = self.not_after(path) - 5 * DAY
+        scheduler = self.scheduler(jobs, lambda: now)
+        self.assertEqual(scheduler.due()[0], jobs)
+        self.certificate("renewed.crt", 90)
+        os.utime(path, (now, now)) # the index notices a new certificate by its mtime
+        self.assertEqual(scheduler.due()[0], [])
+        # a restarted scheduler does not issue it again either
+        self.assertEqual(self.scheduler(jobs, lambda: now).due()[0], [])
+
+    def test_retry(self):
+        path = os.path.join(self.tmp, "never.crt")
+        now = [1000000]
+        scheduler = self.scheduler([("csr", path)], lambda: now[0], retry=3600)
+        self.assertEqual(len(scheduler.due()[0]), 1)
+        scheduler.record([{"output": path, "ok": False}])
+        self.assertEqual(scheduler.due(), ([], now[0] + 3600))
+        now[0] += 3600
+        self.assertEqual(len(scheduler.due()[0]), 1)
+
+
+class RunTest(RenewTestCase):
+
+    def setUp(self):
+        self.acme_dir = os.path.join(self.tmp, "challenges")
+        self.path = os.path.join(self.tmp, "site.crt")
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def run_rounds(self, sessions, rounds, **kwargs):
+        clock = FakeClock(1000000, rounds)
+        scheduler = RenewalScheduler(lambda: [("site.csr", self.path)], clock=clock, log=LOGGER)
+        made = []
+        def make_session():
+            made.append(sessions.pop(0))
+            return made[-1]
+        run(scheduler, make_session, self.acme_dir, clock, check_interval=600, log=LOGGER, **kwargs)
+        return clock, made
+
+    def test_renews_then_waits(self):
+        pem = self.certificate("fresh.crt", 90)[1]
+        rounds = []
+        clock, made = self.run_rounds([StubSession([pem])], 2, on_round=rounds.append)
+        self.assertEqual([r["ok"] for r in rounds[0]], [True])
+        with open(self.path) as cert_file:
+            self.assertEqual(cert_file.read(), pem)
+        # nothing is due for 60 days, so it checks back every check_interval with the session it has
+        self.assertEqual(clock.waits, [600, 600])
+        self.assertEqual(made[0].signed, ["site.csr"])
+        self.assertTrue(made[0].closed)
+
+    def test_ca_down(self):
+        pem = self.certificate("later.crt", 90)[1]
+        sessions = [StubSession(error=IOError("CA down")), StubSession(error=ValueError("Error registering")),
+            StubSession([pem])]
+        rounds = []
+        clock, made = self.run_rounds(sessions, 3, on_round=rounds.append)
+        # each failed round drops its session and the next one starts over, until the CA is back
+        self.assertEqual(clock.waits[:2], [600, 600])
+        self.assertEqual([session.closed for session in made], [True, True, True])
+        self.assertEqual(len(rounds), 1)
+        self.assertEqual(made[2].signed, ["site.csr"])
+
+    def test_once_raises(self):
+        clock = FakeClock(1000000, 1)
+        scheduler = RenewalScheduler(lambda: [("site.csr", self.path)], clock=clock, log=LOGGER)
+        session = StubSession(error=IOError("CA down"))
+        self.assertRaises(IOError, run, scheduler, lambda: session, self.acme_dir, clock, once=True, log=LOGGER)
+        self.assertTrue(session.closed)
+
+if __name__ == "__main__": # pragma: no cover
+    unittest.main()
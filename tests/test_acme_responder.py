@@ -0,0 +1,49 @@
+import unittest
+from acme_http import HTTPSession
+from acme_responder import ChallengeResponder, parse_listen
+
+
+class ResponderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session = HTTPSession()
+
+    def tearDown(self):
+        self.session.close()
+
+    def fetch(self, responder, path, method="GET"):
+        resp = self.session.request(method, "http://127.0.0.1:{0}{1}".format(responder.server_address[1], path))
+        return resp.code, resp.read().decode('utf8'), resp.headers.get("Content-Length")
+
+    def test_tokens(self):
+        with ChallengeResponder(("127.0.0.1", 0)) as responder:
+            responder.add("tok1", "tok1.thumb")
+            responder.add("tok2", "tok2.thumb")
+            self.assertEqual((len(responder), responder.get("tok1")), (2, "tok1.thumb"))
+            self.assertEqual(self.fetch(responder, "/.well-known/acme-challenge/tok1"), (200, "tok1.thumb", "10"))
+            self.assertEqual(self.fetch(responder, "/.well-known/acme-challenge/tok2?x=1")[:2], (200, "tok2.thumb"))
+            # HEAD gets the headers of the GET without its body
+            self.assertEqual(self.fetch(responder, "/.well-known/acme-challenge/tok1", "HEAD"), (200, "", "10"))
+            responder.remove("tok1")
+            responder.remove("tok1")
+            self.assertEqual((len(responder), responder.get("tok1")), (1, None))
+            self.assertEqual(self.fetch(responder, "/.well-known/acme-challenge/tok1")[0], 404)
+            self.assertEqual(self.fetch(responder, "/.well-known/acme-challenge/")[0], 404)
+            self.assertEqual(self.fetch(responder, "/tok2")[0], 404)
+        self.assertEqual(responder.server_address, ("127.0.0.1", 0))
+
+    def test_path_prefix(self):
+        # behind a proxy that strips /.well-known/acme-challenge
+        with ChallengeResponder(("127.0.0.1", 0), path_prefix="/") as responder:
+            responder.add("tok", "tok.thumb")
+            self.assertEqual(self.fetch(responder, "/tok")[:2], (200, "tok.thumb"))
+            self.assertEqual(self.fetch(responder, "/.well-known/acme-challenge/tok")[0], 404)
+
+    def test_parse_listen(self):
+        self.assertEqual(parse_listen("8080"), ("", 8080))
+        self.assertEqual(parse_listen("127.0.0.1:8080"), ("127.0.0.1", 8080))
+        self.assertEqual(parse_listen("[::1]:8080"), ("::1", 8080))
+        self.assertRaises(ValueError, parse_listen, "localhost:http")
+
+if __name__ == "__main__": # pragma: no cover
+    unittest.main()
@@ -0,0 +1,272 @@
+import json, logging, multiprocessing, os, threading, time, unittest
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer # Python 3
+except ImportError: # pragma: no cover
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer # Python 2
+import acme_tiny
+from acme_mockca import MockCA
+from acme_responder import ChallengeResponder
+from acme_state import AuthzCache, IssuanceJournal, JSONStore, RegistrationStore
+from tests.util import TempDirTestCase, openssl
+
+LOGGER = logging.getLogger(__name__)
+
+
+class AuthzCacheTest(TempDirTestCase):
+
+    def test_per_ca(self):
+        cache = AuthzCache(os.path.join(self.tmp, "authz.json"), margin=60)
+        expires = time.time() + 3600
+        cache.put("https://staging.example", "thumb", "a.example", "https://staging.example/authz/1", expires)
+        self.assertEqual(cache.get("https://staging.example", "thumb", "a.example")["uri"],
+            "https://staging.example/authz/1")
+        self.assertIsNone(cache.get("https://prod.example", "thumb", "a.example"))
+        self.assertIsNone(cache.get("https://staging.example", "other", "a.example"))
+        self.assertIsNone(cache.get("https://staging.example", "thumb", "a.example", now=expires - 30))
+        cache.put("https://prod.example", "thumb", "a.example", "https://prod.example/authz/9", expires)
+        cache.invalidate("https://staging.example", "thumb", ["a.example"])
+        self.assertIsNone(cache.get("https://staging.example", "thumb", "a.example"))
+        self.assertEqual(cache.get("https://prod.example", "thumb", "a.example")["uri"], "https://prod.example/authz/9")
+
+
+def _put_many(path, worker, count):
+    cache = AuthzCache(path)
+    for i in range(count):
+        cache.put("https://ca.example", "thumb", "{0}-{1}.example".format(worker, i), "uri", time.time() + 86400)
+
+
+class StoreTest(TempDirTestCase):
+
+    def test_registrations(self):
+        store = RegistrationStore(os.path.join(self.tmp, "registrations.json"))
+        self.assertIsNone(store.get("https://ca.example", "thumb"))
+        store.put("https://ca.example", "thumb", "https://ca.example/reg/1")
+        store.put("https://other.example", "thumb", "https://other.example/reg/7", status="deactivated")
+        self.assertEqual(store.get("https://ca.example", "thumb")["uri"], "https://ca.example/reg/1")
+        self.assertEqual(store.get("https://other.example", "thumb")["status"], "deactivated")
+        store.forget("https://ca.example", "thumb")
+        self.assertIsNone(store.get("https://ca.example", "thumb"))
+        # a new process reads what this one wrote
+        self.assertEqual(RegistrationStore(store.store.path).get("https://other.example", "thumb")["uri"],
+            "https://other.example/reg/7")
+
+    def test_corrupt(self):
+        path = os.path.join(self.tmp, "corrupt.json")
+        with open(path, "w") as store_file:
+            store_file.write('{"https://ca.example": ')
+        store = JSONStore(path)
+        self.assertEqual(store.load(), {})
+        self.assertEqual(store.update(lambda data: data.update(a=1)), {"a": 1})
+        self.assertEqual(store.load(), {"a": 1})
+
+    @unittest.skipUnless(hasattr(os, "fork"), "needs fork")
+    def test_processes_keep_each_others_entries(self):
+        # the renew daemon and a cron run writing the same state dir
+        path = os.path.join(self.tmp, "shared", "authz.json")
+        processes = [multiprocessing.Process(target=_put_many, args=(path, worker, 20)) for worker in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertEqual([process.exitcode for process in processes], [0] * 4)
+        domains = JSONStore(path).load()["https://ca.example"]["thumb"]
+        self.assertEqual(len(domains), 80)
+
+
+class SharedStateDirTest(TempDirTestCase):
+    """one --state-dir used against two CAs reuses each CA's authorizations only with that CA"""
+
+    def test_two_cas(self):
+        responder = ChallengeResponder(("127.0.0.1", 0)).start()
+        port = responder.server_address[1]
+        cas = [MockCA(http_port=port, validation_host="127.0.0.1").start() for _ in range(2)]
+        account_key, state_dir = os.path.join(self.tmp, "account.key"), os.path.join(self.tmp, "state")
+        openssl("genrsa", "-out", account_key, "2048")
+        try:
+            for second_round, ca in [(False, ca) for ca in cas] + [(True, ca) for ca in cas]:
+                ca.reset_stats()
+                acme = acme_tiny.AcmeSession(account_key, CA=ca.base_url, log=LOGGER, responder=responder,
+                    state_dir=state_dir, check_nodes=["http://127.0.0.1:{0}".format(port)])
+                try:
+                    acme.issue(["a.example"])
+                finally:
+                    acme.close()
+                # the first round validates at each CA, the second reuses what that CA granted
+                stats = ca.stats()
+                self.assertEqual(stats.get("POST /acme/new-cert"), 1)
+                self.assertEqual(stats.get("POST /acme/new-authz"), None if second_round else 1)
+        finally:
+            for ca in cas:
+                ca.stop()
+            responder.stop()
+
+
+class JournalTest(TempDirTestCase):
+    """replaying, sweeping and compacting the issuance journal"""
+
+    def setUp(self):
+        self.path = os.path.join(self.tmp, "journal.jsonl")
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def authorize(self, journal, order, domain, token, acme_dir="/srv/acme", *steps):
+        journal.record(order, "authz", domain=domain, authz_uri="https://ca/authz/" + token,
+            challenge_uri="https://ca/challenge/" + token, token=token, expires=None)
+        for step in steps:
+            journal.record(order, step, domain=domain, token=token, acme_dir=acme_dir)
+
+    def lines(self):
+        with open(self.path) as journal_file:
+            return journal_file.read().splitlines()
+
+    def test_resume(self):
+        journal = IssuanceJournal(self.path)
+        order = journal.order_id("https://ca", "thumb", ["b.example", "a.example"])
+        self.assertEqual(order, journal.order_id("https://ca", "thumb", ["a.example", "b.example"]))
+        self.assertNotEqual(order, journal.order_id("https://other-ca", "thumb", ["a.example", "b.example"]))
+        self.assertEqual(journal.resume(order), {})
+        journal.record(order, "start", domains=["a.example", "b.example"])
+        self.authorize(journal, order, "a.example", "ta", "/srv/acme", "provisioned", "triggered", "validated")
+        self.authorize(journal, order, "b.example", "tb", "/srv/acme", "provisioned")
+        journal.record(order, "failed", error="timed out")
+        # a new process sees what the dead one did
+        states = IssuanceJournal(self.path).resume(order)
+        self.assertEqual(sorted(states), ["a.example", "b.example"])
+        self.assertEqual((states["a.example"]["status"], states["a.example"]["triggered"]), ("valid", True))
+        self.assertEqual((states["b.example"]["status"], states["b.example"]["triggered"]), ("pending", False))
+        self.assertEqual(states["b.example"]["challenge_uri"], "https://ca/challenge/tb")
+        self.assertEqual((states["b.example"]["provisioned"], states["b.example"]["acme_dir"]), (True, "/srv/acme"))
+        # nothing to pick up once issued, and a new start of the same order begins afresh
+        journal.record(order, "issued", location="https://ca/cert/1")
+        self.assertEqual(journal.resume(order), {})
+        journal.record(order, "start", domains=["a.example", "b.example"])
+        self.assertEqual(journal.resume(order), {})
+
+    def test_torn_line(self):
+        journal = IssuanceJournal(self.path)
+        journal.record("order", "start", domains=["a.example"])
+        with open(self.path, "a") as journal_file:
+            journal_file.write('{"order": "order", "step": "auth') # the crash
+        self.authorize(journal, "order", "a.example", "ta", "/srv/acme", "provisioned")
+        lines = self.lines()
+        self.assertEqual(len(lines), 4)
+        self.assertRaises(ValueError, json.loads, lines[1])
+        self.assertEqual(journal.resume("order")["a.example"]["token"], "ta")
+
+    def test_stale_tokens(self):
+        journal = IssuanceJournal(self.path)
+        for order in ("finished", "running", "unprovisioned"):
+            journal.record(order, "start", domains=["a.example"])
+            self.authorize(journal, order, "a.example", order, "/srv/acme", "provisioned")
+        journal.record("finished", "failed", error="invalid")
+        journal.record("unprovisioned", "unprovisioned", domain="a.example", token="unprovisioned")
+        # an order this process works on is never stale, one of another process only after the grace period
+        self.assertEqual(journal.stale_tokens(grace=3600, now=time.time() + 3601),
+            [("finished", "a.example", "/srv/acme", "finished")])
+        other = IssuanceJournal(self.path)
+        self.assertEqual(other.stale_tokens(grace=3600), [("finished", "a.example", "/srv/acme", "finished")])
+        self.assertEqual(sorted(other.stale_tokens(grace=3600, now=time.time() + 3601)),
+            [("finished", "a.example", "/srv/acme", "finished"), ("running", "a.example", "/srv/acme", "running")])
+
+    def test_compact(self):
+        journal = IssuanceJournal(self.path)
+        for i in range(2):
+            order = "done{0}".format(i)
+            journal.record(order, "start", domains=["a.example"])
+            self.authorize(journal, order, "a.example", order, "/srv/acme", "provisioned", "unprovisioned")
+            journal.record(order, "issued")
+        journal.record("left", "start", domains=["a.example"])
+        self.authorize(journal, "left", "a.example", "left", "/srv/acme", "provisioned")
+        journal.record("left", "issued")
+        journal.record("open", "start", domains=["a.example"])
+        before = self.lines()
+        # ten lines of finished orders, but only more than compact_after of them are dropped
+        journal.compact_after = 10
+        journal.compact()
+        self.assertEqual(self.lines(), before)
+        # another process still appends to the journal that replaced the one it had open
+        later = IssuanceJournal(self.path)
+        journal.compact_after = 9
+        journal.compact()
+        later.record("open", "authz", domain="a.example", challenge_uri="https://ca/challenge/x", token="x")
+        orders = [json.loads(line)["order"] for line in self.lines()]
+        # the issued order whose token was never removed is kept for the sweep
+        self.assertEqual(orders, ["left"] * 4 + ["open"] * 2)
+        self.assertEqual(later.resume("open")["a.example"]["token"], "x")
+
+
+class _WebRootHandler(BaseHTTPRequestHandler):
+    """serves the files of server.root, like a web server in front of an acme_dir"""
+
+    def do_GET(self):
+        try:
+            with open(os.path.join(self.server.root, self.path.lstrip("/"))) as served_file:
+                body = served_file.read().encode('utf8')
+        except (IOError, OSError):
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+class ResumeTest(TempDirTestCase):
+    """a run that gives up on a triggered challenge is picked up by the next one"""
+
+    def test_resume_after_timeout(self):
+        root = os.path.join(self.tmp, "www")
+        acme_dir, other_dir = os.path.join(root, ".well-known", "acme-challenge"), os.path.join(self.tmp, "old")
+        for directory in (acme_dir, other_dir):
+            os.makedirs(directory)
+        server = HTTPServer(("127.0.0.1", 0), _WebRootHandler)
+        server.root = root
+        threading.Thread(target=server.serve_forever).start()
+        port = server.server_address[1]
+        # validated a while after it is triggered, long after the first run stopped polling
+        ca = MockCA(http_port=port, validation_host="127.0.0.1", validation_delay=2).start()
+        account_key, state_dir = os.path.join(self.tmp, "account.key"), os.path.join(self.tmp, "state")
+        openssl("genrsa", "-out", account_key, "2048")
+        # a token an order for another acme_dir left behind, long ago
+        with open(os.path.join(other_dir, "old-token"), "w") as token_file:
+            token_file.write("old-token.thumb")
+        journal = IssuanceJournal(os.path.join(state_dir, "journal.jsonl"))
+        journal.record("old-order", "provisioned", domain="old.example", token="old-token", acme_dir=other_dir)
+        journal.record("old-order", "failed", error="killed")
+
+        def session():
+            return acme_tiny.AcmeSession(account_key, CA=ca.base_url, log=LOGGER, state_dir=state_dir,
+                check_nodes=["http://127.0.0.1:{0}".format(port)])
+        try:
+            acme = session()
+            try:
+                self.assertRaises(ValueError, acme.issue, ["a.example"], acme_dir, poll_timeout=0.5)
+            finally:
+                acme.close()
+            steps = [r["step"] for r in journal._records() if r["order"] != "old-order"]
+            self.assertIn("triggered", steps)
+            self.assertIn("failed", steps)
+            ca.reset_stats()
+            acme = session()
+            try:
+                key_pem, cert_pem = acme.issue(["a.example"], acme_dir)
+            finally:
+                acme.close()
+            stats = ca.stats()
+            # the pending challenge was polled to the end, not requested or triggered again
+            self.assertEqual(stats.get("POST /acme/new-authz"), None)
+            self.assertEqual(stats.get("POST /acme/challenge"), None)
+            self.assertEqual(stats.get("POST /acme/new-cert"), 1)
+            self.assertEqual(os.listdir(acme_dir), [])
+            self.assertEqual(os.listdir(other_dir), [])
+            self.assertEqual(journal.stale_tokens(grace=0), [])
+        finally:
+            ca.stop()
+            server.shutdown()
+            server.server_close()
+
+if __name__ == "__main__": # pragma: no cover
+    unittest.main()
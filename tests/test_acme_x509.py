@@ -0,0 +1,103 @@
+import os, re, ssl, unittest
+import acme_keys
+from acme_asn1 import pem_blocks
+from acme_x509 import load_certificate, load_csr, parse_csr, read_der
+from tests.util import TempDirTestCase, openssl
+
+
+def openssl_date(text):
+    """seconds since the epoch of an `openssl x509 -enddate` style date"""
+    return ssl.cert_time_to_seconds(text.strip())
+
+
+class CertificateTest(TempDirTestCase):
+    """parse_certificate() agrees with what `openssl x509` says about the same certificates"""
+
+    @classmethod
+    def setUpClass(cls):
+        TempDirTestCase.setUpClass()
+        cls.key = os.path.join(cls.tmp, "key.pem")
+        openssl("genpkey", "-algorithm", "EC", "-pkeyopt", "ec_paramgen_curve:P-256", "-out", cls.key)
+
+    def make_certificate(self, name, days, *addext):
+        path = os.path.join(self.tmp, name)
+        args = ["req", "-x509", "-new", "-key", self.key, "-subj", "/O=Test/CN=test.example", "-days", str(days),
+            "-out", path]
+        for ext in addext:
+            args.extend(["-addext", ext])
+        openssl(*args)
+        return path
+
+    def check_against_openssl(self, path):
+        der, fields = load_certificate(path)
+        serial = openssl("x509", "-in", path, "-noout", "-serial").decode('ascii').strip().split("=", 1)[1]
+        self.assertEqual(fields["serial"], serial.lower().lstrip("0") or "0")
+        for option, field in (("-startdate", "not_before"), ("-enddate", "not_after")):
+            date = openssl("x509", "-in", path, "-noout", option).decode('ascii').split("=", 1)[1]
+            self.assertEqual(fields[field], openssl_date(date))
+        self.assertEqual(fields["issuer"], "test.example")
+        return fields
+
+    def test_names(self):
+        path = self.make_certificate("sans.crt", 90, "subjectAltName=DNS:a.example,DNS:b.example,IP:127.0.0.1")
+        fields = self.check_against_openssl(path)
+        self.assertEqual(fields["common_names"], ["test.example"])
+        self.assertEqual(fields["domains"], ["a.example", "b.example", "test.example"])
+        self.assertEqual(fields["ocsp_urls"], [])
+
+    def test_generalized_time_after_2049(self):
+        # openssl switches notAfter to GeneralizedTime after 2049
+        path = self.make_certificate("long.crt", 40 * 366)
+        fields = self.check_against_openssl(path)
+        self.assertTrue(fields["not_after"] > 2524608000)
+
+    def test_authority_info_access(self):
+        path = self.make_certificate("aia.crt", 90, "authorityInfoAccess=OCSP;URI:http://ocsp.example/,"
+            "caIssuers;URI:http://ca.example/issuer.der")
+        fields = self.check_against_openssl(path)
+        self.assertEqual(fields["ocsp_urls"], ["http://ocsp.example/"])
+        self.assertEqual(fields["ca_issuers"], ["http://ca.example/issuer.der"])
+
+    def test_der_file(self):
+        pem = self.make_certificate("pem.crt", 90)
+        der = os.path.join(self.tmp, "cert.der")
+        openssl("x509", "-in", pem, "-outform", "DER", "-out", der)
+        self.assertEqual(load_certificate(der), load_certificate(pem))
+
+    def test_malformed(self):
+        path = os.path.join(self.tmp, "bad.crt")
+        with open(path, "wb") as bad_file:
+            bad_file.write(b"-----BEGIN CERTIFICATE-----\nMAMCAQE=\n-----END CERTIFICATE-----\n")
+        self.assertRaises(IOError, load_certificate, path)
+        self.assertRaises(ValueError, read_der, self.key, ("CERTIFICATE",))
+
+
+class CsrTest(TempDirTestCase):
+    """parse_csr() reads openssl's CSRs, and openssl accepts the ones acme_keys builds"""
+
+    def test_openssl_csr(self):
+        key, csr = os.path.join(self.tmp, "rsa.key"), os.path.join(self.tmp, "rsa.csr")
+        openssl("genrsa", "-out", key, "2048")
+        openssl("req", "-new", "-key", key, "-subj", "/CN=www.example", "-addext",
+            "subjectAltName=DNS:www.example,DNS:example,DNS:*.example", "-out", csr)
+        der, domains = load_csr(csr)
+        self.assertEqual(domains, set(["www.example", "example", "*.example"]))
+        with open(csr) as csr_file:
+            self.assertEqual(der, next(pem_blocks(csr_file.read()))[2])
+
+    def test_common_name_only(self):
+        key, csr = os.path.join(self.tmp, "cn.key"), os.path.join(self.tmp, "cn.csr")
+        openssl("genrsa", "-out", key, "2048")
+        openssl("req", "-new", "-key", key, "-subj", "/CN=only.example", "-out", csr)
+        self.assertEqual(load_csr(csr)[1], set(["only.example"]))
+
+    def test_make_csr(self):
+        for key_type in ("rsa:2048", "ec:p256"):
+            pem = acme_keys.generate_key(key_type)
+            der = acme_keys.make_csr(pem, ["one.example", "two.example"])
+            self.assertEqual(parse_csr(der), (["one.example"], ["one.example", "two.example"]))
+            text = openssl("req", "-inform", "DER", "-noout", "-verify", "-text", data=der).decode('ascii')
+            self.assertEqual(re.findall(r"DNS:([\w.]+)", text), ["one.example", "two.example"])
+
+if __name__ == "__main__": # pragma: no cover
+    unittest.main()
@@ -0,0 +1,18 @@
+import os, sys, unittest
+import bench_acme
+
+
+class BenchTest(unittest.TestCase):
+    """one round of every client against the mock CA, challenges on a free port instead of port 80"""
+
+    def test_every_client(self):
+        stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+        try:
+            status = bench_acme.main(["--http-port", "0", "--sizes", "1,3", "--repeat", "1", "--baseline", ""])
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        self.assertEqual(status, 0)
+
+if __name__ == "__main__": # pragma: no cover
+    unittest.main()
@@ -0,0 +1,77 @@
+import logging, os, threading, unittest
+import client_for_boulder
+from acme_http import HTTPSession
+from acme_mockca import MockCA
+from acme_x509 import parse_certificate, read_der
+from bench_acme import _DirectoryResponder
+from tests.util import TempDirTestCase, openssl
+
+
+class IssueTest(TempDirTestCase):
+    """client_for_boulder issues against the mock CA with RSA, P-256 and P-384 account keys"""
+
+    @classmethod
+    def setUpClass(cls):
+        TempDirTestCase.setUpClass()
+        client_for_boulder.LOGGER.setLevel(logging.WARNING)
+        cls.acme_dir = os.path.join(cls.tmp, "acme-challenge")
+        os.mkdir(cls.acme_dir)
+        domain_key, cls.csr = os.path.join(cls.tmp, "domain.key"), os.path.join(cls.tmp, "domain.csr")
+        openssl("genrsa", "-out", domain_key, "2048")
+        openssl("req", "-new", "-key", domain_key, "-subj", "/CN=a.example", "-addext",
+            "subjectAltName=DNS:a.example,DNS:b.example", "-out", cls.csr)
+        cls.responder = _DirectoryResponder(cls.acme_dir, ("127.0.0.1", 0)).start()
+        port = cls.responder.server_address[1]
+        cls.ca = MockCA(http_port=port, validation_host="127.0.0.1").start()
+        cls.check_nodes = ["http://127.0.0.1:{0}".format(port)]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.ca.stop()
+        cls.responder.stop()
+        TempDirTestCase.tearDownClass()
+
+    def issue(self, key_args, backend):
+        key = os.path.join(self.tmp, "account.key")
+        openssl("genpkey", *(key_args + ["-out", key]))
+        pem = client_for_boulder.get_crt(key, self.csr, self.acme_dir, CA=self.ca.base_url, signer_backend=backend,
+            check_nodes=self.check_nodes)
+        path = os.path.join(self.tmp, "signed.crt")
+        with open(path, "w") as cert_file:
+            cert_file.write(pem)
+        self.assertEqual(parse_certificate(read_der(path, ("CERTIFICATE",)))["domains"], ["a.example", "b.example"])
+        self.assertEqual(os.listdir(self.acme_dir), [])
+
+    def test_rsa(self):
+        for backend in ("auto", "python", "openssl"):
+            self.issue(["-algorithm", "RSA", "-pkeyopt", "rsa_keygen_bits:2048"], backend)
+
+    def test_ec(self):
+        for curve in ("P-256", "P-384"):
+            for backend in ("auto", "python", "openssl"):
+                self.issue(["-algorithm", "EC", "-pkeyopt", "ec_paramgen_curve:" + curve], backend)
+
+    def test_failure_cleans_up(self):
+        key = os.path.join(self.tmp, "failing.key")
+        openssl("genpkey", "-algorithm", "EC", "-pkeyopt", "ec_paramgen_curve:P-256", "-out", key)
+        sessions = []
+        class RecordingSession(HTTPSession):
+            def close(self):
+                sessions.append(self)
+                HTTPSession.close(self)
+        ca = MockCA(http_port=self.responder.server_address[1], validation_host="127.0.0.1", invalid_rate=1.0).start()
+        client_for_boulder.HTTPSession = RecordingSession
+        try:
+            with self.assertRaises(ValueError) as raised:
+                client_for_boulder.get_crt(key, self.csr, self.acme_dir, CA=ca.base_url, nonce_prefetch=2,
+                    check_nodes=self.check_nodes)
+        finally:
+            client_for_boulder.HTTPSession = HTTPSession
+            ca.stop()
+        self.assertIn("did not pass", str(raised.exception))
+        self.assertEqual(len(sessions), 1)
+        self.assertNotIn("nonce-prefetch", [thread.name for thread in threading.enumerate()])
+        self.assertEqual(os.listdir(self.acme_dir), [])
+
+if __name__ == "__main__": # pragma: no cover
+    unittest.main()
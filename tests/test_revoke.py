@@ -0,0 +1,96 @@
+import glob, logging, os, sys, unittest
+import acme_tiny, revoke
+from acme_asn1 import pem_blocks
+from acme_http import HTTPSession
+from acme_mockca import MockCA
+from acme_responder import ChallengeResponder
+from tests.util import TempDirTestCase, openssl
+try:
+    from StringIO import StringIO # Python 2
+except ImportError:
+    from io import StringIO # Python 3
+
+LOGGER = logging.getLogger(__name__)
+
+
+class RevokeTestCase(TempDirTestCase):
+    """two certificates from a mock CA, the second one revoked already"""
+
+    def setUp(self):
+        responder = ChallengeResponder(("127.0.0.1", 0)).start()
+        self.addCleanup(responder.stop)
+        port = responder.server_address[1]
+        self.ca = MockCA(http_port=port, validation_host="127.0.0.1").start()
+        self.addCleanup(self.ca.stop)
+        self.account_key = os.path.join(self.tmp, "account.key")
+        openssl("genrsa", "-out", self.account_key, "2048")
+        acme = acme_tiny.AcmeSession(self.account_key, CA=self.ca.base_url, log=LOGGER, responder=responder,
+            check_nodes=["http://127.0.0.1:{0}".format(port)])
+        try:
+            self.certs = []
+            for domain in ("a.example", "b.example"):
+                key_pem, cert_pem = acme.issue([domain])
+                path = os.path.join(self.tmp, domain + ".crt")
+                with open(path, "w") as cert_file:
+                    cert_file.write(cert_pem)
+                self.certs.append(path)
+            # someone got to the last one before this run
+            self.assertTrue(acme.revoke(next(pem_blocks(cert_pem))[2]))
+        finally:
+            acme.close()
+
+    def run_main(self, *certificates):
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            code = revoke.main(["--account-key", self.account_key, "--ca", self.ca.base_url, "--quiet"]
+                + list(certificates))
+            return code, sys.stdout.getvalue().splitlines()[-1]
+        finally:
+            sys.stdout = stdout
+
+
+class BatchTest(RevokeTestCase):
+    """the batch summary tells this run's revocations from earlier ones and from failures"""
+
+    def test_already_revoked(self):
+        self.assertEqual(self.run_main(*self.certs), (0, "1 revoked, 1 already revoked, 0 failed"))
+
+    def test_failure(self):
+        missing = os.path.join(self.tmp, "missing.crt")
+        self.assertEqual(self.run_main(missing, *self.certs), (1, "1 revoked, 1 already revoked, 1 failed"))
+
+
+class ManualTest(RevokeTestCase):
+    """the interactive revocation, with the operator's signing step done by openssl"""
+
+    def sign_by_hand(self, prompt):
+        request, = glob.glob("revoke_*.json")
+        signature, = glob.glob("revoke_*.sig")
+        openssl("dgst", "-sha256", "-sign", self.account_key, "-out", signature, request)
+
+    def test_revoke_certificate(self):
+        public_key = os.path.join(self.tmp, "account.pub")
+        openssl("rsa", "-in", self.account_key, "-pubout", "-out", public_key)
+        sessions = []
+        class RecordingSession(HTTPSession):
+            def close(self):
+                sessions.append(self)
+                HTTPSession.close(self)
+        cwd, stderr, original_input = os.getcwd(), sys.stderr, vars(revoke).get("input")
+        os.chdir(self.tmp)
+        revoke.input, revoke.HTTPSession, sys.stderr = self.sign_by_hand, RecordingSession, StringIO()
+        try:
+            revoke.revoke_certificate(public_key, self.certs[0], CA=self.ca.base_url)
+            self.assertIn("Certificate revoked!", sys.stderr.getvalue())
+        finally:
+            os.chdir(cwd)
+            if original_input is None:
+                del revoke.input
+            else:
+                revoke.input = original_input
+            revoke.HTTPSession, sys.stderr = HTTPSession, stderr
+        self.assertEqual(len(sessions), 1)
+        self.assertEqual(self.run_main(*self.certs[:1]), (0, "0 revoked, 1 already revoked, 0 failed"))
+
+if __name__ == "__main__": # pragma: no cover
+    unittest.main()
@@ -0,0 +1,24 @@
+# helpers shared by the tests: a scratch directory and the openssl command line to check against
+import shutil, subprocess, tempfile, unittest
+
+
+def openssl(*args, **kwargs):
+    """output of an openssl command, stdin from `data`"""
+    proc = subprocess.Popen(["openssl"] + list(args), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    out, err = proc.communicate(kwargs.get("data"))
+    if proc.returncode != 0:
+        raise IOError("openssl {0} failed: {1}".format(" ".join(args), err))
+    return out
+
+
+class TempDirTestCase(unittest.TestCase):
+    """a scratch directory per test class, in self.tmp"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp(prefix="acme_test_")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp)